@@ -0,0 +1,137 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import update
+
+import models
+import notification_writer
+from database import SessionLocal
+from utils import ist_now
+
+# Users are warned when their subscription ends within this many days
+SUBSCRIPTION_EXPIRY_DAYS = int(os.getenv("SUBSCRIPTION_EXPIRY_DAYS", "7"))
+
+# Balance below which users get a low-balance alert
+LOW_BALANCE_THRESHOLD = float(os.getenv("LOW_BALANCE_THRESHOLD", "10.0"))
+
+# A user gets at most one low-balance alert per window
+LOW_BALANCE_ALERT_WINDOW = timedelta(hours=int(os.getenv("LOW_BALANCE_ALERT_HOURS", "24")))
+
+# How often the alert jobs run (in seconds)
+ALERT_INTERVAL_SECONDS = int(os.getenv("ALERT_INTERVAL_SECONDS", str(60 * 60)))
+
+# Users per IN (...) list when looking for already sent alerts
+_CHUNK_SIZE = 500
+
+def _already_notified(db, user_ids, notification_type, since):
+    # Routed to the shards of the users by the user_id IN (...) criteria
+    notified = set()
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), _CHUNK_SIZE):
+        notified.update(user_id for (user_id,) in db.query(models.Notification.user_id).filter(
+            models.Notification.user_id.in_(user_ids[i:i + _CHUNK_SIZE]),
+            models.Notification.type == notification_type,
+            models.Notification.created_at >= since
+        ).distinct())
+    return notified
+
+def _send(rows):
+    if rows:
+        notification_writer.write_notifications(rows)
+    return len(rows)
+
+def expire_subscriptions(db=None):
+    """
+    Flip every active subscription whose end date has passed to expired
+
+    Returns:
+        int: Number of users updated
+    """
+    close = db is None
+    db = db or SessionLocal()
+    try:
+        result = db.execute(
+            update(models.User)
+            .where(
+                models.User.subscription_status == models.SubscriptionStatus.ACTIVE,
+                models.User.subscription_end_date < ist_now()
+            )
+            .values(subscription_status=models.SubscriptionStatus.EXPIRED)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        if close:
+            db.close()
+
+def notify_expiring_subscriptions(db=None):
+    """
+    Send one SUBSCRIPTION_EXPIRING notification to every active user whose
+    subscription ends within SUBSCRIPTION_EXPIRY_DAYS
+
+    Returns:
+        int: Number of notifications sent
+    """
+    close = db is None
+    db = db or SessionLocal()
+    try:
+        now = ist_now()
+        window = timedelta(days=SUBSCRIPTION_EXPIRY_DAYS)
+        users = db.query(models.User.id, models.User.subscription_end_date).filter(
+            models.User.subscription_end_date >= now,
+            models.User.subscription_end_date < now + window,
+            models.User.subscription_status == models.SubscriptionStatus.ACTIVE
+        ).all()
+        notified = _already_notified(db, (user_id for user_id, _ in users), models.NotificationType.SUBSCRIPTION_EXPIRING, now - window)
+        return _send([
+            {
+                "user_id": user_id,
+                "message": f"Your subscription expires on {end_date:%d %b %Y}. Renew it to keep your plan benefits.",
+                "type": models.NotificationType.SUBSCRIPTION_EXPIRING.value,
+                "is_read": False,
+                "created_at": now
+            }
+            for user_id, end_date in users if user_id not in notified
+        ])
+    finally:
+        if close:
+            db.close()
+
+def notify_low_balances(db=None):
+    """
+    Send a BALANCE_LOW notification to every user below LOW_BALANCE_THRESHOLD
+    who has not had one within LOW_BALANCE_ALERT_WINDOW
+
+    Returns:
+        int: Number of notifications sent
+    """
+    close = db is None
+    db = db or SessionLocal()
+    try:
+        now = ist_now()
+        user_ids = [user_id for (user_id,) in db.query(models.User.id).filter(
+            models.User.current_balance < LOW_BALANCE_THRESHOLD,
+            models.User.subscription_status != models.SubscriptionStatus.CANCELED
+        )]
+        notified = _already_notified(db, user_ids, models.NotificationType.BALANCE_LOW, now - LOW_BALANCE_ALERT_WINDOW)
+        return _send([
+            {
+                "user_id": user_id,
+                "message": "Your account balance is running low. Please recharge to continue using toll services.",
+                "type": models.NotificationType.BALANCE_LOW.value,
+                "is_read": False,
+                "created_at": now
+            }
+            for user_id in user_ids if user_id not in notified
+        ])
+    finally:
+        if close:
+            db.close()
+
+def run_alert_jobs():
+    """Expire ended subscriptions, then send expiry and low-balance alerts"""
+    expired = expire_subscriptions()
+    expiring = notify_expiring_subscriptions()
+    low_balance = notify_low_balances()
+    return {"expired": expired, "expiring": expiring, "low_balance": low_balance}
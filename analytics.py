@@ -0,0 +1,234 @@
+import glob
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import archive
+import models
+import traffic_rollups
+from database import scatter_gather, GLOBAL_SHARD
+
+HOURS_PER_DAY = 24
+
+# Hours whose throughput exceeds mean + PEAK_STD_FACTOR * std of the plaza's
+# hourly curve are reported as peaks
+PEAK_STD_FACTOR = 1.0
+
+TRANSACTION_DTYPE = np.dtype([("toll_plaza_id", "i8"), ("vehicle_id", "i8"), ("amount", "f8"), ("ts", "i8")])
+# Traffic rows are raw samples (samples = 1) or hourly rollup buckets, whose
+# vehicle_count and average_wait_time hold the sums over their samples
+TRAFFIC_DTYPE = np.dtype([("toll_plaza_id", "i8"), ("vehicle_count", "f8"), ("average_wait_time", "f8"), ("samples", "f8"), ("ts", "i8")])
+
+# Timestamps are fetched as epoch seconds so that bucketing is integer arithmetic
+_TRANSACTIONS_SQL = """
+    SELECT toll_plaza_id, vehicle_id, amount, CAST(strftime('%s', timestamp) AS INTEGER)
+    FROM transactions
+    WHERE transaction_type = ? AND status = ? AND timestamp >= ? AND timestamp < ?
+"""
+
+_TRAFFIC_HOURLY_SQL = """
+    SELECT toll_plaza_id, vehicle_count_sum, wait_sum, samples, CAST(strftime('%s', bucket) AS INTEGER)
+    FROM traffic_aggregates
+    WHERE resolution = 3600 AND bucket >= ? AND bucket < ?
+"""
+
+# Raw samples that the rollup job has not reached yet
+_TRAFFIC_RAW_SQL = """
+    SELECT toll_plaza_id, vehicle_count, average_wait_time, 1, CAST(strftime('%s', timestamp) AS INTEGER)
+    FROM traffic_data
+    WHERE timestamp >= ? AND timestamp < ? AND id > ?
+"""
+
+def _fetch_array(conn, sql, params, dtype):
+    # Plain DBAPI tuples convert to a structured array without building ORM objects
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return np.array(cursor.fetchall(), dtype=dtype)
+    finally:
+        cursor.close()
+
+def _archivable_ids(conn, table_name, start, end):
+    # Rows of archivable months still in the database, which a failed or
+    # running archive run may have put in their partition too
+    cutoff = archive.archive_cutoff()
+    if start >= cutoff:
+        return np.empty(0, dtype="i8")
+    sql = f"SELECT id FROM {table_name} WHERE timestamp >= ? AND timestamp < ?"
+    return _fetch_array(conn, sql, (start.isoformat(" "), min(end, cutoff).isoformat(" ")), np.dtype([("id", "i8")]))["id"]
+
+def _read_archived(table_name, start, end, columns, dtype, skip_ids=None):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    paths = []
+    month = archive.month_start(start.year, start.month)
+    while month < end:
+        if archive.is_archived_month(month.year, month.month):
+            name = f"{month.year:04d}-{month.month:02d}.parquet"
+            paths += glob.glob(os.path.join(archive.ARCHIVE_DIR, table_name, name))
+            paths += glob.glob(os.path.join(archive.ARCHIVE_DIR, table_name, "*", name))
+        month = archive.next_month_start(month)
+    if not paths:
+        return np.empty(0, dtype=dtype)
+
+    dataset = ds.dataset(paths, format="parquet")
+    condition = (ds.field("timestamp") >= pa.scalar(start, pa.timestamp("us"))) & (ds.field("timestamp") < pa.scalar(end, pa.timestamp("us")))
+    if table_name == models.Transaction.__tablename__:
+        condition = condition & (ds.field("transaction_type") == models.TransactionType.TOLL_PAYMENT.value) & (ds.field("status") == models.TransactionStatus.COMPLETED.value)
+    table = dataset.to_table(columns=columns + ["timestamp", "id"], filter=condition)
+    if skip_ids is not None and len(skip_ids):
+        table = table.filter(pc.invert(pc.is_in(table["id"], value_set=pa.array(skip_ids, type=pa.int64()))))
+
+    result = np.empty(table.num_rows, dtype=dtype)
+    for name in columns:
+        result[name] = table[name].to_numpy()
+    result["ts"] = pc.cast(table["timestamp"], pa.int64()).to_numpy() // 1_000_000
+    return result
+
+def load_transactions(start, end):
+    """Load completed toll payments in ``[start, end)`` from every shard and the archive"""
+    params = (models.TransactionType.TOLL_PAYMENT.value, models.TransactionStatus.COMPLETED.value, start.isoformat(" "), end.isoformat(" "))
+    table_name = models.Transaction.__tablename__
+    parts = scatter_gather(lambda db: _fetch_array(db.connection(), _TRANSACTIONS_SQL, params, TRANSACTION_DTYPE))
+    # Ids are unique across shards
+    in_db = np.concatenate(scatter_gather(lambda db: _archivable_ids(db.connection(), table_name, start, end)))
+    parts.append(_read_archived(table_name, start, end, ["toll_plaza_id", "vehicle_id", "amount"], TRANSACTION_DTYPE, in_db))
+    return np.concatenate(parts)
+
+def load_traffic(db: Session, start, end):
+    """
+    Load traffic in ``[start, end)`` from the hourly rollup, the raw samples
+    not rolled up yet and the traffic archived by earlier versions
+    """
+    conn = db.connection(bind_arguments={"shard_id": GLOBAL_SHARD})
+    bounds = (start.isoformat(" "), end.isoformat(" "))
+    watermark = db.query(models.JobWatermark.value).filter(models.JobWatermark.name == traffic_rollups.WATERMARK).scalar() or 0
+    hourly = _fetch_array(conn, _TRAFFIC_HOURLY_SQL, bounds, TRAFFIC_DTYPE)
+    live = _fetch_array(conn, _TRAFFIC_RAW_SQL, bounds + (watermark,), TRAFFIC_DTYPE)
+    in_db = _archivable_ids(conn, models.TrafficData.__tablename__, start, end)
+    archived = _read_archived(models.TrafficData.__tablename__, start, end, ["toll_plaza_id", "vehicle_count", "average_wait_time"], TRAFFIC_DTYPE, in_db)
+    archived["samples"] = 1
+    return np.concatenate([hourly, live, archived])
+
+def _vehicle_type_codes(db: Session, vehicle_ids):
+    vehicles = db.query(models.Vehicle.id, models.Vehicle.vehicle_type).order_by(models.Vehicle.id).all()
+    type_names = [vehicle_type.value for vehicle_type in models.VehicleType]
+    known_ids = np.array([vehicle_id for vehicle_id, _ in vehicles], dtype="i8")
+    known_codes = np.array([type_names.index(vehicle_type) if vehicle_type in type_names else type_names.index("other") for _, vehicle_type in vehicles], dtype="i8")
+
+    # Vectorized join of transactions to vehicle types
+    codes = np.full(len(vehicle_ids), type_names.index("other"), dtype="i8")
+    if len(known_ids):
+        positions = np.clip(np.searchsorted(known_ids, vehicle_ids), 0, len(known_ids) - 1)
+        found = known_ids[positions] == vehicle_ids
+        codes[found] = known_codes[positions[found]]
+    return codes, type_names
+
+def summarize_plazas(plaza_ids, transactions, vehicle_type_codes, type_names, traffic):
+    """
+    Compute per-plaza revenue, hourly curves, vehicle mix and peaks
+
+    Args:
+        plaza_ids (np.ndarray): Ids of the plazas to report on
+        transactions (np.ndarray): Array of TRANSACTION_DTYPE
+        vehicle_type_codes (np.ndarray): Index into ``type_names`` per transaction
+        type_names (list): Vehicle type names
+        traffic (np.ndarray): Array of TRAFFIC_DTYPE
+
+    Returns:
+        list: One dict per plaza
+    """
+    plaza_ids = np.asarray(plaza_ids, dtype="i8")
+    n_plazas = len(plaza_ids)
+
+    # Row index of plaza ids by binary search over the sorted ids, so that
+    # memory follows the number of plazas rather than the largest id
+    order = np.argsort(plaza_ids, kind="stable")
+    sorted_ids = plaza_ids[order]
+
+    def plaza_index(ids):
+        if not n_plazas:
+            return np.full(len(ids), -1, dtype="i8"), np.zeros(len(ids), dtype=bool)
+        positions = np.clip(np.searchsorted(sorted_ids, ids), 0, n_plazas - 1)
+        found = sorted_ids[positions] == ids
+        return np.where(found, order[positions], -1), found
+
+    # Transactions: revenue, trips, hourly throughput and vehicle mix
+    tx_index, tx_valid = plaza_index(transactions["toll_plaza_id"])
+    tx_index, tx_hours = tx_index[tx_valid], (transactions["ts"][tx_valid] // 3600) % HOURS_PER_DAY
+    amounts, codes = transactions["amount"][tx_valid], vehicle_type_codes[tx_valid]
+
+    trips = np.bincount(tx_index, minlength=n_plazas)
+    revenue = np.bincount(tx_index, weights=amounts, minlength=n_plazas)
+    hourly_trips = np.bincount(tx_index * HOURS_PER_DAY + tx_hours, minlength=n_plazas * HOURS_PER_DAY).reshape(n_plazas, HOURS_PER_DAY)
+    hourly_revenue = np.bincount(tx_index * HOURS_PER_DAY + tx_hours, weights=amounts, minlength=n_plazas * HOURS_PER_DAY).reshape(n_plazas, HOURS_PER_DAY)
+    vehicle_mix = np.bincount(tx_index * len(type_names) + codes, minlength=n_plazas * len(type_names)).reshape(n_plazas, len(type_names))
+
+    # Traffic samples: average vehicle count and wait time per hour of day
+    tr_index, tr_valid = plaza_index(traffic["toll_plaza_id"])
+    tr_bins = tr_index[tr_valid] * HOURS_PER_DAY + (traffic["ts"][tr_valid] // 3600) % HOURS_PER_DAY
+    samples = np.bincount(tr_bins, weights=traffic["samples"][tr_valid], minlength=n_plazas * HOURS_PER_DAY)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_vehicles = np.bincount(tr_bins, weights=traffic["vehicle_count"][tr_valid], minlength=n_plazas * HOURS_PER_DAY) / samples
+        avg_wait = np.bincount(tr_bins, weights=traffic["average_wait_time"][tr_valid], minlength=n_plazas * HOURS_PER_DAY) / samples
+    avg_vehicles = np.nan_to_num(avg_vehicles).reshape(n_plazas, HOURS_PER_DAY)
+    avg_wait = np.nan_to_num(avg_wait).reshape(n_plazas, HOURS_PER_DAY)
+
+    # Peak detection on the hourly throughput curve of each plaza
+    curve = hourly_trips.astype("f8")
+    threshold = curve.mean(axis=1, keepdims=True) + PEAK_STD_FACTOR * curve.std(axis=1, keepdims=True)
+    peaks = (curve > threshold) & (curve > 0)
+
+    report = []
+    for i, plaza_id in enumerate(plaza_ids.tolist()):
+        report.append({
+            "toll_plaza_id": plaza_id,
+            "trips": int(trips[i]),
+            "revenue": float(revenue[i]),
+            "average_toll": float(revenue[i] / trips[i]) if trips[i] else 0,
+            "hourly_trips": hourly_trips[i].tolist(),
+            "hourly_revenue": hourly_revenue[i].round(2).tolist(),
+            "hourly_vehicle_count": avg_vehicles[i].round(2).tolist(),
+            "hourly_wait_time": avg_wait[i].round(2).tolist(),
+            "vehicle_type_mix": dict(zip(type_names, vehicle_mix[i].tolist())),
+            "peak_hours": np.flatnonzero(peaks[i]).tolist(),
+            "busiest_hour": int(curve[i].argmax()) if trips[i] else None
+        })
+    return report
+
+def get_plaza_analytics(db: Session, start_date, end_date):
+    """
+    Plaza-level revenue and throughput analytics over ``[start_date, end_date]``
+
+    Args:
+        db (Session): Database session
+        start_date (date): First day of the range
+        end_date (date): Last day of the range (inclusive)
+
+    Returns:
+        dict: Range and per-plaza analytics
+    """
+    start = datetime(start_date.year, start_date.month, start_date.day)
+    end = datetime(end_date.year, end_date.month, end_date.day) + timedelta(days=1)
+
+    plazas = db.query(models.TollPlaza.id, models.TollPlaza.name).order_by(models.TollPlaza.id).all()
+    transactions = load_transactions(start, end)
+    vehicle_type_codes, type_names = _vehicle_type_codes(db, transactions["vehicle_id"])
+    traffic = load_traffic(db, start, end)
+
+    report = summarize_plazas([plaza_id for plaza_id, _ in plazas], transactions, vehicle_type_codes, type_names, traffic)
+    names = dict(plazas)
+    for plaza in report:
+        plaza["toll_plaza_name"] = names[plaza["toll_plaza_id"]]
+
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "total_trips": int(len(transactions)),
+        "total_revenue": float(transactions["amount"].sum()),
+        "plazas": report
+    }
@@ -0,0 +1,189 @@
+import glob
+import os
+from datetime import datetime
+
+from sqlalchemy import select, delete, func, Integer, Float, String, DateTime, Boolean
+from sqlalchemy.types import TypeDecorator
+
+import models
+from database import shard_engines, shard_for_user, USER_SHARDS
+from utils import ist_now
+
+# Directory holding the archived monthly partitions
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Number of closed months kept in the database before being archived
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "3"))
+
+# How often the background archiver runs (in seconds)
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", str(24 * 60 * 60)))
+
+# Rows fetched from the database per Parquet write
+ARCHIVE_BATCH_SIZE = 50000
+
+def month_start(year, month):
+    """Return the first instant of a month"""
+    return datetime(year, month, 1)
+
+def next_month_start(dt):
+    """Return the first instant of the month following ``dt``"""
+    if dt.month == 12:
+        return datetime(dt.year + 1, 1, 1)
+    return datetime(dt.year, dt.month + 1, 1)
+
+def archive_cutoff():
+    """Return the start of the oldest month still kept in the database"""
+    now = ist_now()
+    months = now.year * 12 + (now.month - 1) - ARCHIVE_AFTER_MONTHS
+    return datetime(months // 12, months % 12 + 1, 1)
+
+def is_archived_month(year, month):
+    """Check whether a month has been moved out of the database"""
+    return month_start(year, month) < archive_cutoff()
+
+def partition_path(table_name, year, month, shard_id=None):
+    """Return the Parquet file holding one monthly partition of a table"""
+    parts = [ARCHIVE_DIR, table_name] + ([shard_id] if shard_id else []) + [f"{year:04d}-{month:02d}.parquet"]
+    return os.path.join(*parts)
+
+def arrow_schema(table):
+    """Build an Arrow schema matching the columns of a SQLAlchemy table"""
+    import pyarrow as pa
+
+    arrow_types = {
+        Integer: pa.int64(),
+        Float: pa.float64(),
+        String: pa.string(),
+        DateTime: pa.timestamp("us"),
+        Boolean: pa.bool_(),
+    }
+    fields = []
+    for column in table.columns:
+        column_type = column.type.impl if isinstance(column.type, TypeDecorator) else column.type
+        arrow_type = next((t for sql_type, t in arrow_types.items() if isinstance(column_type, sql_type)), pa.string())
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+def rows_to_record_batch(rows, schema):
+    """Transpose a list of DB rows into an Arrow record batch"""
+    import pyarrow as pa
+
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+def _archive_month(conn, table, start, end, path, sort_columns):
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(table)
+    in_month = (table.c.timestamp >= start) & (table.c.timestamp < end)
+    if conn.execute(select(table.c.id).where(in_month).limit(1)).first() is None:
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        # Rows that arrived after the month was first archived are appended.
+        # The partition is replaced before the delete commits, so when that
+        # commit failed it already holds rows still in the database: those
+        # are dropped from it and written again from the database.
+        if os.path.exists(path):
+            import pyarrow as pa
+            import pyarrow.compute as pc
+
+            archived = pq.read_table(path, schema=schema)
+            in_db = pa.array(conn.execute(select(table.c.id).where(in_month)).scalars().all(), type=pa.int64())
+            writer.write_table(archived.filter(pc.invert(pc.is_in(archived["id"], value_set=in_db))))
+        result = conn.execution_options(yield_per=ARCHIVE_BATCH_SIZE).execute(
+            select(*table.columns).where(in_month).order_by(*sort_columns)
+        )
+        for rows in result.partitions():
+            writer.write_batch(rows_to_record_batch(rows, schema))
+
+    os.replace(tmp_path, path)
+    conn.execute(delete(table).where(in_month))
+    return True
+
+def _archive_table(db_engine, table, sort_columns, shard_id=None):
+    cutoff = archive_cutoff()
+    with db_engine.execution_options(sqlite_immediate=True).begin() as conn:
+        oldest = conn.execute(select(func.min(table.c.timestamp)).where(table.c.timestamp < cutoff)).scalar()
+        if oldest is None:
+            return 0
+
+        archived = 0
+        start = month_start(oldest.year, oldest.month)
+        while start < cutoff:
+            end = next_month_start(start)
+            if _archive_month(conn, table, start, end, partition_path(table.name, start.year, start.month, shard_id), sort_columns):
+                archived += 1
+            start = end
+        return archived
+
+def archive_closed_months():
+    """
+    Move closed months of transactions out of the database into compressed
+    Parquet partitions. Raw traffic data is not archived any more: it is
+    rolled up and dropped by traffic_rollups.py. Traffic partitions written
+    before are still read by analytics.
+
+    Returns:
+        int: Number of monthly partitions written
+    """
+    transactions = models.Transaction.__table__
+
+    archived = 0
+    for shard_id in USER_SHARDS:
+        archived += _archive_table(
+            shard_engines[shard_id],
+            transactions,
+            [transactions.c.user_id, transactions.c.timestamp],
+            shard_id
+        )
+    return archived
+
+def _read_transactions(paths, condition, skip_ids=None):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    if not paths:
+        return []
+    table = ds.dataset(paths, format="parquet").to_table(filter=condition)
+    if skip_ids:
+        table = table.filter(pc.invert(pc.is_in(table["id"], value_set=pa.array(list(skip_ids), type=pa.int64()))))
+    return [models.Transaction(**row) for row in table.to_pylist()]
+
+def find_archived_transaction(transaction_id):
+    """
+    Look a transaction up in the archived partitions of every shard
+
+    Returns:
+        Transaction: Transient object (not attached to a session), or None
+    """
+    import pyarrow.dataset as ds
+
+    table_name = models.Transaction.__tablename__
+    paths = glob.glob(os.path.join(ARCHIVE_DIR, table_name, "*", "*.parquet"))
+    transactions = _read_transactions(paths, ds.field("id") == transaction_id)
+    return transactions[0] if transactions else None
+
+def read_archived_transactions(user_id, skip_ids=None):
+    """
+    Read a user's archived transactions, month by month in time order
+
+    Args:
+        user_id (int): User
+        skip_ids (set): Ids still in the database, left out
+
+    Returns:
+        list: Transient Transaction objects (not attached to a session)
+    """
+    import pyarrow.dataset as ds
+
+    table_name = models.Transaction.__tablename__
+    paths = sorted(glob.glob(os.path.join(ARCHIVE_DIR, table_name, shard_for_user(user_id), "*.parquet")))
+    return _read_transactions(paths, ds.field("user_id") == user_id, skip_ids)
@@ -1,13 +1,15 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 import schemas
-from database import get_db
+from database import get_db, SessionLocal, WriteSession
 from models import User
 from utils import get_ist_now
 
@@ -16,6 +18,9 @@ SECRET_KEY = "a_very_secure_secret_key_that_should_be_in_environment_variables"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Comma separated emails of the users allowed to use admin-only tools
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -50,8 +55,35 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Get current user from token
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Decode a token without touching the database; None when it is invalid
+def get_token_subject(token: str):
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+def is_admin_email(email: Optional[str]):
+    return email is not None and email.lower() in ADMIN_EMAILS
+
+# Load a user by email. On write requests the first query of the session
+# takes the database write lock (see get_db), which must be taken in the
+# endpoint's own threadpool call: taken here, it would be held while the
+# endpoint waits for a thread, and requests waiting for the lock in every
+# other thread would never let it have one. The user is therefore read with a
+# session of its own and attached to the write session without a query.
+def _load_user(db: Session, email: str):
+    if not isinstance(db, WriteSession):
+        return db.query(User).filter(User.email == email).first()
+    read_db = SessionLocal()
+    try:
+        user = read_db.query(User).filter(User.email == email).first()
+        return db.merge(user, load=False) if user is not None else None
+    finally:
+        read_db.close()
+
+# Get current user from token. Sync so that FastAPI runs it in the threadpool
+# and the query does not block the event loop.
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -65,7 +97,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.email == token_data.email).first()
+    user = _load_user(db, token_data.email)
     if user is None:
         raise credentials_exception
     return user
@@ -74,4 +106,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if current_user.subscription_status == "canceled":
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user 
\ No newline at end of file
+    return current_user
+
+def _get_user_with_own_session(token: str):
+    db = SessionLocal()
+    try:
+        return get_current_user(token, db)
+    finally:
+        db.close()
+
+# Get current active user with a short-lived session, for long-lived responses
+# (notification streams, exports) that must not hold a pooled connection while
+# open. The query runs in the threadpool, off the event loop.
+async def get_current_streaming_user(token: str = Depends(oauth2_scheme)):
+    return await get_current_active_user(await run_in_threadpool(_get_user_with_own_session, token))
+
+# Get current user and require them to be listed in ADMIN_EMAILS
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    if not is_admin_email(current_user.email):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return current_user
@@ -0,0 +1,106 @@
+"""
+Concurrent charges and recharges for a handful of users
+
+Starts serve.sh on a fresh database and fires toll payments, deposits and
+withdrawals for a few users at once, in random order. Prints throughput,
+then checks that every balance equals the sum of the accepted operations
+and that no user's ledger went below zero at any point.
+
+Usage:
+    python benchmarks/balance_stress.py [--workers 4] [--users 5] [--ops 2000] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sqlite3
+import time
+
+import httpx
+
+import harness
+
+PORT = 8806
+BASE_URL = f"http://127.0.0.1:{PORT}"
+OPENING_BALANCE = 50.0
+# Amount of each operation; tolls and withdrawals fail once the balance is too low
+AMOUNTS = {"toll": -7.0, "recharge": 5.0, "withdraw": -3.0}
+
+def _setup(client, users):
+    accounts = []
+    for index in range(users):
+        headers = harness.sign_up(client, f"stress-{index}@example.com", balance=OPENING_BALANCE)
+        vehicle = client.post("/api/vehicles", json={
+            "license_plate": f"KA01AB{index:04d}", "vehicle_type": "car", "make": "-", "model": "-",
+            "year": 2020, "color": "-", "transponder_id": f"stress-{index}"
+        }, headers=headers)
+        vehicle.raise_for_status()
+        accounts.append((headers, vehicle.json()["id"]))
+    return accounts
+
+async def _run(accounts, ops, concurrency):
+    operations = [(user, random.choice(["toll", "toll", "recharge", "withdraw"])) for user in range(len(accounts)) for _ in range(ops)]
+    random.shuffle(operations)
+    statuses = collections.Counter()
+    accepted = collections.defaultdict(collections.Counter)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=BASE_URL, trust_env=False, timeout=120, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def run(user, kind):
+            headers, vehicle_id = accounts[user]
+            async with semaphore:
+                if kind == "toll":
+                    response = await client.post("/api/transactions", json={
+                        "vehicle_id": vehicle_id, "toll_plaza_id": 1, "amount": -AMOUNTS[kind], "transaction_type": "toll payment"
+                    }, headers=headers)
+                else:
+                    response = await client.post("/api/account-transactions", json={
+                        "amount": abs(AMOUNTS[kind]), "type": "deposit" if kind == "recharge" else "withdrawal"
+                    }, headers=headers)
+            statuses[(kind, response.status_code)] += 1
+            if response.status_code == 200:
+                accepted[user][kind] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[run(user, kind) for user, kind in operations])
+        seconds = time.perf_counter() - started
+        balances = [(await client.get("/api/users/me", headers=headers)).json()["current_balance"] for headers, _ in accounts]
+
+    print(f"{len(operations)} operations in {seconds:.1f} s = {len(operations) / seconds:.0f} ops/s")
+    print("Responses: " + ", ".join(f"{kind} {status}: {count}" for (kind, status), count in sorted(statuses.items())))
+    wrong = 0
+    for user, balance in enumerate(balances):
+        expected = OPENING_BALANCE + sum(AMOUNTS[kind] * count for kind, count in accepted[user].items())
+        if abs(balance - expected) > 1e-6:
+            wrong += 1
+            print(f"User {user}: balance {balance}, expected {expected}")
+    print("Balances match the accepted operations" if not wrong else f"{wrong} balances do not match")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--ops", type=int, default=2000, help="Operations per user")
+    parser.add_argument("--concurrency", type=int, default=64, help="Requests in flight")
+    args = parser.parse_args()
+    random.seed(1)
+
+    # Seeded for the toll plazas
+    harness.use_scratch_database(TOLLEASY_SEED_DATA="true")
+    with harness.serve(["bash", "serve.sh"], port=PORT, WEB_CONCURRENCY=args.workers):
+        with httpx.Client(base_url=BASE_URL, trust_env=False, timeout=120) as client:
+            accounts = _setup(client, args.users)
+        asyncio.run(_run(accounts, args.ops, args.concurrency))
+
+    # Running balance of every user after each ledger entry
+    with sqlite3.connect(os.environ["DATABASE_URL"][len("sqlite:///"):]) as conn:
+        below_zero = conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT SUM(amount_paise) OVER (PARTITION BY user_id ORDER BY id) AS balance FROM ledger_entries
+            ) WHERE balance < 0
+        """).fetchone()[0]
+    print(f"Ledger prefixes below zero: {below_zero}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Columnar export of a user's history against JSON paging
+
+Inserts toll payments for one user, then times GET /api/transactions/export
+as Arrow IPC and as Parquet, and /api/transactions pages of 100 rows at
+offsets spread over the history (extrapolated to the whole history). Runs
+in process through the test client. Also times the plain SQLite fetch of
+the rows.
+
+Usage:
+    python benchmarks/export.py [--rows 1000000] [--pages 40]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+from datetime import timedelta
+
+import harness
+
+PAGE_SIZE = 100
+INSERT_BATCH = 100000
+
+def _insert(user_id, rows):
+    import models
+    from database import engine
+    from utils import ist_now
+
+    start = ist_now().replace(microsecond=0) - timedelta(days=60)
+    for first in range(0, rows, INSERT_BATCH):
+        with engine.begin() as conn:
+            conn.execute(models.Transaction.__table__.insert(), [
+                {
+                    "user_id": user_id,
+                    "vehicle_id": 1,
+                    "toll_plaza_id": index % 50 + 1,
+                    "amount": 100.0,
+                    "timestamp": start + timedelta(seconds=index * 5),
+                    "status": models.TransactionStatus.COMPLETED.value,
+                    "transaction_type": models.TransactionType.TOLL_PAYMENT.value,
+                    "reference_id": f"export-{index}"
+                }
+                for index in range(first, min(first + INSERT_BATCH, rows))
+            ])
+
+def _download(client, headers, export_format):
+    size = 0
+    with client.stream("GET", "/api/transactions/export", params={"format": export_format}, headers=headers) as response:
+        response.raise_for_status()
+        for chunk in response.iter_bytes():
+            size += len(chunk)
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--pages", type=int, default=40, help="JSON pages timed")
+    args = parser.parse_args()
+
+    harness.use_scratch_database()
+    from fastapi.testclient import TestClient
+
+    import main as app_module
+
+    with TestClient(app_module.app) as client:
+        headers = harness.sign_up(client, "export@example.com")
+        user_id = client.get("/api/users/me", headers=headers).json()["id"]
+        _insert(user_id, args.rows)
+
+        for export_format in ("arrow", "parquet"):
+            size, seconds = harness.timed(_download, client, headers, export_format)
+            print(f"{export_format}: {args.rows} rows in {seconds:.1f} s ({args.rows / seconds:.0f} rows/s), {size / 2 ** 20:.0f} MB")
+
+        pages = -(-args.rows // PAGE_SIZE)
+        offsets = [page * PAGE_SIZE for page in range(0, pages, max(pages // args.pages, 1))][:args.pages]
+        page_seconds = statistics.mean(
+            harness.timed(client.get, "/api/transactions", params={"skip": offset, "limit": PAGE_SIZE}, headers=headers)[1]
+            for offset in offsets
+        )
+        print(f"JSON paging: {page_seconds * 1000:.1f} ms per page of {PAGE_SIZE}, about {page_seconds * pages:.0f} s "
+              f"for {pages} pages ({args.rows / (page_seconds * pages):.0f} rows/s)")
+
+    with sqlite3.connect(os.environ["DATABASE_URL"][len("sqlite:///"):]) as conn:
+        _, seconds = harness.timed(lambda: conn.execute("SELECT * FROM transactions WHERE user_id = ?", (user_id,)).fetchall())
+    print(f"Plain SQLite fetch of the rows: {seconds:.1f} s")
+
+if __name__ == "__main__":
+    main()
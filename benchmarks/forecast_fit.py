@@ -0,0 +1,117 @@
+"""
+Wait time forecast training time and accuracy
+
+Writes a year of synthetic hourly rollup buckets (a weekly profile per plaza
+plus autocorrelated noise) and times a full fit of forecasting's model, with
+and without the SQL read, and an incremental refresh. Then holds out the
+last week and compares the 60 minute forecast with the last value and with
+the weekly profile alone.
+
+Usage:
+    python benchmarks/forecast_fit.py [--plazas 50] [--days 365] [--raw-samples 1000]
+"""
+import argparse
+import calendar
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import harness
+
+HOUR = 3600
+
+def _synthetic(plazas, hours, rng):
+    # Wait time and vehicles per hour of every plaza and hour
+    hour_of_week = np.arange(hours) % 168
+    profile = 5 + 10 * rng.random((plazas, 1)) * (1 + np.sin(2 * np.pi * hour_of_week / 24))[None, :]
+    noise = np.zeros((plazas, hours))
+    for hour in range(1, hours):
+        noise[:, hour] = 0.9 * noise[:, hour - 1] + rng.normal(0, 1.5, plazas)
+    wait = np.maximum(profile + noise, 0)
+    return np.stack([wait, wait * 20], axis=-1)
+
+def _insert(values, start):
+    import models
+    from database import engine
+
+    plazas, hours, _ = values.shape
+    rows = [
+        {
+            "toll_plaza_id": plaza + 1,
+            "resolution": HOUR,
+            "bucket": start + timedelta(hours=hour),
+            "samples": 60,
+            "vehicle_count_sum": int(values[plaza, hour, 1] * 60),
+            "wait_sum": float(values[plaza, hour, 0] * 60),
+            "multiplier_sum": 60.0
+        }
+        for plaza in range(plazas) for hour in range(hours)
+    ]
+    with engine.begin() as conn:
+        conn.execute(models.TrafficAggregate.__table__.insert(), rows)
+    return rows
+
+def _insert_raw(count, plazas, at):
+    import models
+    from database import engine
+
+    with engine.begin() as conn:
+        conn.execute(models.TrafficData.__table__.insert(), [
+            {"toll_plaza_id": index % plazas + 1, "timestamp": at, "vehicle_count": 100, "average_wait_time": 5, "price_multiplier": 1.0}
+            for index in range(count)
+        ])
+
+def _holdout(forecasting, values, start_ts):
+    plazas, hours, _ = values.shape
+    train = hours - 168
+    plaza_ids = np.arange(1, plazas + 1)
+    model = forecasting.WaitTimeModel()
+    model.update(np.repeat(plaza_ids, train), np.tile(start_ts + np.arange(train) * HOUR, plazas), values[:, :train].reshape(-1, 2), np.ones(plazas * train))
+
+    errors = {"model": [], "last value": [], "weekly profile": []}
+    rows = model._rows(plaza_ids)
+    for hour in range(train, hours - 1):
+        ts = start_ts + hour * HOUR
+        model.update(plaza_ids, np.full(plazas, ts), values[:, hour], np.ones(plazas))
+        _, predictions = model.predict(ts, [60])
+        actual = values[:, hour + 1, 0]
+        errors["model"].append(np.abs(predictions[0, :, 0] - actual))
+        errors["last value"].append(np.abs(values[:, hour, 0] - actual))
+        errors["weekly profile"].append(np.abs(model.baseline(rows, np.full(plazas, forecasting.hour_of_week(ts + HOUR)))[:, 0] - actual))
+    return {name: float(np.mean(values)) for name, values in errors.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--plazas", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--raw-samples", type=int, default=1000, help="Samples added before the incremental refresh")
+    args = parser.parse_args()
+
+    harness.use_scratch_database()
+    import forecasting
+    from database import init_db
+
+    init_db()
+    hours = args.days * 24
+    start = datetime(2024, 1, 1)
+    start_ts = calendar.timegm(start.timetuple())
+    values = _synthetic(args.plazas, hours, np.random.default_rng(1))
+    rows = _insert(values, start)
+
+    model, seconds = harness.timed(forecasting.fit)
+    print(f"Full fit from SQLite: {len(rows)} hourly buckets, {len(model.plaza_ids)} plazas in {seconds:.2f} s")
+    plaza_ids = np.repeat(np.arange(1, args.plazas + 1), hours)
+    ts = np.tile(start_ts + np.arange(hours) * HOUR, args.plazas)
+    _, seconds = harness.timed(forecasting.WaitTimeModel().update, plaza_ids, ts, values.reshape(-1, 2), np.full(len(ts), 60.0))
+    print(f"NumPy part of the fit: {seconds:.2f} s")
+
+    forecasting.refresh_forecasts()
+    _insert_raw(args.raw_samples, args.plazas, start + timedelta(hours=hours))
+    _, seconds = harness.timed(forecasting.refresh_forecasts)
+    print(f"Incremental refresh with {args.raw_samples} new samples, forecasts stored: {seconds * 1000:.0f} ms")
+
+    errors = _holdout(forecasting, values, start_ts)
+    print("Hold-out last week, 60 min ahead, wait time MAE: " + ", ".join(f"{name} {error:.2f} min" for name, error in errors.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+
+# Repository root, so that the application modules import from any directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def use_scratch_database(shards=0, **env):
+    """
+    Point the application at a fresh database directory and make it
+    importable. The application reads its configuration when imported, so
+    call this before the first import of an application module.
+
+    Args:
+        shards (int): Number of shard database files (0 keeps everything on
+            the global database)
+        **env: Further environment variables to set
+
+    Returns:
+        str: The scratch directory
+    """
+    data_dir = tempfile.mkdtemp(prefix="tolleasy-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{data_dir}/tolleasy.db"
+    if shards:
+        os.environ["SHARD_DATABASE_URLS"] = ",".join(f"sqlite:///{data_dir}/shard_{index}.db" for index in range(shards))
+    os.environ["ARCHIVE_DIR"] = os.path.join(data_dir, "archive")
+    os.environ.setdefault("TOLLEASY_SEED_DATA", "false")
+    for limit in ("AUTH", "WRITE", "PUBLIC", "IP", "USER"):
+        os.environ.setdefault(f"RATE_LIMIT_{limit}", "100000000/1")
+    os.environ.update({name: str(value) for name, value in env.items()})
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return data_dir
+
+def timed(fn, *args, **kwargs):
+    """Run ``fn`` once and return its result and the elapsed seconds"""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def median_time(fn, repeat=5):
+    """Return the median elapsed seconds of ``repeat`` runs of ``fn``"""
+    return statistics.median(timed(fn)[1] for _ in range(repeat))
+
+def insert_users(count, balance=0.0):
+    """
+    Insert ``count`` users straight into the users table (no bcrypt hashing)
+
+    Returns:
+        list: Their ids
+    """
+    import models
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        users = [
+            models.User(email=f"bench-{index}@example.com", password_hash="-", name="Bench", current_balance=balance)
+            for index in range(count)
+        ]
+        db.add_all(users)
+        db.commit()
+        return [user.id for user in users]
+
+@contextmanager
+def serve(command, port=8801, **env):
+    """
+    Run an API server command (its own process group) against the scratch
+    database set up by use_scratch_database, and stop it on exit
+
+    Args:
+        command (list): Server command line, run from the repository root
+        port (int): Port the server listens on
+        **env: Further environment variables of the server
+
+    Yields:
+        subprocess.Popen: The server process, once it answers requests
+    """
+    data_dir = os.path.dirname(os.environ["DATABASE_URL"][len("sqlite:///"):])
+    server_env = dict(
+        os.environ,
+        PORT=str(port),
+        RATE_LIMIT_BACKEND=f"sqlite:///{data_dir}/ratelimit.db",
+        SCHEDULER_LOCK_FILE=os.path.join(data_dir, "scheduler.lock"),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(data_dir, "prometheus"),
+        **{name: str(value) for name, value in env.items()}
+    )
+    os.makedirs(server_env["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    log_path = os.path.join(data_dir, "server.log")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=server_env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        try:
+            try:
+                wait_until_up(f"http://127.0.0.1:{port}", process)
+            except RuntimeError as e:
+                raise RuntimeError(f"{e}, see {log_path}")
+            yield process
+        finally:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+
+def wait_until_up(base_url, process=None, timeout=120):
+    """Wait until the server at ``base_url`` answers requests"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            httpx.get(f"{base_url}/api/toll-plazas", trust_env=False, timeout=5)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not answer within {timeout} s")
+
+def sign_up(client, email, balance=0):
+    """
+    Register a user through the API, optionally with a deposit
+
+    Returns:
+        dict: Authorization headers of the user
+    """
+    client.post("/api/users", json={"email": email, "name": "Bench", "password": "bench"})
+    token = client.post("/api/token", data={"username": email, "password": "bench"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    if balance:
+        response = client.post("/api/account-transactions", json={"amount": balance, "type": "deposit"}, headers=headers)
+        response.raise_for_status()
+    return headers
+
+def process_cpu_seconds(pid):
+    """User plus system CPU time of a process and its children, from /proc"""
+    fields = open(f"/proc/{pid}/stat").read().rsplit(")", 1)[1].split()
+    ticks = sum(int(value) for value in fields[11:15])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+def process_rss_mb(pid):
+    """Resident memory of a process, from /proc"""
+    for line in open(f"/proc/{pid}/status"):
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) / 1024
+    return 0.0
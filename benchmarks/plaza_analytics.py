@@ -0,0 +1,98 @@
+"""
+Plaza analytics on synthetic data
+
+Times analytics.summarize_plazas on NumPy arrays of random transactions and
+traffic samples, against a pure Python loop computing only the revenue per
+plaza. Also times loading transactions from SQLite into the structured
+array (analytics.load_transactions).
+
+Usage:
+    python benchmarks/plaza_analytics.py [--transactions 10000000] [--traffic 1000000] [--plazas 2000] [--fetch-rows 1000000]
+"""
+import argparse
+from datetime import timedelta
+
+import numpy as np
+
+import harness
+
+def _transactions(analytics, count, plazas, start_ts, rng):
+    transactions = np.empty(count, dtype=analytics.TRANSACTION_DTYPE)
+    transactions["toll_plaza_id"] = rng.integers(1, plazas + 1, count)
+    transactions["vehicle_id"] = rng.integers(1, 100000, count)
+    transactions["amount"] = rng.uniform(20, 400, count).round(2)
+    transactions["ts"] = start_ts + rng.integers(0, 30 * 86400, count)
+    return transactions
+
+def _traffic(analytics, count, plazas, start_ts, rng):
+    traffic = np.empty(count, dtype=analytics.TRAFFIC_DTYPE)
+    traffic["toll_plaza_id"] = rng.integers(1, plazas + 1, count)
+    traffic["vehicle_count"] = rng.integers(0, 500, count)
+    traffic["average_wait_time"] = rng.uniform(0, 30, count)
+    traffic["samples"] = 1
+    traffic["ts"] = start_ts + rng.integers(0, 30 * 86400, count)
+    return traffic
+
+def _python_revenue(plaza_ids, amounts):
+    revenue = {}
+    for plaza_id, amount in zip(plaza_ids, amounts):
+        revenue[plaza_id] = revenue.get(plaza_id, 0.0) + amount
+    return revenue
+
+def _fetch(analytics, count, rng):
+    import models
+    from database import engine, init_db
+    from utils import ist_now
+
+    init_db()
+    start = ist_now().replace(microsecond=0) - timedelta(days=30)
+    offsets = rng.integers(0, 30 * 86400, count).tolist()
+    plaza_ids = rng.integers(1, 100, count).tolist()
+    with engine.begin() as conn:
+        conn.execute(models.Transaction.__table__.insert(), [
+            {
+                "user_id": 1,
+                "vehicle_id": 1,
+                "toll_plaza_id": plaza_id,
+                "amount": 100.0,
+                "timestamp": start + timedelta(seconds=offset),
+                "status": models.TransactionStatus.COMPLETED.value,
+                "transaction_type": models.TransactionType.TOLL_PAYMENT.value,
+                "reference_id": f"bench-{index}"
+            }
+            for index, (plaza_id, offset) in enumerate(zip(plaza_ids, offsets))
+        ])
+    loaded, seconds = harness.timed(analytics.load_transactions, start, start + timedelta(days=31))
+    print(f"load_transactions: {len(loaded)} rows from SQLite in {seconds:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=10_000_000)
+    parser.add_argument("--traffic", type=int, default=1_000_000)
+    parser.add_argument("--plazas", type=int, default=2000)
+    parser.add_argument("--fetch-rows", type=int, default=1_000_000, help="Rows loaded from SQLite (0 to skip)")
+    args = parser.parse_args()
+
+    harness.use_scratch_database()
+    import analytics
+
+    rng = np.random.default_rng(1)
+    start_ts = 1_700_000_000
+    transactions = _transactions(analytics, args.transactions, args.plazas, start_ts, rng)
+    traffic = _traffic(analytics, args.traffic, args.plazas, start_ts, rng)
+    type_names = ["car", "truck", "bus", "motorcycle", "other"]
+    codes = rng.integers(0, len(type_names), args.transactions)
+    plaza_ids = np.arange(1, args.plazas + 1)
+
+    report, seconds = harness.timed(analytics.summarize_plazas, plaza_ids, transactions, codes, type_names, traffic)
+    print(f"summarize_plazas: {args.transactions} transactions, {args.traffic} traffic samples, {len(report)} plazas in {seconds:.2f} s")
+
+    sample = min(args.transactions, 1_000_000)
+    _, seconds = harness.timed(_python_revenue, transactions["toll_plaza_id"][:sample].tolist(), transactions["amount"][:sample].tolist())
+    print(f"Python loop, revenue only: {sample} transactions in {seconds:.2f} s ({seconds * args.transactions / sample:.1f} s for {args.transactions})")
+
+    if args.fetch_rows:
+        _fetch(analytics, args.fetch_rows, rng)
+
+if __name__ == "__main__":
+    main()
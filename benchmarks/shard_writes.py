@@ -0,0 +1,64 @@
+"""
+Write throughput by shard count
+
+Every run starts from fresh database files. Writer threads post deposits for
+users spread over the shards, one commit each, through
+crud.create_account_transaction (transaction row and ledger entry).
+
+Usage:
+    python benchmarks/shard_writes.py [--shards 1 2 4 8] [--commits 12800] [--threads 16]
+"""
+import argparse
+import subprocess
+import sys
+import threading
+
+import harness
+
+USERS = 64
+
+def _write(user_ids, commits):
+    import crud
+    import schemas
+    from database import WriteSessionLocal
+
+    deposit = schemas.AccountTransactionCreate(amount=1.0, type=schemas.AccountTransactionType.DEPOSIT)
+    for index in range(commits):
+        with WriteSessionLocal() as db:
+            crud.create_account_transaction(db=db, account_transaction=deposit, user_id=user_ids[index % len(user_ids)])
+
+def _threads(user_ids, commits, threads):
+    workers = [threading.Thread(target=_write, args=(user_ids[index::threads] or user_ids, commits // threads)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def run(shards, commits, threads):
+    # Child process: its configuration is read at import time
+    harness.use_scratch_database(shards=shards if shards > 1 else 0)
+    from database import init_db
+
+    init_db()
+    user_ids = harness.insert_users(USERS)
+    _, seconds = harness.timed(_threads, user_ids, commits, threads)
+    print(f"{shards} shard(s): {commits} commits in {seconds:.2f} s = {commits / seconds:.0f} commits/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--commits", type=int, default=12800)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run(args.shards[0], args.commits, args.threads)
+        return
+    for shards in args.shards:
+        subprocess.run([
+            sys.executable, __file__, "--child", "--shards", str(shards), "--commits", str(args.commits), "--threads", str(args.threads)
+        ], check=True)
+
+if __name__ == "__main__":
+    main()
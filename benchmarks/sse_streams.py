@@ -0,0 +1,100 @@
+"""
+Idle notification streams on one worker, against polling
+
+Opens many /api/notifications/stream connections for one user on a single
+uvicorn worker. Reports the server's memory and idle CPU, and how long one
+notification takes to reach every stream. For comparison it measures the
+server CPU spent on /api/notifications?unread_only=true polls.
+
+Usage:
+    python benchmarks/sse_streams.py [--streams 10000] [--idle-seconds 10] [--polls 1000]
+"""
+import argparse
+import asyncio
+import resource
+import sys
+import time
+
+import httpx
+
+import harness
+
+PORT = 8802
+
+async def _open_stream(headers):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write(
+        f"GET /api/notifications/stream HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+        f"Authorization: {headers['Authorization']}\r\nAccept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status = await reader.readline()
+    if b" 200 " not in status:
+        raise RuntimeError(f"Stream refused: {status.decode().strip()}")
+    await reader.readuntil(b"\r\n\r\n")
+    return reader, writer
+
+async def _wait_for_notification(reader):
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise RuntimeError("Stream closed")
+        if line.startswith(b"event: notification"):
+            return time.perf_counter()
+
+async def run(args, server):
+    base_url = f"http://127.0.0.1:{PORT}"
+    with httpx.Client(base_url=base_url, trust_env=False, timeout=120) as client:
+        headers = harness.sign_up(client, "streams@example.com")
+    rss_before = harness.process_rss_mb(server.pid)
+
+    streams = []
+    for start in range(0, args.streams, 500):
+        streams += await asyncio.gather(*[_open_stream(headers) for _ in range(start, min(start + 500, args.streams))])
+    await asyncio.sleep(1)
+    rss_after = harness.process_rss_mb(server.pid)
+    print(f"{len(streams)} open streams: server RSS {rss_before:.0f} MB -> {rss_after:.0f} MB ({(rss_after - rss_before) * 1024 / len(streams):.1f} KB per stream)")
+
+    cpu = harness.process_cpu_seconds(server.pid)
+    await asyncio.sleep(args.idle_seconds)
+    print(f"Idle CPU with {len(streams)} open streams: {harness.process_cpu_seconds(server.pid) - cpu:.2f} s per {args.idle_seconds} s")
+
+    # A deposit raises one notification, which the hub sends to every stream
+    waiters = [asyncio.ensure_future(_wait_for_notification(reader)) for reader, _ in streams]
+    async with httpx.AsyncClient(base_url=base_url, trust_env=False, timeout=120) as client:
+        sent = time.perf_counter()
+        response = await client.post("/api/account-transactions", json={"amount": 10, "type": "deposit"}, headers=headers)
+        response.raise_for_status()
+    received = await asyncio.gather(*waiters)
+    print(f"One notification fanned out to {len(streams)} streams: {max(received) - sent:.2f} s to the last")
+
+    for _, writer in streams:
+        writer.close()
+
+    cpu = harness.process_cpu_seconds(server.pid)
+    with httpx.Client(base_url=base_url, trust_env=False, timeout=120) as client:
+        for _ in range(args.polls):
+            client.get("/api/notifications", params={"unread_only": True}, headers=headers).raise_for_status()
+    polled = harness.process_cpu_seconds(server.pid) - cpu
+    print(f"Polling baseline: {args.polls} unread_only polls cost {polled:.2f} s of server CPU "
+          f"({polled / args.polls * args.streams / 15:.2f} cores for {args.streams} clients polling every 15 s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--streams", type=int, default=10000)
+    parser.add_argument("--idle-seconds", type=int, default=10)
+    parser.add_argument("--polls", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Both ends hold one file descriptor per stream
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    harness.use_scratch_database()
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT), "--backlog", "4096", "--log-level", "warning"]
+    with harness.serve(command, port=PORT) as server:
+        asyncio.run(run(args, server))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Cold start time of the API server
+
+Starts uvicorn on a fresh database and times how long it takes until the
+first request is answered, with and without dummy data seeding (median of
+several runs). Also times a bare ``import main``.
+
+Usage:
+    python benchmarks/startup.py [--runs 5]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+import harness
+
+PORT = 8803
+
+def _cold_start(seed):
+    harness.use_scratch_database(TOLLEASY_SEED_DATA="true" if seed else "false")
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT), "--log-level", "warning"]
+    started = time.perf_counter()
+    with harness.serve(command, port=PORT):
+        return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for seed in (False, True):
+        seconds = statistics.median(_cold_start(seed) for _ in range(args.runs))
+        print(f"First response {'with' if seed else 'without'} seeding: {seconds:.2f} s (median of {args.runs})")
+
+    harness.use_scratch_database()
+    seconds = statistics.median(
+        harness.timed(subprocess.run, [sys.executable, "-c", "import main"], cwd=harness.ROOT, check=True, capture_output=True)[1]
+        for _ in range(args.runs)
+    )
+    print(f"import main: {seconds:.2f} s (median of {args.runs}, interpreter start included)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Cost of the IST timestamp helpers and of the inserts using them as defaults
+
+Times utils.get_ist_now and utils.ist_now per call, against a per-call
+pytz zone lookup and conversion when pytz is installed. Then times an ORM
+insert of transactions and a Core executemany of notifications, both
+relying on the column defaults.
+
+Usage:
+    python benchmarks/timestamps.py [--calls 100000] [--transactions 50000] [--notifications 100000]
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+import harness
+
+def _pytz_now():
+    import pytz
+
+    return datetime.now(pytz.utc).astimezone(pytz.timezone("Asia/Kolkata"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--transactions", type=int, default=50000)
+    parser.add_argument("--notifications", type=int, default=100000)
+    args = parser.parse_args()
+
+    harness.use_scratch_database()
+    import models
+    import utils
+    from database import SessionLocal, engine, init_db
+
+    helpers = {"get_ist_now": utils.get_ist_now, "ist_now": utils.ist_now}
+    try:
+        import pytz  # noqa: F401
+        helpers["pytz lookup per call"] = _pytz_now
+    except ImportError:
+        print("pytz is not installed, skipping the per-call zone lookup")
+    for name, helper in helpers.items():
+        seconds = min(timeit.repeat(helper, number=args.calls, repeat=3))
+        print(f"{name}: {seconds / args.calls * 1e6:.2f} us per call")
+
+    init_db()
+    transactions = [
+        models.Transaction(user_id=1, vehicle_id=1, toll_plaza_id=1, amount=10.0, status="completed",
+                           transaction_type="toll payment", reference_id=f"timestamps-{index}")
+        for index in range(args.transactions)
+    ]
+
+    def orm_insert():
+        with SessionLocal() as db:
+            db.add_all(transactions)
+            db.commit()
+
+    _, seconds = harness.timed(orm_insert)
+    print(f"ORM insert of {args.transactions} transactions: {seconds:.2f} s")
+
+    rows = [{"user_id": 1, "message": "-", "type": "general", "is_read": False} for _ in range(args.notifications)]
+
+    def core_insert():
+        with engine.begin() as conn:
+            conn.execute(models.Notification.__table__.insert(), rows)
+
+    _, seconds = harness.timed(core_insert)
+    print(f"Core executemany of {args.notifications} notifications: {seconds:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Traffic sample ingestion throughput
+
+Compares the per-sample crud path (one traffic row and one plaza update per
+commit) with the write-behind buffers of traffic_writer: enqueue rate,
+bulk flush time and the samples dropped when producers outrun the buffers.
+Then measures both endpoints over HTTP on one uvicorn worker.
+
+Usage:
+    python benchmarks/traffic_ingest.py [--plazas 5] [--samples 40000] [--crud-samples 2000] [--batch 500]
+"""
+import argparse
+import sys
+import threading
+
+import httpx
+
+import harness
+
+PORT = 8805
+ADMIN_EMAIL = "traffic-admin@example.com"
+
+def _samples(schemas, plazas, count):
+    return [
+        schemas.TrafficDataCreate(toll_plaza_id=index % plazas + 1, vehicle_count=index % 500, average_wait_time=index % 30, price_multiplier=1.0)
+        for index in range(count)
+    ]
+
+def _in_process(args):
+    import crud
+    import models
+    import schemas
+    import traffic_writer
+    from database import SessionLocal, WriteSessionLocal, init_db
+
+    init_db()
+    with SessionLocal() as db:
+        db.add_all([models.TollPlaza(name=f"Plaza {index}", location="0,0", address="-", base_price=100.0, current_price=100.0) for index in range(args.plazas)])
+        db.commit()
+
+    def crud_path(samples):
+        for sample in samples:
+            with WriteSessionLocal() as db:
+                crud.create_traffic_data(db=db, traffic_data=sample)
+
+    _, seconds = harness.timed(crud_path, _samples(schemas, args.plazas, args.crud_samples))
+    print(f"Per-sample crud path: {args.crud_samples / seconds:.0f} samples/s")
+
+    traffic_writer.start()
+    samples = _samples(schemas, args.plazas, args.samples)
+    _, seconds = harness.timed(traffic_writer.enqueue, samples)
+    print(f"enqueue: {args.samples / seconds:.0f} samples/s")
+    written, seconds = harness.timed(traffic_writer.flush)
+    print(f"flush: {written} rows in {seconds * 1000:.0f} ms ({written / seconds:.0f} samples/s)")
+
+    # Producers outrunning the flush interval: the buffers keep the newest
+    # TRAFFIC_BUFFER_SIZE samples per plaza
+    dropped = []
+    producers = [threading.Thread(target=lambda: dropped.append(traffic_writer.enqueue(samples))) for _ in range(4)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    buffered = sum(len(buffer) for buffer in traffic_writer._buffers.values())
+    print(f"4 producers x {args.samples} samples within one interval: {buffered} buffered "
+          f"({args.plazas} plazas x {traffic_writer.TRAFFIC_BUFFER_SIZE}), about {sum(dropped)} dropped")
+    traffic_writer.stop()
+
+def _over_http(args):
+    base_url = f"http://127.0.0.1:{PORT}"
+    sample = {"toll_plaza_id": 1, "vehicle_count": 120, "average_wait_time": 5, "price_multiplier": 1.0}
+    with httpx.Client(base_url=base_url, trust_env=False, timeout=120) as client:
+        headers = harness.sign_up(client, ADMIN_EMAIL)
+
+        def single(count):
+            for _ in range(count):
+                client.post("/api/admin/traffic-data", json=sample, headers=headers).raise_for_status()
+
+        def batches(count):
+            batch = [dict(sample, toll_plaza_id=index % args.plazas + 1) for index in range(args.batch)]
+            for _ in range(count):
+                client.post("/api/admin/traffic-data/samples", json=batch, headers=headers).raise_for_status()
+
+        count = max(args.crud_samples // 4, 1)
+        _, seconds = harness.timed(single, count)
+        print(f"HTTP, one sample per request: {count / seconds:.0f} samples/s")
+        count = max(args.samples // args.batch, 1)
+        _, seconds = harness.timed(batches, count)
+        print(f"HTTP, batches of {args.batch}: {count * args.batch / seconds:.0f} samples/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--plazas", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=40000, help="Samples per buffered run")
+    parser.add_argument("--crud-samples", type=int, default=2000, help="Samples written through the crud path")
+    parser.add_argument("--batch", type=int, default=500, help="Samples per HTTP batch")
+    args = parser.parse_args()
+
+    # The in-process flusher only writes when asked to
+    harness.use_scratch_database(TRAFFIC_FLUSH_MS=3600 * 1000, ADMIN_EMAILS=ADMIN_EMAIL)
+    _in_process(args)
+
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT), "--log-level", "warning"]
+    with harness.serve(command, port=PORT, TRAFFIC_FLUSH_MS=1000):
+        _over_http(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Request throughput by worker count
+
+Starts serve.sh (gunicorn with uvicorn workers) on a fresh database for
+each worker count. Measures GET /api/toll-plazas requests per second at a
+fixed number of concurrent clients, then concurrent deposits from several
+users, checking that every balance adds up.
+
+Usage:
+    python benchmarks/worker_scaling.py [--workers 1 2 4] [--clients 16] [--seconds 10] [--users 8] [--deposits 160]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import harness
+
+PORT = 8804
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+async def _reads(clients, seconds):
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client_loop(client):
+        nonlocal done
+        while time.perf_counter() < deadline:
+            (await client.get("/api/toll-plazas")).raise_for_status()
+            done += 1
+
+    async with httpx.AsyncClient(base_url=BASE_URL, trust_env=False, timeout=120, limits=httpx.Limits(max_connections=clients)) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(clients)])
+        return done / (time.perf_counter() - started)
+
+async def _writes(users, deposits, clients):
+    with httpx.Client(base_url=BASE_URL, trust_env=False, timeout=120) as client:
+        headers = [harness.sign_up(client, f"writer-{index}@example.com") for index in range(users)]
+
+    semaphore = asyncio.Semaphore(clients)
+    async with httpx.AsyncClient(base_url=BASE_URL, trust_env=False, timeout=120, limits=httpx.Limits(max_connections=clients)) as client:
+        async def deposit(user_headers):
+            async with semaphore:
+                response = await client.post("/api/account-transactions", json={"amount": 1, "type": "deposit"}, headers=user_headers)
+            return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*[deposit(user_headers) for user_headers in headers for _ in range(deposits)])
+        seconds = time.perf_counter() - started
+        balances = [(await client.get("/api/users/me", headers=user_headers)).json()["current_balance"] for user_headers in headers]
+    failed = sum(status != 200 for status in statuses)
+    wrong = sum(balance != deposits for balance in balances)
+    return len(statuses) / seconds, failed, wrong
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--seconds", type=int, default=10, help="Duration of the read test")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--deposits", type=int, default=160, help="Deposits per user")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        harness.use_scratch_database()
+        with harness.serve(["bash", "serve.sh"], port=PORT, WEB_CONCURRENCY=workers):
+            rps = asyncio.run(_reads(args.clients, args.seconds))
+            writes, failed, wrong = asyncio.run(_writes(args.users, args.deposits, args.clients))
+        print(f"{workers} worker(s): {rps:.0f} reads/s, {writes:.0f} writes/s, {failed} failed writes, {wrong} wrong balances")
+
+if __name__ == "__main__":
+    main()
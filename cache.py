@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal, GLOBAL_SHARD, engine, is_memory_database, SQLITE_BUSY_TIMEOUT_MS
+
+# How often cache versions are polled on databases without PRAGMA data_version
+# (in seconds)
+CACHE_POLL_SECONDS = float(os.getenv("CACHE_POLL_SECONDS", "1.0"))
+
+def bump(db: Session, name: str):
+    """
+    Invalidate the cache ``name`` in every worker once the caller's
+    transaction commits
+
+    Args:
+        db (Session): Session writing the cached data
+        name (str): Cache name
+    """
+    versions = models.CacheVersion.__table__
+    db.execute(
+        sqlite_insert(versions).values(name=name, version=1).on_conflict_do_update(
+            index_elements=[versions.c.name], set_={"version": versions.c.version + 1}
+        ),
+        bind_arguments={"shard_id": GLOBAL_SHARD}
+    )
+    # Seen by this process right after the commit, without waiting for a poll
+    event.listen(db, "after_commit", lambda session: watcher.mark_stale(), once=True)
+
+class VersionWatcher:
+    """
+    Keeps the current cache versions of the global database
+
+    On a SQLite file, ``PRAGMA data_version`` on a dedicated connection
+    changes whenever any other connection (of this or another process)
+    commits, so the versions table is only read after a commit. Other
+    databases are polled every CACHE_POLL_SECONDS.
+    """
+
+    def __init__(self, url):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._stale = True
+        self._data_version = None
+        self._checked_at = 0.0
+        # Dedicated autocommit connection, opened on first use
+        self._path = url.database if url.get_backend_name() == "sqlite" and not is_memory_database(url) else None
+        self._conn = None
+
+    def mark_stale(self):
+        self._stale = True
+
+    def _read_versions(self):
+        if self._conn is not None:
+            return dict(self._conn.execute("SELECT name, version FROM cache_versions").fetchall())
+        db = SessionLocal()
+        try:
+            conn = db.connection(bind_arguments={"shard_id": GLOBAL_SHARD})
+            return dict(conn.execute(select(models.CacheVersion.name, models.CacheVersion.version)).all())
+        finally:
+            db.close()
+
+    def version(self, name):
+        """Return the current version of the cache ``name``"""
+        with self._lock:
+            if self._path is not None and self._conn is None:
+                self._conn = sqlite3.connect(
+                    self._path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False
+                )
+            if self._conn is not None:
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    self._data_version = data_version
+                    self._stale = True
+            elif time.monotonic() - self._checked_at >= CACHE_POLL_SECONDS:
+                self._stale = True
+
+            if self._stale:
+                self._stale = False
+                self._checked_at = time.monotonic()
+                self._versions = self._read_versions()
+            return self._versions.get(name, 0)
+
+watcher = VersionWatcher(engine.url)
+
+_MISSING = object()
+
+class VersionedCache:
+    """
+    A value loaded from the database and kept in process memory until the
+    cache version changes. Writers call ``invalidate(db)`` in the same
+    transaction as their write.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._value = _MISSING
+        self._version = None
+
+    def get(self):
+        version = watcher.version(self.name)
+        with self._lock:
+            if self._value is _MISSING or self._version != version:
+                # The version is read before loading, so a write that
+                # commits during the load triggers another one
+                self._value = self.loader()
+                self._version = version
+            return self._value
+
+    def invalidate(self, db: Session):
+        bump(db, self.name)
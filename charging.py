@@ -0,0 +1,94 @@
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import ledger
+import models
+import plan_catalog
+import pricing
+from database import shard_for_user
+from utils import ist_now
+
+def current_period():
+    """Return the free pass period of today: the first day of the month (IST)"""
+    return ist_now().date().replace(day=1)
+
+def active_plan(user: models.User):
+    """
+    Return the plan (schemas.Plan) whose benefits apply to ``user``, or None.
+    Expired subscriptions are flipped by the alert job (see alerts.py).
+    """
+    if user.subscription_plan_id is None or user.subscription_status != models.SubscriptionStatus.ACTIVE:
+        return None
+    return plan_catalog.get_plan(user.subscription_plan_id)
+
+def _free_pass_allowance(plan):
+    return int((plan.features or {}).get("free_passes", 0)) if plan is not None else 0
+
+def _take_free_pass(db: Session, user_id: int, allowance: int, period):
+    # Count the pass and check the allowance in one statement, so that
+    # concurrent payments cannot use more passes than the plan has. No row
+    # comes back when the allowance is used up.
+    usage = models.PlanUsage.__table__
+    stmt = sqlite_insert(usage).values(user_id=user_id, period=period, free_passes_used=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[usage.c.user_id, usage.c.period],
+        set_={"free_passes_used": usage.c.free_passes_used + 1},
+        where=usage.c.free_passes_used < allowance
+    ).returning(usage.c.free_passes_used)
+    return db.execute(stmt, bind_arguments={"shard_id": shard_for_user(user_id)}).first() is not None
+
+def charge_toll(db: Session, user: models.User, amount: float):
+    """
+    Apply the plan of ``user`` to a toll: a free pass of the current month
+    is used while some are left, otherwise the plan discount is taken off.
+    Runs inside the caller's transaction, so the pass is only used if the
+    payment commits.
+
+    Args:
+        db (Session): Session of the payment
+        user (User): Paying user
+        amount (float): Toll before plan benefits
+
+    Returns:
+        dict: Amount to charge, discount given and whether a free pass was used
+    """
+    plan = active_plan(user)
+    allowance = _free_pass_allowance(plan)
+    if allowance > 0 and _take_free_pass(db, user.id, allowance, current_period()):
+        return {"amount": 0.0, "discount": amount, "free_pass": True}
+
+    # In paise, like the ledger, so that the charge and discount add up
+    amount_paise = ledger.to_paise(amount)
+    discount_paise = int(round(amount_paise * pricing.plan_discount(plan)))
+    return {
+        "amount": ledger.to_rupees(amount_paise - discount_paise),
+        "discount": ledger.to_rupees(discount_paise),
+        "free_pass": False
+    }
+
+def get_plan_usage(db: Session, user: models.User):
+    """
+    Return the free passes of the user's plan used and left this month
+
+    Args:
+        db (Session): Database session
+        user (User): Subscriber
+
+    Returns:
+        dict: Plan, period, allowance, used and remaining free passes and discount
+    """
+    plan = active_plan(user)
+    period = current_period()
+    allowance = _free_pass_allowance(plan)
+    used = db.query(models.PlanUsage.free_passes_used).filter(
+        models.PlanUsage.user_id == user.id,
+        models.PlanUsage.period == period
+    ).scalar() or 0
+    return {
+        "plan_id": plan.id if plan is not None else None,
+        "period": period,
+        "free_passes": allowance,
+        "free_passes_used": used,
+        "free_passes_left": max(allowance - used, 0),
+        "discount_percent": pricing.plan_discount(plan) * 100
+    }
@@ -1,12 +1,19 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func, select, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import uuid
 from datetime import datetime
-import json
 
+import archive
+import ledger
 import models
+import notification_hub
+import plan_catalog
+import rollups
 import schemas
 from auth import get_password_hash
-from utils import get_ist_now
+from database import scatter_gather, shard_for_user
+from utils import ist_now
 
 # User CRUD operations
 def get_user(db: Session, user_id: int):
@@ -43,10 +50,18 @@ def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
     if "password" in update_data:
         update_data["password_hash"] = get_password_hash(update_data.pop("password"))
     
+    # Balance changes are recorded as ledger adjustments
+    if "current_balance" in update_data:
+        new_balance = update_data.pop("current_balance")
+        if new_balance is not None:
+            delta = ledger.to_paise(new_balance) - ledger.to_paise(db_user.current_balance or 0.0)
+            if delta:
+                ledger.post_entry(db, user_id, delta, ledger.ADJUSTMENT)
+    
     for key, value in update_data.items():
         setattr(db_user, key, value)
     
-    db_user.updated_at = get_ist_now()
+    db_user.updated_at = ist_now()
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -63,6 +78,9 @@ def delete_user(db: Session, user_id: int):
 def get_vehicles_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.Vehicle).filter(models.Vehicle.user_id == user_id).offset(skip).limit(limit).all()
 
+def count_vehicles_by_user(db: Session, user_id: int):
+    return db.query(func.count(models.Vehicle.id)).filter(models.Vehicle.user_id == user_id).scalar()
+
 def get_vehicle(db: Session, vehicle_id: int):
     return db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id).first()
 
@@ -85,7 +103,7 @@ def update_vehicle(db: Session, vehicle_id: int, vehicle: schemas.VehicleUpdate)
     for key, value in update_data.items():
         setattr(db_vehicle, key, value)
     
-    db_vehicle.updated_at = get_ist_now()
+    db_vehicle.updated_at = ist_now()
     db.commit()
     db.refresh(db_vehicle)
     return db_vehicle
@@ -105,6 +123,9 @@ def get_toll_plazas(db: Session, skip: int = 0, limit: int = 100):
 def get_toll_plaza(db: Session, toll_plaza_id: int):
     return db.query(models.TollPlaza).filter(models.TollPlaza.id == toll_plaza_id).first()
 
+def get_existing_toll_plaza_ids(db: Session, toll_plaza_ids):
+    return {plaza_id for (plaza_id,) in db.query(models.TollPlaza.id).filter(models.TollPlaza.id.in_(toll_plaza_ids))}
+
 def create_toll_plaza(db: Session, toll_plaza: schemas.TollPlazaCreate):
     db_toll_plaza = models.TollPlaza(**toll_plaza.dict())
     db.add(db_toll_plaza)
@@ -141,21 +162,16 @@ def get_plan(db: Session, plan_id: int):
     return db.query(models.Plan).filter(models.Plan.id == plan_id).first()
 
 def create_plan(db: Session, plan: schemas.PlanCreate):
-    # Convert features dict to JSON string
-    if isinstance(plan.features, dict):
-        features_json = json.dumps(plan.features)
-    else:
-        features_json = plan.features
-    
     db_plan = models.Plan(
         name=plan.name,
         price=plan.price,
         annual_price=plan.annual_price,
         max_vehicles=plan.max_vehicles,
-        features=features_json,
+        features=plan.features,
         is_active=plan.is_active
     )
     db.add(db_plan)
+    plan_catalog.invalidate(db)
     db.commit()
     db.refresh(db_plan)
     return db_plan
@@ -167,13 +183,10 @@ def update_plan(db: Session, plan_id: int, plan: schemas.PlanUpdate):
     
     update_data = plan.dict(exclude_unset=True)
     
-    # Convert features dict to JSON string if it exists
-    if "features" in update_data and isinstance(update_data["features"], dict):
-        update_data["features"] = json.dumps(update_data["features"])
-    
     for key, value in update_data.items():
         setattr(db_plan, key, value)
     
+    plan_catalog.invalidate(db)
     db.commit()
     db.refresh(db_plan)
     return db_plan
@@ -183,15 +196,36 @@ def delete_plan(db: Session, plan_id: int):
     if not db_plan:
         return None
     db.delete(db_plan)
+    plan_catalog.invalidate(db)
     db.commit()
     return db_plan
 
 # Transaction CRUD operations
 def get_transactions_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Transaction).filter(models.Transaction.user_id == user_id).offset(skip).limit(limit).all()
+    transactions = db.query(models.Transaction).filter(models.Transaction.user_id == user_id).offset(skip).limit(limit).all()
+    if len(transactions) == limit:
+        return transactions
+    
+    # The listing goes on with the archived months. Rows of archivable months
+    # still in the database are skipped in the partitions.
+    if transactions:
+        in_db_count = skip + len(transactions)
+    else:
+        in_db_count = db.query(func.count(models.Transaction.id)).filter(models.Transaction.user_id == user_id).scalar()
+    in_db = {row_id for row_id, in db.query(models.Transaction.id).filter(
+        models.Transaction.user_id == user_id,
+        models.Transaction.timestamp < archive.archive_cutoff()
+    )}
+    archived = archive.read_archived_transactions(user_id, skip_ids=in_db)
+    offset = max(0, skip - in_db_count)
+    return transactions + archived[offset:offset + limit - len(transactions)]
 
 def get_transaction(db: Session, transaction_id: int):
-    return db.query(models.Transaction).filter(models.Transaction.id == transaction_id).first()
+    # Transactions of archived months are read from their partition
+    transaction = db.query(models.Transaction).filter(models.Transaction.id == transaction_id).first()
+    if transaction is None:
+        transaction = archive.find_archived_transaction(transaction_id)
+    return transaction
 
 def create_transaction(db: Session, transaction: schemas.TransactionCreate, user_id: int):
     # Generate a unique reference ID
@@ -204,17 +238,22 @@ def create_transaction(db: Session, transaction: schemas.TransactionCreate, user
         reference_id=reference_id
     )
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    
-    # Update user balance
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if transaction.transaction_type == models.TransactionType.TOLL_PAYMENT:
-        db_user.current_balance -= transaction.amount
-    elif transaction.transaction_type == models.TransactionType.ACCOUNT_RECHARGE:
-        db_user.current_balance += transaction.amount
+    db.flush()
+    
+    # Update user balance through the ledger. Payments may not overdraw the
+    # account; the check is part of the balance update.
+    amount_paise = ledger.to_paise(transaction.amount)
+    try:
+        if transaction.transaction_type == models.TransactionType.TOLL_PAYMENT:
+            ledger.post_entry(db, user_id, -amount_paise, transaction.transaction_type.value, reference_id, min_balance_paise=0)
+        elif transaction.transaction_type == models.TransactionType.ACCOUNT_RECHARGE:
+            ledger.post_entry(db, user_id, amount_paise, transaction.transaction_type.value, reference_id)
+    except ledger.InsufficientBalanceError:
+        db.rollback()
+        raise
     
     db.commit()
+    db.refresh(db_transaction)
     
     return db_transaction
 
@@ -223,10 +262,16 @@ def update_transaction(db: Session, transaction_id: int, transaction: schemas.Tr
     if not db_transaction:
         return None
     
+    was_completed = db_transaction.status == models.TransactionStatus.COMPLETED
     update_data = transaction.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_transaction, key, value)
     
+    # Keep the daily spend rollup in step with status changes
+    is_completed = db_transaction.status == models.TransactionStatus.COMPLETED
+    if is_completed != was_completed:
+        rollups.record_toll_payment(db, db_transaction, sign=1 if is_completed else -1)
+    
     db.commit()
     db.refresh(db_transaction)
     return db_transaction
@@ -273,7 +318,7 @@ def update_payment_method(db: Session, payment_method_id: int, payment_method: s
     for key, value in update_data.items():
         setattr(db_payment_method, key, value)
     
-    db_payment_method.updated_at = get_ist_now()
+    db_payment_method.updated_at = ist_now()
     db.commit()
     db.refresh(db_payment_method)
     return db_payment_method
@@ -304,46 +349,45 @@ def create_account_transaction(db: Session, account_transaction: schemas.Account
         reference_id=reference_id
     )
     db.add(db_account_transaction)
-    db.commit()
-    db.refresh(db_account_transaction)
     
-    # Update user balance
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if account_transaction.type == models.AccountTransactionType.DEPOSIT:
-        db_user.current_balance += account_transaction.amount
-    elif account_transaction.type == models.AccountTransactionType.WITHDRAWAL:
-        db_user.current_balance -= account_transaction.amount
-    elif account_transaction.type == models.AccountTransactionType.REFUND:
-        db_user.current_balance += account_transaction.amount
+    # Update user balance through the ledger. Withdrawals may not overdraw
+    # the account; the check is part of the balance update.
+    amount_paise = ledger.to_paise(account_transaction.amount)
+    try:
+        if account_transaction.type == models.AccountTransactionType.DEPOSIT:
+            ledger.post_entry(db, user_id, amount_paise, account_transaction.type.value, reference_id)
+        elif account_transaction.type == models.AccountTransactionType.WITHDRAWAL:
+            ledger.post_entry(db, user_id, -amount_paise, account_transaction.type.value, reference_id, min_balance_paise=0)
+        elif account_transaction.type == models.AccountTransactionType.REFUND:
+            ledger.post_entry(db, user_id, amount_paise, account_transaction.type.value, reference_id)
+    except ledger.InsufficientBalanceError:
+        db.rollback()
+        raise
     
     db.commit()
+    db.refresh(db_account_transaction)
     
     return db_account_transaction
 
 # TrafficData CRUD operations
-def get_traffic_data_by_toll_plaza(db: Session, toll_plaza_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.TrafficData).filter(models.TrafficData.toll_plaza_id == toll_plaza_id).offset(skip).limit(limit).all()
+def get_traffic_data_by_toll_plaza(db: Session, toll_plaza_id: int, start: datetime, end: datetime, limit: int = 100):
+    # Raw samples are only kept for a few days; longer ranges are read from
+    # the rollups (see traffic_rollups.py)
+    return db.query(models.TrafficData).filter(
+        models.TrafficData.toll_plaza_id == toll_plaza_id,
+        models.TrafficData.timestamp >= start,
+        models.TrafficData.timestamp < end
+    ).order_by(models.TrafficData.timestamp).limit(limit).all()
 
 def create_traffic_data(db: Session, traffic_data: schemas.TrafficDataCreate):
     db_traffic_data = models.TrafficData(**traffic_data.dict())
     db.add(db_traffic_data)
-    db.commit()
-    db.refresh(db_traffic_data)
     
-    # Update toll plaza busy level and price based on traffic data
+    # Record the latest traffic state of the toll plaza, in the same commit.
+    # Busy level and price are derived from it for all plazas at once by
+    # pricing.recompute_prices.
     db_toll_plaza = db.query(models.TollPlaza).filter(models.TollPlaza.id == traffic_data.toll_plaza_id).first()
     
-    # Update busy level based on vehicle count
-    if traffic_data.vehicle_count < 50:
-        db_toll_plaza.busy_level = models.BusyLevel.LOW
-    elif traffic_data.vehicle_count < 100:
-        db_toll_plaza.busy_level = models.BusyLevel.MEDIUM
-    else:
-        db_toll_plaza.busy_level = models.BusyLevel.HIGH
-    
-    # Update current price based on price multiplier
-    db_toll_plaza.current_price = db_toll_plaza.base_price * traffic_data.price_multiplier
-    
     # Update estimated time
     db_toll_plaza.estimated_time = traffic_data.average_wait_time
     
@@ -351,6 +395,7 @@ def create_traffic_data(db: Session, traffic_data: schemas.TrafficDataCreate):
     db_toll_plaza.vehicles_per_hour = traffic_data.vehicle_count
     
     db.commit()
+    db.refresh(db_traffic_data)
     
     return db_traffic_data
 
@@ -364,14 +409,60 @@ def get_notifications_by_user(db: Session, user_id: int, skip: int = 0, limit: i
 def get_notification(db: Session, notification_id: int):
     return db.query(models.Notification).filter(models.Notification.id == notification_id).first()
 
+def _unread_count_upsert():
+    # Add :delta to the counter of :counter_user_id. A missing counter starts
+    # from the unread rows in the table, which already include the change.
+    counters = models.NotificationCounter.__table__
+    notifications = models.Notification.__table__
+    user_id = bindparam("counter_user_id")
+    unread = select(func.count()).select_from(notifications).where(
+        notifications.c.user_id == user_id,
+        notifications.c.is_read == False
+    ).scalar_subquery()
+    stmt = sqlite_insert(counters).values(user_id=user_id, unread=unread)
+    return stmt.on_conflict_do_update(
+        index_elements=[counters.c.user_id],
+        set_={"unread": counters.c.unread + bindparam("delta")}
+    )
+
+def adjust_unread_counts(conn, deltas):
+    """
+    Apply unread counter changes on a shard connection, in the caller's
+    transaction and after the notification rows were written
+
+    Args:
+        conn (Connection): Connection to the shard of the users
+        deltas (dict): user_id -> change of the unread count
+    """
+    if deltas:
+        conn.execute(_unread_count_upsert(), [{"counter_user_id": user_id, "delta": delta} for user_id, delta in deltas.items()])
+
+def _adjust_unread_count(db: Session, user_id: int, delta: int):
+    db.flush()
+    adjust_unread_counts(db.connection(bind_arguments={"shard_id": shard_for_user(user_id)}), {user_id: delta})
+
+def get_unread_count(db: Session, user_id: int):
+    unread = db.query(models.NotificationCounter.unread).filter(models.NotificationCounter.user_id == user_id).scalar()
+    if unread is None:
+        # No counter until the user's unread count first changes; count the
+        # rows instead of creating it, as this runs in read-only requests
+        unread = db.query(func.count(models.Notification.id)).filter(
+            models.Notification.user_id == user_id,
+            models.Notification.is_read == False
+        ).scalar()
+    return unread
+
 def create_notification(db: Session, notification: schemas.NotificationCreate, user_id: int):
     db_notification = models.Notification(
         **notification.dict(),
         user_id=user_id
     )
     db.add(db_notification)
+    if not db_notification.is_read:
+        _adjust_unread_count(db, user_id, 1)
     db.commit()
     db.refresh(db_notification)
+    notification_hub.hub.publish(user_id, notification_hub.notification_event(db_notification))
     return db_notification
 
 def mark_notification_as_read(db: Session, notification_id: int):
@@ -379,15 +470,49 @@ def mark_notification_as_read(db: Session, notification_id: int):
     if not db_notification:
         return None
     
-    db_notification.is_read = True
+    if not db_notification.is_read:
+        db_notification.is_read = True
+        _adjust_unread_count(db, db_notification.user_id, -1)
     db.commit()
     db.refresh(db_notification)
     return db_notification
 
 def mark_all_notifications_as_read(db: Session, user_id: int):
-    db.query(models.Notification).filter(
+    # Nothing to update when the counter says everything is read
+    if get_unread_count(db, user_id) == 0:
+        return True
+    updated = db.query(models.Notification).filter(
         models.Notification.user_id == user_id,
         models.Notification.is_read == False
     ).update({models.Notification.is_read: True})
+    _adjust_unread_count(db, user_id, -updated)
     db.commit()
-    return True 
\ No newline at end of file
+    return True 
+
+# Cross-shard admin aggregations
+def _shard_statistics(db: Session):
+    toll_payments = db.query(
+        func.count(models.Transaction.id),
+        func.coalesce(func.sum(models.Transaction.amount), 0.0)
+    ).filter(
+        models.Transaction.transaction_type == models.TransactionType.TOLL_PAYMENT,
+        models.Transaction.status == models.TransactionStatus.COMPLETED
+    ).one()
+    deposits = db.query(
+        func.coalesce(func.sum(models.AccountTransaction.amount), 0.0)
+    ).filter(models.AccountTransaction.type == models.AccountTransactionType.DEPOSIT).scalar()
+    return {
+        "total_transactions": db.query(func.count(models.Transaction.id)).scalar(),
+        "completed_toll_payments": toll_payments[0],
+        "toll_revenue": toll_payments[1],
+        "total_account_transactions": db.query(func.count(models.AccountTransaction.id)).scalar(),
+        "total_deposits": deposits,
+        "unread_notifications": db.query(func.count(models.Notification.id)).filter(models.Notification.is_read == False).scalar()
+    }
+
+def get_platform_statistics():
+    """Aggregate per-user data over all shards, querying the shards in parallel"""
+    per_shard = scatter_gather(_shard_statistics)
+    totals = {key: sum(shard[key] for shard in per_shard) for key in per_shard[0]}
+    totals["shards"] = len(per_shard)
+    return totals
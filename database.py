@@ -1,24 +1,281 @@
-from sqlalchemy import create_engine
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, make_url, update, Table, MetaData, Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql import operators, visitors
+
+# Global database URL (users, vehicles, plans, toll plazas, ...)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///:memory:")
+
+# Load dummy data at startup when the database is empty (development only)
+SEED_DUMMY_DATA = os.getenv("TOLLEASY_SEED_DATA", "false").lower() == "true"
+
+# Optional comma separated list of shard database URLs for per-user data
+# (transactions, account transactions, notifications). When empty, per-user
+# data lives on the global database.
+SHARD_DATABASE_URLS = [url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+
+# How long a SQLite connection waits for a lock held by another connection or
+# worker process before failing (in milliseconds)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+
+# Connections per SQLite file. Sync endpoints and the cleanup of their
+# sessions run in the same 40-thread pool, so a smaller connection pool lets
+# threads waiting for a connection block the ones that would return theirs.
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "40"))
+
+def is_memory_database(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    # Transactions are begun by _begin_sqlite_transaction instead of the driver
+    dbapi_connection.isolation_level = None
+    # WAL lets readers run alongside a writer, and the busy timeout makes
+    # writers from other workers wait for the lock instead of failing
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def _begin_sqlite_transaction(conn):
+    # A deferred transaction that reads before writing cannot wait for the
+    # write lock once another worker has committed since its read; it fails
+    # with "database is locked" right away. Writers therefore take the lock
+    # when they begin (see WriteSessionLocal).
+    if conn.get_execution_options().get("sqlite_immediate"):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        conn.exec_driver_sql("BEGIN")
+
+def _create_engine(url):
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+    connect_args = {"check_same_thread": False}
+    if is_memory_database(url):
+        # A single connection shared by all threads; with a connection per
+        # thread every threadpool thread would see its own empty database
+        return create_engine(url, connect_args=connect_args, poolclass=StaticPool)
+    sqlite_engine = create_engine(url, connect_args=connect_args, pool_size=SQLITE_POOL_SIZE, max_overflow=10)
+    event.listen(sqlite_engine, "connect", _configure_sqlite_connection)
+    event.listen(sqlite_engine, "begin", _begin_sqlite_transaction)
+    return sqlite_engine
+
+# Create engine for the global database
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+
+# Shard identifiers and engines
+GLOBAL_SHARD = "global"
+if SHARD_DATABASE_URLS:
+    USER_SHARDS = [f"shard_{index}" for index in range(len(SHARD_DATABASE_URLS))]
+    shard_engines = {shard_id: _create_engine(url) for shard_id, url in zip(USER_SHARDS, SHARD_DATABASE_URLS)}
+else:
+    USER_SHARDS = [GLOBAL_SHARD]
+    shard_engines = {GLOBAL_SHARD: engine}
+
+# Import Base and models
+import models
+from models import Base
 
-# SQLite in-memory database URL
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# Tables holding per-user data, placed on a shard by a hash of user_id
+SHARDED_MODELS = (
+    models.Transaction,
+    models.AccountTransaction,
+    models.Notification,
+    models.NotificationCounter,
+    models.UserDailySpend,
+    models.PlanUsage,
+    models.IdempotencyKey,
+    models.LedgerEntry,
+    models.LedgerBalance,
+    models.LedgerSnapshot
+)
+SHARDED_TABLES = {model.__tablename__ for model in SHARDED_MODELS}
+
+# Sharded tables with a surrogate integer id drawn from the shard sequences
+SEQUENCED_MODELS = tuple(model for model in SHARDED_MODELS if "id" in model.__table__.c)
 
-# Create engine for SQLite in-memory database
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
+# Per-shard id sequences. Shard k only hands out ids congruent to k modulo the
+# shard count, so primary keys stay unique across shards.
+shard_metadata = MetaData()
+shard_sequences = Table(
+    "shard_sequences",
+    shard_metadata,
+    Column("name", String, primary_key=True),
+    Column("next_value", Integer, nullable=False, default=1)
 )
 
+def shard_for_user(user_id: int) -> str:
+    """Return the shard id holding the per-user data of ``user_id``"""
+    if len(USER_SHARDS) == 1:
+        return USER_SHARDS[0]
+    return USER_SHARDS[zlib.crc32(str(user_id).encode()) % len(USER_SHARDS)]
+
+def _is_sharded(mapper) -> bool:
+    return mapper is not None and mapper.local_table.name in SHARDED_TABLES
+
+def _bind_value(value):
+    if hasattr(value, "effective_value"):
+        return value.effective_value
+    return getattr(value, "value", None)
+
+def _user_ids_from_criteria(statement):
+    """Collect the user ids a statement is restricted to via ``user_id == x`` or ``user_id IN (...)``"""
+    user_ids = set()
+
+    def visit_binary(binary):
+        column = binary.left
+        if getattr(column, "key", None) != "user_id" or getattr(column, "table", None) is None:
+            return
+        if column.table.name not in SHARDED_TABLES:
+            return
+        value = _bind_value(binary.right)
+        if binary.operator == operators.eq and value is not None:
+            user_ids.add(value)
+        elif binary.operator == operators.in_op and value:
+            user_ids.update(value)
+
+    visitors.traverse(statement, {}, {"binary": visit_binary})
+    return user_ids
+
+def _shard_chooser(mapper, instance, clause=None):
+    if not _is_sharded(mapper):
+        return GLOBAL_SHARD
+    if instance is not None and instance.user_id is not None:
+        return shard_for_user(instance.user_id)
+    return USER_SHARDS[0]
+
+def _identity_chooser(mapper, primary_key, *, lazy_loaded_from, **kw):
+    if not _is_sharded(mapper):
+        return [GLOBAL_SHARD]
+    if lazy_loaded_from is not None and getattr(lazy_loaded_from.obj(), "user_id", None) is not None:
+        return [shard_for_user(lazy_loaded_from.obj().user_id)]
+    return USER_SHARDS
+
+def _execute_chooser(context):
+    if not _is_sharded(context.bind_mapper):
+        return [GLOBAL_SHARD]
+    user_ids = _user_ids_from_criteria(context.statement)
+    if user_ids:
+        return sorted({shard_for_user(user_id) for user_id in user_ids})
+    # No user criteria: scatter to every shard
+    return USER_SHARDS
+
+def reserve_shard_ids(connection, table_name, count=1):
+    """
+    Reserve ``count`` primary keys for rows inserted outside the ORM into a
+    sequenced sharded table on the shard ``connection`` belongs to
+
+    Returns:
+        list: Reserved ids (empty when there is a single shard and SQLite
+            autoincrement applies)
+    """
+    if len(USER_SHARDS) == 1:
+        return []
+    # Compared by pool, which write sessions' engines (with execution options) share
+    shard_index = next(index for index, shard_id in enumerate(USER_SHARDS) if shard_engines[shard_id].pool is connection.engine.pool)
+    value = connection.execute(
+        update(shard_sequences)
+        .where(shard_sequences.c.name == table_name)
+        .values(next_value=shard_sequences.c.next_value + count)
+        .returning(shard_sequences.c.next_value)
+    ).scalar_one()
+    return [(sequence - 1) * len(USER_SHARDS) + shard_index + 1 for sequence in range(value - count, value)]
+
+def _assign_sharded_id(mapper, connection, target):
+    if target.id is None and len(USER_SHARDS) > 1:
+        target.id = reserve_shard_ids(connection, mapper.local_table.name)[0]
+
+for _model in SEQUENCED_MODELS:
+    event.listen(_model, "before_insert", _assign_sharded_id)
+
 # Create sessionmaker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(
+    class_=ShardedSession,
+    autocommit=False,
+    autoflush=False,
+    shards={GLOBAL_SHARD: engine, **shard_engines},
+    shard_chooser=_shard_chooser,
+    identity_chooser=_identity_chooser,
+    execute_chooser=_execute_chooser
+)
 
-# Import Base from models
-from models import Base
+# Engines whose SQLite transactions begin immediate, by engine
+_immediate_engines = {
+    shard_engine: shard_engine.execution_options(sqlite_immediate=True)
+    for shard_engine in {engine, *shard_engines.values()}
+}
+
+class WriteSession(ShardedSession):
+    """
+    Session of requests that write. Its transactions take the write lock
+    when they begin, until the first commit: what runs after it (refreshes,
+    lazy loads) only reads. A read that waited for a write lock could hold
+    one shard while waiting for another and deadlock with a request
+    locking them in the opposite order.
+    """
+
+    def get_bind(self, *args, **kwargs):
+        bind = super().get_bind(*args, **kwargs)
+        return bind if self.info.get("committed") else _immediate_engines[bind]
+
+@event.listens_for(WriteSession, "after_commit")
+def _after_write_commit(session):
+    session.info["committed"] = True
+
+# Sessions for requests that write
+WriteSessionLocal = sessionmaker(
+    class_=WriteSession,
+    autocommit=False,
+    autoflush=False,
+    shards={GLOBAL_SHARD: engine, **shard_engines},
+    shard_chooser=_shard_chooser,
+    identity_chooser=_identity_chooser,
+    execute_chooser=_execute_chooser
+)
+
+# Thread pool used to query all shards in parallel
+_scatter_pool = ThreadPoolExecutor(max_workers=max(len(USER_SHARDS), 1), thread_name_prefix="shard")
+
+def _run_on_shard(shard_id, fn, write):
+    bind = shard_engines[shard_id].execution_options(sqlite_immediate=True) if write else shard_engines[shard_id]
+    with Session(bind=bind, info={"shard_id": shard_id}) as db:
+        return fn(db)
+
+def scatter_gather(fn, shard_ids=None, write=False):
+    """
+    Run ``fn(session)`` against every user shard in parallel
+
+    Args:
+        fn (callable): Function receiving a plain Session bound to one shard
+            (the shard id is available as ``session.info["shard_id"]``)
+        shard_ids (list): Shards to query (default: all user shards)
+        write (bool): Whether ``fn`` writes; its transaction then takes the
+            write lock when it begins, like WriteSessionLocal
+
+    Returns:
+        list: Results of ``fn`` in shard order
+    """
+    shard_ids = shard_ids or USER_SHARDS
+    futures = [_scatter_pool.submit(_run_on_shard, shard_id, fn, write) for shard_id in shard_ids]
+    return [future.result() for future in futures]
 
 # Get database session
-def get_db():
+def get_db(request: Request):
+    db = SessionLocal() if request.method in ("GET", "HEAD") else WriteSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Get database session for requests that only read, whatever their method
+def get_read_db():
     db = SessionLocal()
     try:
         yield db
@@ -29,23 +286,50 @@ def get_db():
 def init_db():
     # Import all models to ensure they are registered with the Base metadata
     from models import User, Vehicle, TollPlaza, Plan, Transaction, PaymentMethod, AccountTransaction, TrafficData, Notification
-    
-    # Create all tables
-    Base.metadata.create_all(bind=engine)
-    
+
+    # Create all tables. Per-user tables live on the shards when sharding is enabled.
+    if SHARD_DATABASE_URLS:
+        global_tables = [table for table in Base.metadata.sorted_tables if table.name not in SHARDED_TABLES]
+        Base.metadata.create_all(bind=engine, tables=global_tables)
+        sharded_tables = [table for table in Base.metadata.sorted_tables if table.name in SHARDED_TABLES]
+        for shard_engine in shard_engines.values():
+            Base.metadata.create_all(bind=shard_engine, tables=sharded_tables)
+            shard_metadata.create_all(bind=shard_engine)
+            with shard_engine.begin() as conn:
+                for model in SEQUENCED_MODELS:
+                    conn.execute(
+                        shard_sequences.insert().prefix_with("OR IGNORE"),
+                        {"name": model.__tablename__, "next_value": 1}
+                    )
+    else:
+        Base.metadata.create_all(bind=engine)
+
     # Initialize with some default data
     db = SessionLocal()
     try:
         # Check if we need to seed initial data
         if db.query(Plan).count() == 0:
             seed_initial_data(db)
+        else:
+            _decode_plan_features(db)
     finally:
         db.close()
 
+# Older databases stored plan features as a JSON encoded string inside the
+# JSON column; store them as objects so they are parsed once on load
+def _decode_plan_features(db):
+    import json
+    from models import Plan
+
+    plans = [plan for plan in db.query(Plan) if isinstance(plan.features, str)]
+    for plan in plans:
+        plan.features = json.loads(plan.features)
+    if plans:
+        db.commit()
+
 # Seed initial data
 def seed_initial_data(db):
     from models import Plan
-    import json
     
     # Create default plans
     basic_plan = Plan(
@@ -53,11 +337,11 @@ def seed_initial_data(db):
         price=9.99,
         annual_price=99.99,
         max_vehicles=2,
-        features=json.dumps({
+        features={
             "free_passes": 5,
             "discount": 0,
             "priority_support": False
-        }),
+        },
         is_active=True
     )
     
@@ -66,11 +350,11 @@ def seed_initial_data(db):
         price=19.99,
         annual_price=199.99,
         max_vehicles=5,
-        features=json.dumps({
+        features={
             "free_passes": 10,
             "discount": 5,
             "priority_support": True
-        }),
+        },
         is_active=True
     )
     
@@ -79,12 +363,12 @@ def seed_initial_data(db):
         price=49.99,
         annual_price=499.99,
         max_vehicles=10,
-        features=json.dumps({
+        features={
             "free_passes": 20,
             "discount": 10,
             "priority_support": True,
             "dedicated_manager": True
-        }),
+        },
         is_active=True
     )
     
@@ -1,14 +1,14 @@
-import json
 import random
 import uuid
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 
 import models
+import rollups
 import schemas
 from auth import get_password_hash
-from database import SessionLocal
-from utils import get_ist_now
+from database import SessionLocal, seed_initial_data
+from utils import ist_now
 
 def create_dummy_data():
     """
@@ -21,52 +21,13 @@ def create_dummy_data():
             print("Database already contains data. Skipping dummy data creation.")
             return
         
-        # Create subscription plans
-        print("Creating subscription plans...")
-        basic_plan = models.Plan(
-            name="Basic",
-            price=9.99,
-            annual_price=99.99,
-            max_vehicles=2,
-            features=json.dumps({
-                "free_passes": 5,
-                "discount": 0,
-                "priority_support": False
-            }),
-            is_active=True
-        )
-        
-        premium_plan = models.Plan(
-            name="Premium",
-            price=19.99,
-            annual_price=199.99,
-            max_vehicles=5,
-            features=json.dumps({
-                "free_passes": 10,
-                "discount": 5,
-                "priority_support": True
-            }),
-            is_active=True
-        )
-        
-        business_plan = models.Plan(
-            name="Business",
-            price=49.99,
-            annual_price=499.99,
-            max_vehicles=10,
-            features=json.dumps({
-                "free_passes": 20,
-                "discount": 10,
-                "priority_support": True,
-                "dedicated_manager": True
-            }),
-            is_active=True
-        )
-        
-        db.add(basic_plan)
-        db.add(premium_plan)
-        db.add(business_plan)
-        db.commit()
+        # Subscription plans are seeded by init_db
+        if db.query(models.Plan).count() == 0:
+            seed_initial_data(db)
+        plans_by_name = {plan.name: plan for plan in db.query(models.Plan)}
+        basic_plan = plans_by_name.get("Basic")
+        premium_plan = plans_by_name.get("Premium")
+        business_plan = plans_by_name.get("Business")
         
         # Create toll plazas
         print("Creating toll plazas...")
@@ -149,6 +110,10 @@ def create_dummy_data():
         plans = [basic_plan, premium_plan, business_plan, None]
         plan_weights = [0.4, 0.3, 0.2, 0.1]  # 40% basic, 30% premium, 20% business, 10% no plan
         
+        # All dummy users share one password, so it is hashed once (bcrypt is
+        # deliberately slow)
+        password_hash = get_password_hash("password123")
+        
         for i in range(1, 21):
             first_name = random.choice(first_names)
             last_name = random.choice(last_names)
@@ -160,7 +125,7 @@ def create_dummy_data():
             
             # Calculate subscription dates if plan is assigned
             if subscription_plan:
-                subscription_start_date = get_ist_now() - timedelta(days=random.randint(1, 180))
+                subscription_start_date = ist_now() - timedelta(days=random.randint(1, 180))
                 subscription_end_date = subscription_start_date + timedelta(days=365)
             else:
                 subscription_start_date = None
@@ -169,13 +134,13 @@ def create_dummy_data():
             # Create user
             user = models.User(
                 email=email,
-                password_hash=get_password_hash("password123"),  # Same password for all dummy users
+                password_hash=password_hash,
                 name=f"{first_name} {last_name}",
                 phone_number=phone,
                 address=f"{random.randint(1, 999)}, {random.choice(['Main Street', 'Park Avenue', 'MG Road', 'Ring Road', 'Beach Road'])}, {random.choice(['Mumbai', 'Delhi', 'Bangalore', 'Chennai', 'Kolkata', 'Hyderabad', 'Pune'])}",
                 current_balance=random.uniform(200, 5000),
-                created_at=get_ist_now() - timedelta(days=random.randint(1, 365)),
-                updated_at=get_ist_now(),
+                created_at=ist_now() - timedelta(days=random.randint(1, 365)),
+                updated_at=ist_now(),
                 subscription_plan_id=subscription_plan.id if subscription_plan else None,
                 subscription_status=models.SubscriptionStatus.ACTIVE if subscription_plan else models.SubscriptionStatus.EXPIRED,
                 subscription_start_date=subscription_start_date,
@@ -209,8 +174,8 @@ def create_dummy_data():
                     color=color,
                     transponder_id=f"T-{uuid.uuid4().hex[:8].upper()}",
                     is_active=random.random() > 0.1,  # 90% chance of being active
-                    created_at=get_ist_now() - timedelta(days=random.randint(1, 365)),
-                    updated_at=get_ist_now()
+                    created_at=ist_now() - timedelta(days=random.randint(1, 365)),
+                    updated_at=ist_now()
                 )
                 
                 db.add(vehicle)
@@ -230,7 +195,7 @@ def create_dummy_data():
                         vehicle_id=vehicle.id,
                         toll_plaza_id=toll_plaza.id,
                         amount=amount,
-                        timestamp=get_ist_now() - timedelta(days=random.randint(1, 90), hours=random.randint(1, 24)),
+                        timestamp=ist_now() - timedelta(days=random.randint(1, 90), hours=random.randint(1, 24)),
                         status=models.TransactionStatus.COMPLETED,
                         transaction_type=models.TransactionType.TOLL_PAYMENT,
                         payment_method="Transponder",
@@ -238,6 +203,7 @@ def create_dummy_data():
                     )
                     
                     db.add(transaction)
+                    rollups.record_toll_payment(db, transaction)
                     
                     # Add notifications for some transactions
                     if random.random() > 0.5:  # 50% chance
@@ -268,8 +234,8 @@ def create_dummy_data():
                     payment_type=payment_type,
                     payment_details=payment_details,
                     is_default=j == 0,  # First payment method is default
-                    created_at=get_ist_now() - timedelta(days=random.randint(1, 180)),
-                    updated_at=get_ist_now()
+                    created_at=ist_now() - timedelta(days=random.randint(1, 180)),
+                    updated_at=ist_now()
                 )
                 
                 db.add(payment_method)
@@ -288,7 +254,7 @@ def create_dummy_data():
                         type=transaction_type,
                         payment_method_id=payment_method.id,
                         status="completed",
-                        timestamp=get_ist_now() - timedelta(days=random.randint(1, 90), hours=random.randint(1, 24)),
+                        timestamp=ist_now() - timedelta(days=random.randint(1, 90), hours=random.randint(1, 24)),
                         reference_id=str(uuid.uuid4())
                     )
                     
@@ -324,7 +290,7 @@ def create_dummy_data():
                     message=message,
                     type=notification_type,
                     is_read=random.random() > 0.5,  # 50% chance of being read
-                    created_at=get_ist_now() - timedelta(days=random.randint(1, 30), hours=random.randint(1, 24))
+                    created_at=ist_now() - timedelta(days=random.randint(1, 30), hours=random.randint(1, 24))
                 )
                 
                 db.add(notification)
@@ -1,7 +1,7 @@
 import os
 import sqlite3
 import datetime
-from database import SessionLocal
+from database import engine
 
 def export_database_to_sql():
     """
@@ -21,10 +21,8 @@ def export_database_to_sql():
     db_file = "temp_db.sqlite"
 
     try:
-        # Get a database session and connection info
-        db = SessionLocal()
-        db_url = db.bind.url
-        db.close()
+        # Get the connection info of the global database
+        db_url = engine.url
         
         # For in-memory database, we need to create a temp file
         conn = sqlite3.connect(db_file)
@@ -0,0 +1,199 @@
+import glob
+import os
+
+import archive
+import models
+from database import shard_engines, shard_for_user
+
+# Rows per Arrow record batch (and Parquet row group) of an export
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "65536"))
+
+# Export formats: media type and file extension
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+class _ChunkSink:
+    """Write-only file object whose bytes are taken out after every batch"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _record_batch(rows, schema):
+    # Columns are built from the plain DBAPI tuples of a batch, without ORM or
+    # Pydantic objects. SQLite hands timestamps out as ISO strings, which
+    # Arrow parses in one cast per column.
+    import pyarrow as pa
+
+    arrays = []
+    for column, field in zip(zip(*rows), schema):
+        if pa.types.is_timestamp(field.type):
+            arrays.append(pa.array(column, type=pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(column, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _archived_batches(user_id, shard_id, start, end, skip_ids=None, only_ids=None):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    table_name = models.Transaction.__tablename__
+    paths = sorted(glob.glob(os.path.join(archive.ARCHIVE_DIR, table_name, shard_id, "*.parquet")))
+    condition = ds.field("user_id") == user_id
+    if start is not None:
+        condition = condition & (ds.field("timestamp") >= pa.scalar(start, pa.timestamp("us")))
+    if end is not None:
+        condition = condition & (ds.field("timestamp") < pa.scalar(end, pa.timestamp("us")))
+
+    for path in paths:
+        # Partitions are named after their month
+        year, month = (int(part) for part in os.path.basename(path)[:-len(".parquet")].split("-"))
+        month_start = archive.month_start(year, month)
+        if (end is not None and month_start >= end) or (start is not None and archive.next_month_start(month_start) <= start):
+            continue
+        for batch in ds.dataset(path, format="parquet").to_batches(filter=condition, batch_size=EXPORT_BATCH_ROWS):
+            if skip_ids is not None:
+                batch = batch.filter(pc.invert(pc.is_in(batch["id"], value_set=skip_ids)))
+            if only_ids is not None:
+                batch = batch.filter(pc.is_in(batch["id"], value_set=only_ids))
+            if batch.num_rows:
+                yield batch
+
+def _fetch_rows(shard_id, sql, params):
+    # One statement on a connection taken from the pool for it alone, so the
+    # read snapshot ends with the batch and does not hold back checkpoints
+    # while the client downloads
+    with shard_engines[shard_id].connect() as conn:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+def transaction_batches(user_id: int, start=None, end=None):
+    """
+    Yield a user's transactions in ``[start, end)`` as Arrow record batches:
+    the archived months first, then the rows in the database, each in time
+    order
+
+    Rows are read from the database in pages of EXPORT_BATCH_ROWS, each on a
+    short connection of its own. Rows the archiver moves out of the
+    database during the export are read from their partition at the end.
+
+    Args:
+        user_id (int): User
+        start (datetime): Optional start of the range (IST)
+        end (datetime): Optional end of the range (IST)
+    """
+    import pyarrow as pa
+
+    table = models.Transaction.__table__
+    schema = archive.arrow_schema(table)
+    shard_id = shard_for_user(user_id)
+    columns = [column.name for column in table.columns]
+    id_index, timestamp_index = columns.index("id"), columns.index("timestamp")
+
+    conditions = ["user_id = ?"]
+    params = [user_id]
+    if start is not None:
+        conditions.append("timestamp >= ?")
+        params.append(start.isoformat(" "))
+    if end is not None:
+        conditions.append("timestamp < ?")
+        params.append(end.isoformat(" "))
+
+    # Rows of archivable months still in the database are skipped in their
+    # partition, where a failed or running archive run may have put them too
+    cutoff = archive.archive_cutoff()
+    in_db = _fetch_rows(
+        shard_id,
+        f"SELECT id FROM {table.name} WHERE {' AND '.join(conditions)} AND timestamp < ?",
+        params + [cutoff.isoformat(" ")]
+    )
+    in_db = [row_id for row_id, in in_db]
+    if start is None or start < cutoff:
+        skip_ids = pa.array(in_db, type=pa.int64()) if in_db else None
+        yield from _archived_batches(user_id, shard_id, start, end, skip_ids)
+
+    # Pages follow (timestamp, id), the order of the user_id, timestamp index
+    not_seen = set(in_db)
+    last = None
+    while True:
+        page_conditions = conditions + (["(timestamp, id) > (?, ?)"] if last else [])
+        rows = _fetch_rows(
+            shard_id,
+            f"SELECT {', '.join(columns)} FROM {table.name} "
+            f"WHERE {' AND '.join(page_conditions)} ORDER BY timestamp, id LIMIT ?",
+            params + list(last or ()) + [EXPORT_BATCH_ROWS]
+        )
+        if not rows:
+            break
+        if not_seen:
+            not_seen.difference_update(row[id_index] for row in rows)
+        last = (rows[-1][timestamp_index], rows[-1][id_index])
+        yield _record_batch(rows, schema)
+
+    if not_seen:
+        yield from _archived_batches(user_id, shard_id, start, end, only_ids=pa.array(sorted(not_seen), type=pa.int64()))
+
+def stream_transactions(user_id: int, export_format: str, start=None, end=None):
+    """
+    Stream a user's transactions as an Arrow IPC stream or a Parquet file,
+    one chunk of bytes per record batch
+
+    Args:
+        user_id (int): User
+        export_format (str): "arrow" or "parquet"
+        start (datetime): Optional start of the range (IST)
+        end (datetime): Optional end of the range (IST)
+
+    Raises:
+        ValueError: Unknown format
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format}")
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = archive.arrow_schema(models.Transaction.__table__)
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode="w")
+    if export_format == "arrow":
+        writer = pa.ipc.new_stream(output, schema)
+    else:
+        writer = pq.ParquetWriter(output, schema, compression="zstd")
+
+    def chunks():
+        with writer:
+            for batch in transaction_batches(user_id, start, end):
+                writer.write_batch(batch)
+                yield sink.take()
+        # Footer (Parquet) or end-of-stream marker (Arrow)
+        yield sink.take()
+
+    return chunks()
@@ -0,0 +1,286 @@
+import calendar
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+
+import models
+import pricing
+import traffic_rollups
+from database import engine
+from utils import ist_now
+
+logger = logging.getLogger(__name__)
+
+# Forecasts are refreshed every FORECAST_INTERVAL_SECONDS
+FORECAST_INTERVAL_SECONDS = int(os.getenv("FORECAST_INTERVAL_SECONDS", "60"))
+
+# Minutes ahead for which wait time and busy level are predicted
+FORECAST_HORIZONS_MINUTES = [int(minutes) for minutes in os.getenv("FORECAST_HORIZONS_MINUTES", "15,30,60").split(",")]
+
+# Time constant (minutes) of the moving average of the deviation of recent
+# samples from the weekly profile
+FORECAST_EWMA_MINUTES = float(os.getenv("FORECAST_EWMA_MINUTES", "15"))
+
+# Time constant (minutes) with which a deviation fades back into the profile
+FORECAST_DECAY_MINUTES = float(os.getenv("FORECAST_DECAY_MINUTES", "60"))
+
+# Raw samples read per query when catching up
+FORECAST_BATCH = int(os.getenv("FORECAST_BATCH", "200000"))
+
+HOURS_PER_WEEK = 168
+
+# 1970-01-01 was a Thursday: shifting by three days puts Monday 00:00 in bin 0
+_WEEK_OFFSET_HOURS = 72
+
+# Series forecast per plaza: wait time (minutes) and vehicles per hour
+_SERIES = 2
+
+# Timestamps are read as epoch seconds of their IST wall clock time, like the
+# rollup buckets, so hours of the week are IST hours
+_HOURLY_SQL = """
+    SELECT toll_plaza_id, CAST(strftime('%s', bucket) AS INTEGER),
+           wait_sum / samples, CAST(vehicle_count_sum AS REAL) / samples, samples
+    FROM traffic_aggregates
+    WHERE resolution = 3600
+"""
+
+_RAW_SQL = """
+    SELECT id, toll_plaza_id, CAST(strftime('%s', timestamp) AS INTEGER),
+           COALESCE(average_wait_time, 0), COALESCE(vehicle_count, 0)
+    FROM traffic_data
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+def hour_of_week(ts):
+    """Return the hour of the week (0 = Monday 00:00) of epoch seconds"""
+    return (ts // 3600 + _WEEK_OFFSET_HOURS) % HOURS_PER_WEEK
+
+class WaitTimeModel:
+    """
+    Per-plaza forecast of wait time and vehicles per hour: the mean of every
+    hour of the week, plus an exponentially weighted moving average of the
+    deviation of recent samples from that mean, fading out with the horizon.
+    Observations are added incrementally; nothing is refit from scratch.
+    """
+
+    def __init__(self):
+        self.sums = np.zeros((0, HOURS_PER_WEEK, _SERIES))
+        self.weights = np.zeros((0, HOURS_PER_WEEK))
+        self.residuals = np.zeros((0, _SERIES))
+        # Epoch seconds of the latest observation per plaza, -1 before the first
+        self.last_ts = np.zeros(0, dtype="i8")
+        # Plaza id of each row, in the order plazas were first seen
+        self.plaza_ids = np.zeros(0, dtype="i8")
+        # Largest traffic_data id added
+        self.last_id = 0
+
+    def _rows(self, plaza_ids):
+        # Row of each plaza id, adding rows for new plazas. Rows are compact,
+        # so memory follows the number of plazas rather than the largest id.
+        new = np.setdiff1d(plaza_ids, self.plaza_ids)
+        if len(new):
+            extra = len(new)
+            self.sums = np.concatenate([self.sums, np.zeros((extra, HOURS_PER_WEEK, _SERIES))])
+            self.weights = np.concatenate([self.weights, np.zeros((extra, HOURS_PER_WEEK))])
+            self.residuals = np.concatenate([self.residuals, np.zeros((extra, _SERIES))])
+            self.last_ts = np.concatenate([self.last_ts, np.full(extra, -1, dtype="i8")])
+            self.plaza_ids = np.concatenate([self.plaza_ids, new])
+        order = np.argsort(self.plaza_ids)
+        return order[np.searchsorted(self.plaza_ids[order], plaza_ids)]
+
+    def baseline(self, rows, bins):
+        """Mean of the hour of the week, or of the whole week when the hour has no data"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hourly = self.sums[rows, bins] / self.weights[rows, bins][:, None]
+            overall = self.sums.sum(axis=1) / self.weights.sum(axis=1)[:, None]
+        return np.nan_to_num(np.where(np.isnan(hourly), overall[rows], hourly))
+
+    def update(self, plaza_ids, ts, values, weights):
+        """
+        Add observations to the model
+
+        Args:
+            plaza_ids (np.ndarray): Plaza of each observation
+            ts (np.ndarray): Epoch seconds of each observation
+            values (np.ndarray): Wait time and vehicles per hour, shape (n, 2)
+            weights (np.ndarray): Number of samples behind each observation
+        """
+        if not len(ts):
+            return
+        rows = self._rows(plaza_ids)
+        n_plazas = len(self.weights)
+
+        # Weekly profile: weighted sums per plaza and hour of the week
+        cells = rows * HOURS_PER_WEEK + hour_of_week(ts)
+        self.weights += np.bincount(cells, weights=weights, minlength=n_plazas * HOURS_PER_WEEK).reshape(n_plazas, HOURS_PER_WEEK)
+        for series in range(_SERIES):
+            self.sums[:, :, series] += np.bincount(cells, weights=values[:, series] * weights, minlength=n_plazas * HOURS_PER_WEEK).reshape(n_plazas, HOURS_PER_WEEK)
+
+        # Moving average of the deviations, in time order per plaza. With a
+        # step a = 1 - exp(-dt / tau), the recursion r = (1 - a) r + a e adds
+        # up to r_T = r_0 exp(-(T - t_0) / tau) + sum a_i e_i exp(-(T - t_i) / tau),
+        # which is evaluated for all observations at once.
+        order = np.lexsort((ts, rows))
+        rows, ts, values = rows[order], ts[order], values[order]
+        errors = values - self.baseline(rows, hour_of_week(ts))
+
+        first = np.ones(len(ts), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        previous = np.empty(len(ts), dtype="i8")
+        previous[1:] = ts[:-1]
+        previous[first] = self.last_ts[rows[first]]
+
+        tau = FORECAST_EWMA_MINUTES * 60
+        steps = 1 - np.exp(-np.maximum(ts - previous, 0) / tau)
+        # The first observation of a plaza starts the average
+        steps[first & (previous < 0)] = 1.0
+
+        groups = np.cumsum(first) - 1
+        group_plazas = rows[first]
+        latest = np.maximum(np.maximum.reduceat(ts, np.flatnonzero(first)), self.last_ts[group_plazas])
+        fades = np.exp(-(latest[groups] - ts) / tau)
+
+        carried = np.where(
+            self.last_ts[group_plazas] >= 0,
+            np.exp(-(latest - self.last_ts[group_plazas]) / tau),
+            0.0
+        )
+        for series in range(_SERIES):
+            added = np.bincount(groups, weights=steps * errors[:, series] * fades, minlength=len(group_plazas))
+            self.residuals[group_plazas, series] = self.residuals[group_plazas, series] * carried + added
+        self.last_ts[group_plazas] = latest
+
+    def predict(self, now_ts, horizons_minutes):
+        """
+        Predict wait time and vehicles per hour of every plaza with data
+
+        Args:
+            now_ts (int): Epoch seconds of now
+            horizons_minutes (list): Minutes ahead
+
+        Returns:
+            tuple: Plaza ids and predictions of shape (horizons, plazas, 2)
+        """
+        rows = np.flatnonzero(self.weights.sum(axis=1) > 0)
+        predictions = np.empty((len(horizons_minutes), len(rows), _SERIES))
+        for i, minutes in enumerate(horizons_minutes):
+            target = now_ts + minutes * 60
+            base = self.baseline(rows, np.full(len(rows), hour_of_week(target)))
+            fade = np.exp(-np.maximum(target - self.last_ts[rows], 0) / (FORECAST_DECAY_MINUTES * 60))
+            predictions[i] = np.maximum(base + self.residuals[rows] * fade[:, None], 0)
+        return self.plaza_ids[rows], predictions
+
+def _fetch(conn, sql, params=()):
+    # Plain DBAPI tuples, as rows for a year of data are too many for Row objects
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return np.array(cursor.fetchall(), dtype="f8").reshape(-1, 5)
+    finally:
+        cursor.close()
+
+def _add_raw_samples(conn, model):
+    # Samples written after the last run, in id order
+    added = 0
+    while True:
+        rows = _fetch(conn, _RAW_SQL, (model.last_id, FORECAST_BATCH))
+        if not len(rows):
+            return added
+        model.update(rows[:, 1].astype("i8"), rows[:, 2].astype("i8"), rows[:, 3:5], np.ones(len(rows)))
+        model.last_id = int(rows[-1, 0])
+        added += len(rows)
+        if len(rows) < FORECAST_BATCH:
+            return added
+
+def fit():
+    """
+    Fit a model from the hourly traffic rollup and the raw samples that are
+    not rolled up yet
+
+    Returns:
+        WaitTimeModel: Fitted model
+    """
+    model = WaitTimeModel()
+    with engine.connect() as conn:
+        # One read transaction, so that the rollup and its watermark match
+        with conn.begin():
+            model.last_id = conn.execute(
+                select(models.JobWatermark.value).where(models.JobWatermark.name == traffic_rollups.WATERMARK)
+            ).scalar() or 0
+            rows = _fetch(conn, _HOURLY_SQL)
+            model.update(rows[:, 0].astype("i8"), rows[:, 1].astype("i8"), rows[:, 2:4], rows[:, 4])
+            _add_raw_samples(conn, model)
+    return model
+
+_model = None
+_model_lock = threading.Lock()
+
+def refresh_forecasts():
+    """
+    Add the traffic samples written since the last run to the model (fitting
+    it on the first run) and store the forecasts of every plaza
+
+    Returns:
+        int: Number of plazas forecast
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            started = time.perf_counter()
+            _model = fit()
+            logger.info("Fitted wait time forecasts for %d plazas in %.2fs", int((_model.weights.sum(axis=1) > 0).sum()), time.perf_counter() - started)
+        else:
+            with engine.connect() as conn:
+                _add_raw_samples(conn, _model)
+
+        now = ist_now()
+        plaza_ids, predictions = _model.predict(calendar.timegm(now.timetuple()), FORECAST_HORIZONS_MINUTES)
+
+    rows = []
+    for i, minutes in enumerate(FORECAST_HORIZONS_MINUTES):
+        levels = pricing.busy_levels_for(predictions[i, :, 1])
+        for j, plaza_id in enumerate(plaza_ids):
+            rows.append({
+                "toll_plaza_id": int(plaza_id),
+                "horizon_minutes": minutes,
+                "generated_at": now,
+                "estimated_time": round(float(predictions[i, j, 0]), 1),
+                "vehicles_per_hour": round(float(predictions[i, j, 1]), 1),
+                "busy_level": str(levels[j])
+            })
+
+    forecasts = models.PlazaForecast.__table__
+    with engine.execution_options(sqlite_immediate=True).begin() as conn:
+        conn.execute(delete(forecasts))
+        if rows:
+            conn.execute(forecasts.insert(), rows)
+    return len(plaza_ids)
+
+def get_forecasts(db: Session, toll_plaza_id: int):
+    """
+    Return the stored forecasts of a plaza, nearest first
+
+    Returns:
+        list: Dicts with horizon, predicted time, wait time, vehicles per hour and busy level
+    """
+    forecasts = db.query(models.PlazaForecast).filter(
+        models.PlazaForecast.toll_plaza_id == toll_plaza_id
+    ).order_by(models.PlazaForecast.horizon_minutes).all()
+    return [
+        {
+            "horizon_minutes": forecast.horizon_minutes,
+            "time": forecast.generated_at + timedelta(minutes=forecast.horizon_minutes),
+            "estimated_time": forecast.estimated_time,
+            "vehicles_per_hour": forecast.vehicles_per_hour,
+            "busy_level": forecast.busy_level
+        }
+        for forecast in forecasts
+    ]
@@ -3,12 +3,18 @@ from datetime import datetime
 import os
 from dotenv import load_dotenv
 
+import metrics
+
 # Load environment variables
 load_dotenv()
 
 # Get API key from environment variables
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "")
 
+def _client(api_key):
+    # Every HTTP call made by the client is timed through a response hook
+    return googlemaps.Client(key=api_key, requests_kwargs={"hooks": {"response": metrics.observe_maps_response}})
+
 def get_traffic_details(location):
     """
     Gets traffic details around a specific location
@@ -26,7 +32,7 @@ def get_traffic_details(location):
         return {"error": "Google Maps API key not configured"}
     
     # Initialize the Google Maps client
-    gmaps = googlemaps.Client(key=api_key)
+    gmaps = _client(api_key)
     
     # Get the geocoded location to extract coordinates
     geocode_result = gmaps.geocode(location)
@@ -145,7 +151,7 @@ def get_route(origin, destination):
         return {"error": "Google Maps API key not configured"}
     
     # Initialize the Google Maps client
-    gmaps = googlemaps.Client(key=api_key)
+    gmaps = _client(api_key)
     
     # Get directions
     directions_result = gmaps.directions(
@@ -220,7 +226,7 @@ def get_nearby_toll_plazas(location, radius=10000):
         return {"error": "Google Maps API key not configured"}
     
     # Initialize the Google Maps client
-    gmaps = googlemaps.Client(key=api_key)
+    gmaps = _client(api_key)
     
     # Get the geocoded location to extract coordinates
     geocode_result = gmaps.geocode(location)
@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+# Production server settings, used by serve.sh
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+
+# One worker per CPU; the app is async and blocking work runs in threads
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Give in-flight requests and the notification writer time to finish
+graceful_timeout = 30
+
+def on_starting(server):
+    # Create the schema, default plans and dummy data once, before the
+    # workers start and would race to do it
+    import database
+    database.init_db()
+    if database.SEED_DUMMY_DATA:
+        from dummy_data import create_dummy_data
+        create_dummy_data()
+    # Connections must not be inherited by the forked workers
+    for shard_engine in {database.engine, *database.shard_engines.values()}:
+        shard_engine.dispose()
+
+def child_exit(server, worker):
+    # Drop the live gauges of a worker that exited
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
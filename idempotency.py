@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from sqlalchemy import and_, delete, event, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+from database import scatter_gather, shard_engines, shard_for_user
+from utils import ist_now
+
+# How long a stored response is replayed for a repeated key (in seconds)
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+
+# How often expired keys are deleted (in seconds)
+IDEMPOTENCY_PRUNE_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_PRUNE_INTERVAL_SECONDS", "3600"))
+
+# Maximum length of a client supplied key
+MAX_KEY_LENGTH = 255
+
+_keys = models.IdempotencyKey.__table__
+
+def _fingerprint(payload):
+    return hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode()).hexdigest()
+
+def _where(key):
+    user_id, operation, idempotency_key = key
+    return and_(_keys.c.user_id == user_id, _keys.c.operation == operation, _keys.c.key == idempotency_key)
+
+def _expiry():
+    return ist_now() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+
+def _load(key):
+    # Read on a connection of its own, so that the lookup neither takes nor
+    # waits for the write lock of the request's session
+    with shard_engines[shard_for_user(key[0])].connect() as conn:
+        return conn.execute(select(_keys.c.fingerprint, _keys.c.response, _keys.c.created_at).where(_where(key))).first()
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    if stored.response is None:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    return Response(
+        content=stored.response.encode(),
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+class IdempotentRequest:
+    def __init__(self, key, fingerprint, replay, db=None, row=None):
+        self.key = key
+        self.fingerprint = fingerprint
+        # Stored response of an earlier request with the same key, if any
+        self.replay = replay
+        self._db = db
+        self._row = row
+        self._model = None
+        self._schema = None
+        self._created = None
+        self._body = None
+
+    def respond_with(self, model, schema):
+        """
+        Store the response in the transaction that commits the request. The
+        response is the ``model`` instance inserted by the request, as
+        ``schema``; it is written to the key right before the commit, so the
+        key, the response and the payment are committed together.
+        """
+        if self._row is None:
+            return
+        self._model = model
+        self._schema = schema
+        event.listen(self._db, "after_flush", self._track)
+        event.listen(self._db, "before_commit", self._store)
+
+    def _track(self, session, flush_context):
+        for obj in session.new:
+            if isinstance(obj, self._model):
+                self._created = obj
+
+    def _store(self, session):
+        if self._created is None:
+            return
+        session.flush()
+        self._body = json.dumps(jsonable_encoder(self._schema.model_validate(self._created, from_attributes=True)))
+        self._row.response = self._body
+
+    def close(self):
+        if self._model is not None:
+            event.remove(self._db, "after_flush", self._track)
+            event.remove(self._db, "before_commit", self._store)
+
+    def save(self, response):
+        """
+        Return the JSON response of the first request: the one committed with
+        the key, when ``respond_with`` was called
+        """
+        body = self._body if self._body is not None else json.dumps(jsonable_encoder(response))
+        return Response(content=body.encode(), media_type="application/json")
+
+@contextmanager
+def guard(db: Session, user_id, operation, idempotency_key, payload):
+    """
+    Run a state-changing request at most once per ``Idempotency-Key``
+
+    The key is inserted through ``db`` before the request runs, in the
+    user's shard, so a retry served by any worker finds it. The insert takes
+    the shard's write lock: a concurrent retry waits for the first request
+    to finish and, once its own insert fails on the primary key, gets the
+    stored response. A repeated request gets the stored response as
+    ``replay`` (marked with an ``Idempotent-Replayed`` header) and must not
+    be executed again. Reusing a key with a different payload is rejected
+    with 422. Requests without a key run as usual.
+
+    Args:
+        db (Session): Session of the request's writes
+        user_id (int): Authenticated user
+        operation (str): Name of the endpoint
+        idempotency_key (str): Value of the Idempotency-Key header, if any
+        payload (BaseModel): Request body, used to detect key reuse
+
+    Yields:
+        IdempotentRequest: Call ``respond_with`` before the commit and
+            ``save`` with the response
+    """
+    if idempotency_key is None:
+        yield IdempotentRequest(None, None, None)
+        return
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+
+    key = (user_id, operation, idempotency_key)
+    fingerprint = _fingerprint(payload)
+    stored = _load(key)
+    if stored is not None and stored.created_at < _expiry():
+        with shard_engines[shard_for_user(user_id)].execution_options(sqlite_immediate=True).begin() as conn:
+            conn.execute(delete(_keys).where(_where(key), _keys.c.created_at < _expiry()))
+        stored = None
+
+    if stored is None:
+        row = models.IdempotencyKey(user_id=user_id, operation=operation, key=idempotency_key, fingerprint=fingerprint)
+        db.add(row)
+        try:
+            db.flush()
+        except IntegrityError:
+            # A concurrent request with the same key committed first, together
+            # with its response
+            db.rollback()
+            stored = _load(key)
+            if stored is None:
+                raise
+
+    if stored is not None:
+        yield IdempotentRequest(key, fingerprint, _replay(stored, fingerprint))
+        return
+
+    request = IdempotentRequest(key, fingerprint, None, db, row)
+    try:
+        yield request
+    finally:
+        request.close()
+
+def _prune_shard(db: Session):
+    deleted = db.execute(delete(_keys).where(_keys.c.created_at < _expiry())).rowcount
+    db.commit()
+    return deleted
+
+def prune_keys():
+    """
+    Delete keys older than IDEMPOTENCY_TTL_SECONDS from every shard
+
+    Returns:
+        int: Number of keys deleted
+    """
+    return sum(scatter_gather(_prune_shard, write=True))
@@ -0,0 +1,193 @@
+import logging
+import os
+from datetime import timedelta
+
+from sqlalchemy import select, delete, update, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import archive
+import models
+from database import SessionLocal, GLOBAL_SHARD, shard_for_user, scatter_gather
+from utils import ist_now
+
+logger = logging.getLogger(__name__)
+
+# Ledger entries older than this are folded into the per-user snapshot and
+# moved to the archive
+LEDGER_COMPACT_AFTER_DAYS = int(os.getenv("LEDGER_COMPACT_AFTER_DAYS", "90"))
+
+# How often compaction and reconciliation run (in seconds)
+LEDGER_INTERVAL_SECONDS = int(os.getenv("LEDGER_INTERVAL_SECONDS", str(24 * 60 * 60)))
+
+# Entry kinds
+OPENING = "opening"
+ADJUSTMENT = "adjustment"
+
+class InsufficientBalanceError(ValueError):
+    """Raised when a debit would take a balance below its minimum"""
+
+def to_paise(amount):
+    """Convert a rupee amount to integer paise"""
+    return int(round(amount * 100))
+
+def to_rupees(paise):
+    return paise / 100
+
+def get_balance_paise(db: Session, user_id: int):
+    """Return the cached balance of a user in paise, or None without a ledger"""
+    return db.query(models.LedgerBalance.balance_paise).filter(models.LedgerBalance.user_id == user_id).scalar()
+
+def _open_ledger(db: Session, user_id: int):
+    # Users that predate the ledger start from an opening entry carrying their
+    # existing balance
+    current_balance = db.query(models.User.current_balance).filter(models.User.id == user_id).scalar() or 0.0
+    opening = models.LedgerEntry(user_id=user_id, amount_paise=to_paise(current_balance), kind=OPENING)
+    db.add(opening)
+    db.flush()
+    db.execute(
+        sqlite_insert(models.LedgerBalance.__table__).values(user_id=user_id, balance_paise=opening.amount_paise, last_entry_id=opening.id),
+        bind_arguments={"shard_id": shard_for_user(user_id)}
+    )
+
+def post_entry(db: Session, user_id: int, amount_paise: int, kind: str, reference_id: str = None, min_balance_paise: int = None):
+    """
+    Append a ledger entry and apply it to the cached balance and to
+    ``User.current_balance`` within the caller's transaction (nothing is
+    committed here)
+
+    Args:
+        db (Session): Database session
+        user_id (int): Account holder
+        amount_paise (int): Signed amount, positive for credits
+        kind (str): Transaction or account transaction type, or "adjustment"
+        reference_id (str): Reference of the originating transaction
+        min_balance_paise (int): Lowest balance a debit may leave, if any
+
+    Returns:
+        int: New balance in paise
+
+    Raises:
+        InsufficientBalanceError: The debit would go below ``min_balance_paise``.
+            The entry is already added, so the caller rolls back.
+    """
+    if get_balance_paise(db, user_id) is None:
+        _open_ledger(db, user_id)
+
+    entry = models.LedgerEntry(user_id=user_id, amount_paise=amount_paise, kind=kind, reference_id=reference_id)
+    db.add(entry)
+    db.flush()
+
+    # The balance is changed by an increment in SQL, never written back from
+    # Python. The balance row of the user is the serialization point: each
+    # change applies on top of the last committed one. A debit is checked in
+    # the same statement, so concurrent debits cannot overdraw the account.
+    balances = models.LedgerBalance.__table__
+    stmt = update(balances).where(balances.c.user_id == user_id)
+    if min_balance_paise is not None and amount_paise < 0:
+        stmt = stmt.where(balances.c.balance_paise + amount_paise >= min_balance_paise)
+    balance_paise = db.execute(
+        stmt.values(balance_paise=balances.c.balance_paise + amount_paise, last_entry_id=entry.id)
+        .returning(balances.c.balance_paise),
+        bind_arguments={"shard_id": shard_for_user(user_id)}
+    ).scalar()
+    if balance_paise is None:
+        raise InsufficientBalanceError(f"Balance of user {user_id} too low for a debit of {-amount_paise} paise")
+
+    # User.current_balance mirrors the ledger for existing readers
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.current_balance: to_rupees(balance_paise)},
+        synchronize_session="fetch"
+    )
+    return balance_paise
+
+def get_entries(db: Session, user_id: int, skip: int = 0, limit: int = 100):
+    """Return the ledger entries of a user still in the database, newest first"""
+    return db.query(models.LedgerEntry).filter(
+        models.LedgerEntry.user_id == user_id
+    ).order_by(models.LedgerEntry.id.desc()).offset(skip).limit(limit).all()
+
+def _compact_shard(db: Session):
+    shard_id = db.info["shard_id"]
+    entries = models.LedgerEntry.__table__
+    cutoff = ist_now() - timedelta(days=LEDGER_COMPACT_AFTER_DAYS)
+
+    boundary = db.execute(select(func.max(entries.c.id)).where(entries.c.created_at < cutoff)).scalar()
+    if boundary is None:
+        return 0
+
+    # Keep the compacted entries auditable in the archive
+    import pyarrow.parquet as pq
+
+    schema = archive.arrow_schema(entries)
+    path = os.path.join(archive.ARCHIVE_DIR, entries.name, shard_id, f"upto-{boundary:012d}.parquet")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    result = db.execute(
+        select(*entries.columns).where(entries.c.id <= boundary).order_by(entries.c.user_id, entries.c.id),
+        execution_options={"yield_per": archive.ARCHIVE_BATCH_SIZE}
+    )
+    with pq.ParquetWriter(f"{path}.tmp", schema, compression="zstd") as writer:
+        for rows in result.partitions():
+            writer.write_batch(archive.rows_to_record_batch(rows, schema))
+    os.replace(f"{path}.tmp", path)
+
+    db.execute(text("""
+        INSERT INTO ledger_snapshots (user_id, balance_paise, last_entry_id, created_at)
+        SELECT user_id, SUM(amount_paise), MAX(id), :now FROM ledger_entries WHERE id <= :boundary GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            balance_paise = ledger_snapshots.balance_paise + excluded.balance_paise,
+            last_entry_id = excluded.last_entry_id,
+            created_at = excluded.created_at
+    """), {"now": ist_now(), "boundary": boundary})
+    compacted = db.execute(delete(entries).where(entries.c.id <= boundary)).rowcount
+    db.commit()
+    return compacted
+
+def compact_ledgers():
+    """
+    Fold ledger entries older than LEDGER_COMPACT_AFTER_DAYS into the
+    per-user snapshots, writing them to Parquet before deleting them
+
+    Returns:
+        int: Number of entries compacted
+    """
+    return sum(scatter_gather(_compact_shard, write=True))
+
+def _reconcile_shard(db: Session):
+    # Cached balance vs. snapshot + sum of the remaining entries, per user
+    rows = db.execute(text("""
+        SELECT b.user_id, b.balance_paise, COALESCE(s.balance_paise, 0) + COALESCE(e.total, 0)
+        FROM ledger_balances b
+        LEFT JOIN ledger_snapshots s ON s.user_id = b.user_id
+        LEFT JOIN (SELECT user_id, SUM(amount_paise) AS total FROM ledger_entries GROUP BY user_id) e ON e.user_id = b.user_id
+    """)).all()
+    return [(user_id, cached, expected) for user_id, cached, expected in rows]
+
+def reconcile_ledgers():
+    """
+    Verify every cached balance against the sum of its ledger, and the
+    ``User.current_balance`` mirror against the cached balance
+
+    Returns:
+        dict: Number of accounts checked and the mismatches found
+    """
+    balances = [row for shard_rows in scatter_gather(_reconcile_shard) for row in shard_rows]
+    mismatches = [
+        {"user_id": user_id, "cached_paise": cached, "ledger_paise": expected}
+        for user_id, cached, expected in balances if cached != expected
+    ]
+
+    db = SessionLocal()
+    try:
+        conn = db.connection(bind_arguments={"shard_id": GLOBAL_SHARD})
+        mirrors = dict(conn.execute(select(models.User.id, models.User.current_balance)).all())
+    finally:
+        db.close()
+    mismatches += [
+        {"user_id": user_id, "cached_paise": cached, "user_balance": mirrors[user_id]}
+        for user_id, cached, _ in balances if user_id in mirrors and to_paise(mirrors[user_id]) != cached
+    ]
+
+    for mismatch in mismatches:
+        logger.error("Ledger mismatch: %s", mismatch)
+    return {"accounts": len(balances), "mismatches": mismatches}
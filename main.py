@@ -1,24 +1,49 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+
+from fastapi import FastAPI, Depends, File, Header, HTTPException, Query, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel
 
+import alerts
+import archive
+import charging
 import crud
+import exports
+import forecasting
 import models
 import schemas
-import googlemapsapi
-from database import get_db, init_db
+import idempotency
+import ledger
+import metrics
+import notification_hub
+import notification_writer
+import plan_catalog
+import plaza_import
+import pricing
+import profiling
+import ratelimit
+import rollups
+import scheduler
+import traffic_rollups
+import traffic_writer
+from database import get_db, get_read_db, init_db, SEED_DUMMY_DATA
+from utils import ist_now, to_ist_naive
 from auth import (
     authenticate_user,
     create_access_token,
     get_current_active_user,
+    get_current_admin_user,
+    get_current_streaming_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from dummy_data import create_dummy_data
-from export_dummy_data import export_database_to_sql
+# googlemapsapi, analytics, dummy_data and export_dummy_data (and with them
+# googlemaps, requests and the seeding code) are imported where they are
+# used, so that they stay off the startup path
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -27,6 +52,17 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Endpoints can be profiled per request (see profiling.ProfilingMiddleware)
+app.router.route_class = profiling.ProfiledRoute
+
+# Per-request profiling for admins (added first so that it sits closest to
+# the endpoints)
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Rate limiting and load shedding (added before CORS so that CORS headers wrap its
+# 429/503 responses)
+app.add_middleware(ratelimit.RateLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -36,16 +72,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics (added last so that it also times rate limited requests)
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Initialize database on startup
 @app.on_event("startup")
 def startup_event():
     init_db()
-    # Load dummy data if the database is empty
-    create_dummy_data()
+    # Load dummy data if enabled and the database is empty
+    if SEED_DUMMY_DATA:
+        from dummy_data import create_dummy_data
+        create_dummy_data()
+    # Price all plazas from their current traffic state
+    pricing.recompute_prices()
+    # Deliver new notifications to streaming clients
+    notification_hub.hub.bind(asyncio.get_running_loop())
+    # Write notifications in batches in the background
+    notification_writer.start()
+    # Write buffered traffic samples in bulk in the background
+    traffic_writer.start()
+    # Start background jobs
+    scheduler.register_job("archive_closed_months", archive.ARCHIVE_INTERVAL_SECONDS, archive.archive_closed_months)
+    scheduler.register_job("recompute_prices", pricing.PRICING_INTERVAL_SECONDS, pricing.recompute_prices)
+    scheduler.register_job("alerts", alerts.ALERT_INTERVAL_SECONDS, alerts.run_alert_jobs)
+    scheduler.register_job("compact_ledgers", ledger.LEDGER_INTERVAL_SECONDS, ledger.compact_ledgers)
+    scheduler.register_job("reconcile_ledgers", ledger.LEDGER_INTERVAL_SECONDS, ledger.reconcile_ledgers)
+    scheduler.register_job("traffic_rollups", traffic_rollups.TRAFFIC_ROLLUP_INTERVAL_SECONDS, traffic_rollups.run_traffic_rollups)
+    scheduler.register_job("forecasts", forecasting.FORECAST_INTERVAL_SECONDS, forecasting.refresh_forecasts)
+    scheduler.register_job("prune_idempotency_keys", idempotency.IDEMPOTENCY_PRUNE_INTERVAL_SECONDS, idempotency.prune_keys)
+    scheduler.start()
+    # Keep sampling stacks in the background when configured
+    if profiling.SAMPLE_CONTINUOUS:
+        profiling.sampler.start(window_seconds=profiling.SAMPLE_WINDOW_SECONDS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    await asyncio.to_thread(profiling.sampler.stop)
+    # Write notifications still waiting in the queue
+    await asyncio.to_thread(notification_writer.stop)
+    # Write buffered traffic samples
+    await asyncio.to_thread(traffic_writer.stop)
 
 # Authentication endpoints
+# Login only reads, so it does not take the write lock while hashing
 @app.post("/api/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_read_db)):
     user = authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
@@ -82,6 +154,22 @@ def update_user_endpoint(
 ):
     return crud.update_user(db=db, user_id=current_user.id, user=user)
 
+@app.get("/api/users/me/ledger", response_model=List[schemas.LedgerEntry])
+def read_ledger(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return ledger.get_entries(db, user_id=current_user.id, skip=skip, limit=limit)
+
+@app.get("/api/users/me/plan-usage")
+def read_plan_usage(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return charging.get_plan_usage(db, current_user)
+
 # Vehicle endpoints
 @app.get("/api/vehicles", response_model=List[schemas.Vehicle])
 def read_vehicles(
@@ -100,9 +188,9 @@ def create_vehicle_endpoint(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Check if user has reached max vehicles limit based on subscription plan
-    user_plan = crud.get_plan(db, current_user.subscription_plan_id) if current_user.subscription_plan_id else None
+    user_plan = plan_catalog.get_plan(current_user.subscription_plan_id) if current_user.subscription_plan_id else None
     if user_plan:
-        user_vehicles_count = len(crud.get_vehicles_by_user(db, user_id=current_user.id))
+        user_vehicles_count = crud.count_vehicles_by_user(db, user_id=current_user.id)
         if user_vehicles_count >= user_plan.max_vehicles:
             raise HTTPException(
                 status_code=400,
@@ -156,7 +244,7 @@ def read_toll_plazas(
 ):
     return crud.get_toll_plazas(db, skip=skip, limit=limit)
 
-@app.get("/api/toll-plazas/{toll_plaza_id}", response_model=schemas.TollPlaza)
+@app.get("/api/toll-plazas/{toll_plaza_id}", response_model=schemas.TollPlazaDetail)
 def read_toll_plaza(
     toll_plaza_id: int,
     db: Session = Depends(get_db)
@@ -164,7 +252,30 @@ def read_toll_plaza(
     toll_plaza = crud.get_toll_plaza(db, toll_plaza_id=toll_plaza_id)
     if toll_plaza is None:
         raise HTTPException(status_code=404, detail="Toll Plaza not found")
-    return toll_plaza
+    return {
+        **schemas.TollPlaza.model_validate(toll_plaza, from_attributes=True).model_dump(),
+        "forecast": forecasting.get_forecasts(db, toll_plaza_id)
+    }
+
+@app.get("/api/toll-plazas/{toll_plaza_id}/traffic", response_model=schemas.TrafficSeries)
+def read_toll_plaza_traffic(
+    toll_plaza_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = Query(None, description="raw, 1m, 1h or 1d; picked from the range when omitted"),
+    db: Session = Depends(get_db)
+):
+    # Times are IST; the default range is the last 24 hours
+    end = to_ist_naive(end) if end is not None else ist_now()
+    start = to_ist_naive(start) if start is not None else end - timedelta(days=1)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if crud.get_toll_plaza(db, toll_plaza_id=toll_plaza_id) is None:
+        raise HTTPException(status_code=404, detail="Toll Plaza not found")
+    try:
+        return traffic_rollups.get_traffic_series(db, toll_plaza_id, start, end, resolution=resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Admin-only endpoints for creating/updating toll plazas
 @app.post("/api/admin/toll-plazas", response_model=schemas.TollPlaza)
@@ -177,6 +288,17 @@ def create_toll_plaza_endpoint(
     # For now, we'll just create the toll plaza
     return crud.create_toll_plaza(db=db, toll_plaza=toll_plaza)
 
+@app.post("/api/admin/toll-plazas/import")
+def import_toll_plazas_endpoint(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv or ndjson; taken from the file name when omitted"),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    try:
+        return plaza_import.import_toll_plazas(file.file, format or plaza_import.guess_format(file.filename))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.put("/api/admin/toll-plazas/{toll_plaza_id}", response_model=schemas.TollPlaza)
 def update_toll_plaza_endpoint(
     toll_plaza_id: int,
@@ -195,17 +317,15 @@ def update_toll_plaza_endpoint(
 @app.get("/api/plans", response_model=List[schemas.Plan])
 def read_plans(
     skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    limit: int = 100
 ):
-    return crud.get_plans(db, skip=skip, limit=limit)
+    return plan_catalog.get_plans(skip=skip, limit=limit)
 
 @app.get("/api/plans/{plan_id}", response_model=schemas.Plan)
 def read_plan(
-    plan_id: int,
-    db: Session = Depends(get_db)
+    plan_id: int
 ):
-    plan = crud.get_plan(db, plan_id=plan_id)
+    plan = plan_catalog.get_plan(plan_id)
     if plan is None:
         raise HTTPException(status_code=404, detail="Plan not found")
     return plan
@@ -228,11 +348,11 @@ def update_plan_endpoint(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # In a real app, you'd check if the user is an admin here
-    db_plan = crud.get_plan(db, plan_id=plan_id)
+    db_plan = crud.update_plan(db=db, plan_id=plan_id, plan=plan)
     if db_plan is None:
         raise HTTPException(status_code=404, detail="Plan not found")
     
-    return crud.update_plan(db=db, plan_id=plan_id, plan=plan)
+    return db_plan
 
 # Transaction endpoints
 @app.get("/api/transactions", response_model=List[schemas.Transaction])
@@ -247,35 +367,77 @@ def read_transactions(
 @app.post("/api/transactions", response_model=schemas.Transaction)
 def create_transaction_endpoint(
     transaction: schemas.TransactionCreate,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Validate that the vehicle belongs to the user
-    vehicle = crud.get_vehicle(db, vehicle_id=transaction.vehicle_id)
-    if vehicle is None or vehicle.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    
-    # Validate the toll plaza exists
-    toll_plaza = crud.get_toll_plaza(db, toll_plaza_id=transaction.toll_plaza_id)
-    if toll_plaza is None:
-        raise HTTPException(status_code=404, detail="Toll Plaza not found")
-    
-    # Check if the user has enough balance for a toll payment
-    if transaction.transaction_type == schemas.TransactionType.TOLL_PAYMENT and current_user.current_balance < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-    
-    # Create the transaction
-    db_transaction = crud.create_transaction(db=db, transaction=transaction, user_id=current_user.id)
-    
-    # Create notification
-    if transaction.transaction_type == schemas.TransactionType.TOLL_PAYMENT:
-        notification = schemas.NotificationCreate(
-            message=f"Toll payment of ${transaction.amount:.2f} completed successfully at {toll_plaza.name}",
-            type=schemas.NotificationType.TRANSACTION_COMPLETE
-        )
-        crud.create_notification(db=db, notification=notification, user_id=current_user.id)
-    
-    return db_transaction
+    # Retries with the same Idempotency-Key get the stored response
+    with idempotency.guard(db, current_user.id, "transactions", idempotency_key, transaction) as request:
+        if request.replay is not None:
+            return request.replay
+        
+        # Validate that the vehicle belongs to the user
+        vehicle = crud.get_vehicle(db, vehicle_id=transaction.vehicle_id)
+        if vehicle is None or vehicle.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
+        
+        # Validate the toll plaza exists
+        toll_plaza = crud.get_toll_plaza(db, toll_plaza_id=transaction.toll_plaza_id)
+        if toll_plaza is None:
+            raise HTTPException(status_code=404, detail="Toll Plaza not found")
+        
+        # Apply the free passes or discount of the user's plan to toll payments
+        charge = None
+        if transaction.transaction_type == schemas.TransactionType.TOLL_PAYMENT:
+            charge = charging.charge_toll(db, current_user, transaction.amount)
+            transaction = transaction.model_copy(update={"amount": charge["amount"]})
+        
+        # Create the transaction. The balance is checked and debited in one
+        # statement; when it is too low, the free pass is given back too.
+        # The response is stored with the key in the same commit.
+        request.respond_with(models.Transaction, schemas.Transaction)
+        try:
+            db_transaction = crud.create_transaction(db=db, transaction=transaction, user_id=current_user.id)
+        except ledger.InsufficientBalanceError:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+        
+        # Create notification
+        if charge is not None:
+            if charge["free_pass"]:
+                message = f"Toll at {toll_plaza.name} covered by a free pass of your plan"
+            else:
+                message = f"Toll payment of ${transaction.amount:.2f} completed successfully at {toll_plaza.name}"
+            notification = schemas.NotificationCreate(
+                message=message,
+                type=schemas.NotificationType.TRANSACTION_COMPLETE
+            )
+            notification_writer.enqueue(current_user.id, notification)
+        
+        return request.save(schemas.Transaction.model_validate(db_transaction, from_attributes=True))
+
+@app.get("/api/transactions/export")
+def export_transactions(
+    format: str = Query("arrow", description="arrow (Arrow IPC stream) or parquet"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: models.User = Depends(get_current_streaming_user)
+):
+    # Whole trip history (or a range of it, times in IST) streamed in record
+    # batches, archived months included
+    start = to_ist_naive(start) if start is not None else None
+    end = to_ist_naive(end) if end is not None else None
+    if start is not None and end is not None and end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    try:
+        chunks = exports.stream_transactions(current_user.id, format, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, extension = exports.FORMATS[format]
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{extension}"'}
+    )
 
 @app.get("/api/transactions/{transaction_id}", response_model=schemas.Transaction)
 def read_transaction(
@@ -344,35 +506,46 @@ def read_account_transactions(
 @app.post("/api/account-transactions", response_model=schemas.AccountTransaction)
 def create_account_transaction_endpoint(
     account_transaction: schemas.AccountTransactionCreate,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Validate payment method if provided
-    if account_transaction.payment_method_id:
-        payment_method = crud.get_payment_method(db, payment_method_id=account_transaction.payment_method_id)
-        if payment_method is None or payment_method.user_id != current_user.id:
-            raise HTTPException(status_code=404, detail="Payment Method not found")
-    
-    # Create the account transaction
-    db_account_transaction = crud.create_account_transaction(db=db, account_transaction=account_transaction, user_id=current_user.id)
-    
-    # Create notification for deposit
-    if account_transaction.type == schemas.AccountTransactionType.DEPOSIT:
-        notification = schemas.NotificationCreate(
-            message=f"Account recharge of ${account_transaction.amount:.2f} completed successfully",
-            type=schemas.NotificationType.TRANSACTION_COMPLETE
-        )
-        crud.create_notification(db=db, notification=notification, user_id=current_user.id)
-    
-    # Check if balance is low after withdrawal
-    if account_transaction.type == schemas.AccountTransactionType.WITHDRAWAL and current_user.current_balance < 10.0:
-        notification = schemas.NotificationCreate(
-            message="Your account balance is running low. Please recharge to continue using toll services.",
-            type=schemas.NotificationType.BALANCE_LOW
-        )
-        crud.create_notification(db=db, notification=notification, user_id=current_user.id)
-    
-    return db_account_transaction
+    # Retries with the same Idempotency-Key get the stored response
+    with idempotency.guard(db, current_user.id, "account-transactions", idempotency_key, account_transaction) as request:
+        if request.replay is not None:
+            return request.replay
+        
+        # Validate payment method if provided
+        if account_transaction.payment_method_id:
+            payment_method = crud.get_payment_method(db, payment_method_id=account_transaction.payment_method_id)
+            if payment_method is None or payment_method.user_id != current_user.id:
+                raise HTTPException(status_code=404, detail="Payment Method not found")
+        
+        # Create the account transaction. The response is stored with the key
+        # in the same commit.
+        request.respond_with(models.AccountTransaction, schemas.AccountTransaction)
+        try:
+            db_account_transaction = crud.create_account_transaction(db=db, account_transaction=account_transaction, user_id=current_user.id)
+        except ledger.InsufficientBalanceError:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+        
+        # Create notification for deposit
+        if account_transaction.type == schemas.AccountTransactionType.DEPOSIT:
+            notification = schemas.NotificationCreate(
+                message=f"Account recharge of ${account_transaction.amount:.2f} completed successfully",
+                type=schemas.NotificationType.TRANSACTION_COMPLETE
+            )
+            notification_writer.enqueue(current_user.id, notification)
+        
+        # Check if balance is low after withdrawal
+        if account_transaction.type == schemas.AccountTransactionType.WITHDRAWAL and current_user.current_balance < 10.0:
+            notification = schemas.NotificationCreate(
+                message="Your account balance is running low. Please recharge to continue using toll services.",
+                type=schemas.NotificationType.BALANCE_LOW
+            )
+            notification_writer.enqueue(current_user.id, notification)
+        
+        return request.save(schemas.AccountTransaction.model_validate(db_account_transaction, from_attributes=True))
 
 # Traffic Data endpoints (for admin use)
 @app.post("/api/admin/traffic-data", response_model=schemas.TrafficData)
@@ -389,6 +562,28 @@ def create_traffic_data_endpoint(
     
     return crud.create_traffic_data(db=db, traffic_data=traffic_data)
 
+@app.post("/api/admin/traffic-data/samples", status_code=status.HTTP_202_ACCEPTED)
+def ingest_traffic_samples_endpoint(
+    samples: List[schemas.TrafficDataCreate],
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    # Validate the toll plazas exist, which also bounds the number of buffers
+    plaza_ids = {sample.toll_plaza_id for sample in samples}
+    if len(crud.get_existing_toll_plaza_ids(db, plaza_ids)) != len(plaza_ids):
+        raise HTTPException(status_code=404, detail="Toll Plaza not found")
+    
+    # Written in bulk by the traffic writer within TRAFFIC_FLUSH_MS
+    dropped = traffic_writer.enqueue(samples)
+    return {"accepted": len(samples), "dropped": dropped}
+
+@app.post("/api/admin/pricing/recompute")
+def recompute_prices_endpoint(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    return {"updated": pricing.recompute_prices(db)}
+
 # Notification endpoints
 @app.get("/api/notifications", response_model=List[schemas.Notification])
 def read_notifications(
@@ -400,6 +595,23 @@ def read_notifications(
 ):
     return crud.get_notifications_by_user(db, user_id=current_user.id, skip=skip, limit=limit, unread_only=unread_only)
 
+@app.get("/api/notifications/unread-count")
+def read_unread_notification_count(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return {"unread_count": crud.get_unread_count(db, user_id=current_user.id)}
+
+@app.get("/api/notifications/stream")
+async def stream_notifications(current_user: models.User = Depends(get_current_streaming_user)):
+    # Server-Sent Events stream of new notifications
+    subscription = notification_hub.hub.subscribe(current_user.id)
+    return StreamingResponse(
+        notification_hub.event_stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.put("/api/notifications/{notification_id}/read", response_model=schemas.Notification)
 def mark_notification_as_read_endpoint(
     notification_id: int,
@@ -440,6 +652,7 @@ def get_traffic_data(
     request: TrafficRequest,
     current_user: models.User = Depends(get_current_active_user)
 ):
+    import googlemapsapi
     traffic_data = googlemapsapi.get_traffic_details(request.location)
     
     if "error" in traffic_data:
@@ -453,6 +666,7 @@ def get_route_data(
     request: RouteRequest,
     current_user: models.User = Depends(get_current_active_user)
 ):
+    import googlemapsapi
     route_data = googlemapsapi.get_route(request.origin, request.destination)
     
     if "error" in route_data:
@@ -466,6 +680,7 @@ def get_nearby_toll_plazas_data(
     request: NearbyTollPlazasRequest,
     current_user: models.User = Depends(get_current_active_user)
 ):
+    import googlemapsapi
     toll_plazas_data = googlemapsapi.get_nearby_toll_plazas(request.location, request.radius)
     
     if "error" in toll_plazas_data:
@@ -493,23 +708,21 @@ def search_toll_plazas(
 def get_toll_pricing(
     toll_plaza_id: int,
     vehicle_type: schemas.VehicleType,
+    plan_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
     toll_plaza = crud.get_toll_plaza(db, toll_plaza_id=toll_plaza_id)
     if toll_plaza is None:
         raise HTTPException(status_code=404, detail="Toll Plaza not found")
     
-    # Apply vehicle type multiplier
-    multipliers = {
-        schemas.VehicleType.CAR: 1.0,
-        schemas.VehicleType.MOTORCYCLE: 0.5,
-        schemas.VehicleType.TRUCK: 2.0,
-        schemas.VehicleType.BUS: 1.5,
-        schemas.VehicleType.OTHER: 1.0
-    }
+    plan = None
+    if plan_id is not None:
+        plan = plan_catalog.get_plan(plan_id)
+        if plan is None:
+            raise HTTPException(status_code=404, detail="Plan not found")
     
-    vehicle_multiplier = multipliers.get(vehicle_type, 1.0)
-    final_price = toll_plaza.current_price * vehicle_multiplier
+    # Apply vehicle type multiplier and plan discount
+    price = pricing.quote(toll_plaza.current_price, vehicle_type, plan)
     
     return {
         "toll_plaza_id": toll_plaza.id,
@@ -517,10 +730,12 @@ def get_toll_pricing(
         "base_price": toll_plaza.base_price,
         "current_price": toll_plaza.current_price,
         "vehicle_type": vehicle_type,
-        "vehicle_multiplier": vehicle_multiplier,
-        "final_price": final_price,
+        "vehicle_multiplier": price["vehicle_multiplier"],
+        "plan_discount": price["plan_discount"],
+        "final_price": price["final_price"],
         "busy_level": toll_plaza.busy_level,
-        "estimated_wait_time": toll_plaza.estimated_time
+        "estimated_wait_time": toll_plaza.estimated_time,
+        "forecast": forecasting.get_forecasts(db, toll_plaza_id)
     }
 
 # User statistics endpoint
@@ -529,21 +744,18 @@ def get_user_statistics(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Get all transactions for the user
-    transactions = crud.get_transactions_by_user(db, user_id=current_user.id)
+    # Get per-vehicle totals from the daily spend rollup
+    spend_by_vehicle = rollups.get_spend_totals(db, user_id=current_user.id)
     
     # Get all vehicles for the user
     vehicles = crud.get_vehicles_by_user(db, user_id=current_user.id)
     
     # Calculate statistics
-    total_toll_payments = sum(t.amount for t in transactions if t.transaction_type == "toll payment" and t.status == "completed")
-    total_trips = len([t for t in transactions if t.transaction_type == "toll payment" and t.status == "completed"])
+    total_toll_payments = sum(amount for _, _, amount in spend_by_vehicle)
+    total_trips = sum(trips for _, trips, _ in spend_by_vehicle)
     
     # Get most used vehicle
-    vehicle_usage = {}
-    for t in transactions:
-        if t.transaction_type == "toll payment" and t.status == "completed":
-            vehicle_usage[t.vehicle_id] = vehicle_usage.get(t.vehicle_id, 0) + 1
+    vehicle_usage = {vehicle_id: trips for vehicle_id, trips, _ in spend_by_vehicle if trips > 0}
     
     most_used_vehicle_id = max(vehicle_usage.items(), key=lambda x: x[1])[0] if vehicle_usage else None
     most_used_vehicle = next((v for v in vehicles if v.id == most_used_vehicle_id), None) if most_used_vehicle_id else None
@@ -572,28 +784,15 @@ def get_monthly_report(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Get all transactions for the user in the specified month
-    transactions = crud.get_transactions_by_user(db, user_id=current_user.id)
-    
-    # Filter transactions for the specified month
-    filtered_transactions = [
-        t for t in transactions 
-        if t.timestamp.year == year and t.timestamp.month == month
-    ]
+    # Get the daily spend rollup rows for the specified month
+    spend_by_day = [(day, trips, amount) for day, trips, amount in rollups.get_daily_spend(db, user_id=current_user.id, year=year, month=month) if trips > 0]
     
     # Calculate statistics
-    total_toll_payments = sum(t.amount for t in filtered_transactions if t.transaction_type == "toll payment" and t.status == "completed")
-    total_trips = len([t for t in filtered_transactions if t.transaction_type == "toll payment" and t.status == "completed"])
-    
-    # Get transactions by day of month
-    transactions_by_day = {}
-    for t in filtered_transactions:
-        if t.transaction_type == "toll payment" and t.status == "completed":
-            day = t.timestamp.day
-            transactions_by_day[day] = transactions_by_day.get(day, 0) + t.amount
+    total_toll_payments = sum(amount for _, _, amount in spend_by_day)
+    total_trips = sum(trips for _, trips, _ in spend_by_day)
     
     # Format the response
-    daily_data = [{"day": day, "amount": amount} for day, amount in transactions_by_day.items()]
+    daily_data = [{"day": day.day, "amount": amount} for day, _, amount in spend_by_day]
     
     return {
         "user_id": current_user.id,
@@ -605,9 +804,81 @@ def get_monthly_report(
         "daily_data": daily_data
     }
 
+# Admin endpoint for platform-wide statistics across all shards
+@app.get("/api/admin/statistics")
+def get_platform_statistics_endpoint(current_user: models.User = Depends(get_current_active_user)):
+    # In a real app, you'd check if the user is an admin here
+    return crud.get_platform_statistics()
+
+# Admin plaza analytics endpoint
+@app.get("/api/admin/analytics/plazas")
+def get_plaza_analytics_endpoint(
+    start_date: date,
+    end_date: date,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    # In a real app, you'd check if the user is an admin here
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    import analytics
+    return analytics.get_plaza_analytics(db, start_date=start_date, end_date=end_date)
+
 # Admin endpoint to export database
 @app.get("/api/admin/export-data")
 def export_database_endpoint(current_user: models.User = Depends(get_current_active_user)):
     # In a real app, you'd check if the user is an admin here
+    from export_dummy_data import export_database_to_sql
     result = export_database_to_sql()
     return {"message": result}
+
+# Admin endpoints for request profiles captured with the X-Profile header
+@app.get("/api/admin/profiles")
+def list_profiles_endpoint(current_user: models.User = Depends(get_current_admin_user)):
+    return profiling.list_captures()
+
+@app.get("/api/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile_endpoint(profile_id: int, current_user: models.User = Depends(get_current_admin_user)):
+    stats = profiling.get_capture(profile_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return stats
+
+# Admin endpoints for the sampling profiler
+@app.get("/api/admin/profiler")
+def get_profiler_status_endpoint(current_user: models.User = Depends(get_current_admin_user)):
+    return profiling.sampler.status()
+
+@app.post("/api/admin/profiler/start")
+def start_profiler_endpoint(
+    seconds: int = Query(60, ge=1, le=profiling.SAMPLE_MAX_SECONDS),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    if not profiling.sampler.start(seconds=seconds):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return profiling.sampler.status()
+
+@app.post("/api/admin/profiler/stop")
+def stop_profiler_endpoint(current_user: models.User = Depends(get_current_admin_user)):
+    profiling.sampler.stop()
+    return profiling.sampler.status()
+
+@app.get("/api/admin/profiler/flamegraph")
+def download_flamegraph_endpoint(
+    format: str = Query("svg", pattern="^(svg|folded)$"),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    folded = profiling.sampler.folded()
+    if format == "folded":
+        return Response(content=folded, media_type="text/plain", headers={"Content-Disposition": 'attachment; filename="profile.folded"'})
+    return Response(
+        content=profiling.render_flamegraph(folded),
+        media_type="image/svg+xml",
+        headers={"Content-Disposition": 'attachment; filename="flamegraph.svg"'}
+    )
+
+# Prometheus metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    content, media_type = metrics.render()
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,79 @@
+import argparse
+
+import alerts
+import archive
+import forecasting
+import ledger
+import plaza_import
+import rollups
+import traffic_rollups
+from database import init_db
+
+def main():
+    """
+    Management commands for maintenance and backfills
+
+    Usage:
+        python manage.py rebuild-rollups
+        python manage.py archive
+        python manage.py alerts
+        python manage.py compact-ledgers
+        python manage.py reconcile-ledgers
+        python manage.py rollup-traffic
+        python manage.py forecast
+        python manage.py import-plazas plazas.csv
+        python manage.py seed
+    """
+    parser = argparse.ArgumentParser(description="TollEasy management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild-rollups", help="Recompute the user daily spend rollup from all transactions")
+    subparsers.add_parser("archive", help="Move closed months of transactions to Parquet")
+    subparsers.add_parser("alerts", help="Expire ended subscriptions and send expiry / low-balance alerts")
+    subparsers.add_parser("compact-ledgers", help="Fold old ledger entries into snapshots and archive them")
+    subparsers.add_parser("reconcile-ledgers", help="Check cached balances against the ledger")
+    subparsers.add_parser("rollup-traffic", help="Roll up new traffic samples and drop traffic data past its retention")
+    subparsers.add_parser("forecast", help="Fit the wait time forecasts and store them")
+    import_parser = subparsers.add_parser("import-plazas", help="Insert or update toll plazas from a CSV or NDJSON file")
+    import_parser.add_argument("path", help="CSV or NDJSON file")
+    import_parser.add_argument("--format", choices=plaza_import.FORMATS, help="File format (default: from the extension)")
+    subparsers.add_parser("seed", help="Load dummy data into an empty database")
+    args = parser.parse_args()
+
+    init_db()
+
+    if args.command == "rebuild-rollups":
+        rows = rollups.rebuild_user_daily_spend()
+        print(f"Rebuilt user daily spend rollup ({rows} rows)")
+    elif args.command == "archive":
+        partitions = archive.archive_closed_months()
+        print(f"Archived {partitions} monthly partitions")
+    elif args.command == "alerts":
+        counts = alerts.run_alert_jobs()
+        print(f"Expired {counts['expired']} subscriptions, sent {counts['expiring']} expiry and {counts['low_balance']} low-balance alerts")
+    elif args.command == "compact-ledgers":
+        entries = ledger.compact_ledgers()
+        print(f"Compacted {entries} ledger entries")
+    elif args.command == "reconcile-ledgers":
+        result = ledger.reconcile_ledgers()
+        print(f"Checked {result['accounts']} accounts, {len(result['mismatches'])} mismatches")
+    elif args.command == "rollup-traffic":
+        result = traffic_rollups.run_traffic_rollups()
+        print(f"Rolled up {result['rolled_up']} traffic samples, deleted {result['deleted']} expired rows")
+    elif args.command == "forecast":
+        plazas = forecasting.refresh_forecasts()
+        print(f"Stored forecasts for {plazas} toll plazas")
+    elif args.command == "import-plazas":
+        with open(args.path, "rb") as stream:
+            try:
+                result = plaza_import.import_toll_plazas(stream, args.format or plaza_import.guess_format(args.path))
+            except ValueError as e:
+                parser.error(str(e))
+        for error in result["errors"]:
+            print(f"Line {error['line']}: {error['error']}")
+        print(f"Inserted {result['inserted']} and updated {result['updated']} toll plazas, skipped {result['invalid']} invalid rows, repriced {result['repriced']}")
+    elif args.command == "seed":
+        from dummy_data import create_dummy_data
+        create_dummy_data()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ratelimit import STREAMING_PATHS
+
+logger = logging.getLogger(__name__)
+
+# Queries slower than this are logged with the route that issued them (in seconds)
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.2"))
+
+# Route label of queries issued outside of a request (scheduler, writers)
+BACKGROUND = "background"
+
+# Route label of requests that did not match any route, so that random
+# paths cannot blow up the number of series
+UNMATCHED = "unmatched"
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency", ["method", "route", "status"]
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size", ["method", "route"],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000)
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being processed", multiprocess_mode="livesum")
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Duration of single database queries", ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Database queries issued by one request", ["route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "Time spent in database queries by one request", ["route"]
+)
+SLOW_QUERIES = Counter("db_slow_queries_total", "Queries slower than SLOW_QUERY_SECONDS", ["route"])
+MAPS_REQUEST_DURATION = Histogram(
+    "google_maps_request_duration_seconds", "Latency of Google Maps API calls", ["api", "status"]
+)
+
+class RequestStats:
+    """Database usage of the request being processed"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    @property
+    def route(self):
+        # Set by the router once the request is matched
+        route = self.scope.get("route")
+        return route.path if route is not None else UNMATCHED
+
+# The stats object is shared by reference with the threadpool running sync
+# endpoints, so their queries are counted too
+_current_request = ContextVar("current_request", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current_request.get()
+    route = BACKGROUND
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+        route = stats.route
+
+    DB_QUERY_DURATION.labels(route).observe(elapsed)
+    if elapsed >= SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.labels(route).inc()
+        logger.warning("Slow query (%.1f ms) from %s: %s", elapsed * 1000, route, " ".join(statement.split()))
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # after_cursor_execute is not called for failed statements
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+def observe_maps_response(response, *args, **kwargs):
+    """``requests`` response hook recording the latency of a Google Maps call"""
+    MAPS_REQUEST_DURATION.labels(urlparse(response.url).path, str(response.status_code)).observe(
+        response.elapsed.total_seconds()
+    )
+    return response
+
+def render():
+    """Return the metrics in the Prometheus text format with their content type"""
+    # With several workers (see gunicorn.conf.py) each one writes its metrics
+    # to PROMETHEUS_MULTIPROC_DIR and they are added up here
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, response size and database usage per
+    route. Streaming responses are only counted by the database metrics,
+    their duration is the lifetime of the connection.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current_request.set(stats)
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        streaming = scope["path"] in STREAMING_PATHS
+        if not streaming:
+            REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_request.reset(token)
+            route = stats.route
+            method = scope["method"]
+            if not streaming:
+                REQUESTS_IN_FLIGHT.dec()
+                REQUEST_DURATION.labels(method, route, str(status_code)).observe(elapsed)
+                RESPONSE_SIZE.labels(method, route).observe(size)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.query_seconds)
@@ -1,13 +1,29 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Enum, JSON
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Enum, JSON, Index
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
 from datetime import datetime
-from utils import get_ist_now
+from utils import IST, ist_now
 
 Base = declarative_base()
 
+class ISTDateTime(TypeDecorator):
+    """
+    DateTime stored as a naive IST wall clock time (see utils.IST). Aware
+    values, such as API input with an offset, are converted to IST when
+    bound, so that every value of a column, and every range compared with
+    it, is on the same clock.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(IST).replace(tzinfo=None)
+        return value
+
 class SubscriptionStatus(str, enum.Enum):
     ACTIVE = "active"
     EXPIRED = "expired"
@@ -54,13 +70,13 @@ class User(Base):
     name = Column(String)
     phone_number = Column(String)
     address = Column(String)
-    current_balance = Column(Float, default=0.0)
-    created_at = Column(DateTime, default=get_ist_now)
-    updated_at = Column(DateTime, default=get_ist_now, onupdate=get_ist_now)
+    current_balance = Column(Float, default=0.0, index=True)
+    created_at = Column(ISTDateTime, default=ist_now)
+    updated_at = Column(ISTDateTime, default=ist_now, onupdate=ist_now)
     subscription_plan_id = Column(Integer, ForeignKey("plans.id"), nullable=True)
     subscription_status = Column(String, default=SubscriptionStatus.ACTIVE)
-    subscription_start_date = Column(DateTime, nullable=True)
-    subscription_end_date = Column(DateTime, nullable=True)
+    subscription_start_date = Column(ISTDateTime, nullable=True)
+    subscription_end_date = Column(ISTDateTime, nullable=True, index=True)
 
     # Relationships
     vehicles = relationship("Vehicle", back_populates="user")
@@ -74,7 +90,7 @@ class Vehicle(Base):
     __tablename__ = "vehicles"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     license_plate = Column(String, unique=True, index=True)
     vehicle_type = Column(String)
     make = Column(String)
@@ -83,8 +99,8 @@ class Vehicle(Base):
     color = Column(String)
     transponder_id = Column(String, unique=True)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=get_ist_now)
-    updated_at = Column(DateTime, default=get_ist_now, onupdate=get_ist_now)
+    created_at = Column(ISTDateTime, default=ist_now)
+    updated_at = Column(ISTDateTime, default=ist_now, onupdate=ist_now)
 
     # Relationships
     user = relationship("User", back_populates="vehicles")
@@ -129,7 +145,7 @@ class Transaction(Base):
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"))
     toll_plaza_id = Column(Integer, ForeignKey("toll_plazas.id"))
     amount = Column(Float)
-    timestamp = Column(DateTime, default=get_ist_now)
+    timestamp = Column(ISTDateTime, default=ist_now, index=True)
     status = Column(String, default=TransactionStatus.PENDING)
     transaction_type = Column(String)
     payment_method = Column(String, nullable=True)
@@ -140,6 +156,41 @@ class Transaction(Base):
     vehicle = relationship("Vehicle", back_populates="transactions")
     toll_plaza = relationship("TollPlaza", back_populates="transactions")
 
+    # Monthly partitions of a user's transactions are range scans on this index
+    __table_args__ = (Index("ix_transactions_user_id_timestamp", "user_id", "timestamp"),)
+
+class UserDailySpend(Base):
+    __tablename__ = "user_daily_spend"
+
+    # Rollup of completed toll payments, maintained with every payment
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), primary_key=True)
+    trips = Column(Integer, default=0)
+    amount = Column(Float, default=0.0)
+
+class PlanUsage(Base):
+    __tablename__ = "plan_usage"
+
+    # Free passes of the user's plan used in a month (period = first day),
+    # consumed atomically with each toll payment (see charging.py)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    period = Column(Date, primary_key=True)
+    free_passes_used = Column(Integer, default=0)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Idempotency-Key of a payment, inserted in the payment's transaction so
+    # that a retry on any worker finds it; the response is stored once sent
+    # (see idempotency.py)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    operation = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    response = Column(String, nullable=True)
+    created_at = Column(ISTDateTime, default=ist_now, index=True)
+
 class PaymentMethod(Base):
     __tablename__ = "payment_methods"
 
@@ -148,8 +199,8 @@ class PaymentMethod(Base):
     payment_type = Column(String)
     payment_details = Column(String)  # Encrypted
     is_default = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=get_ist_now)
-    updated_at = Column(DateTime, default=get_ist_now, onupdate=get_ist_now)
+    created_at = Column(ISTDateTime, default=ist_now)
+    updated_at = Column(ISTDateTime, default=ist_now, onupdate=ist_now)
 
     # Relationships
     user = relationship("User", back_populates="payment_methods")
@@ -164,26 +215,93 @@ class AccountTransaction(Base):
     type = Column(String)
     payment_method_id = Column(Integer, ForeignKey("payment_methods.id"), nullable=True)
     status = Column(String)
-    timestamp = Column(DateTime, default=get_ist_now)
+    timestamp = Column(ISTDateTime, default=ist_now)
     reference_id = Column(String, unique=True, index=True)
 
     # Relationships
     user = relationship("User", back_populates="account_transactions")
     payment_method = relationship("PaymentMethod", back_populates="account_transactions")
 
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+
+    # Append-only record of every balance change, in integer paise
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    amount_paise = Column(Integer)  # Signed: credits are positive
+    kind = Column(String)
+    reference_id = Column(String, index=True)
+    created_at = Column(ISTDateTime, default=ist_now)
+
+    __table_args__ = (Index("ix_ledger_entries_user_id_id", "user_id", "id"),)
+
+class LedgerBalance(Base):
+    __tablename__ = "ledger_balances"
+
+    # Running balance of a user, updated with every ledger entry
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    balance_paise = Column(Integer, default=0)
+    last_entry_id = Column(Integer)
+
+class LedgerSnapshot(Base):
+    __tablename__ = "ledger_snapshots"
+
+    # Sum of the compacted (archived) ledger entries of a user
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    balance_paise = Column(Integer, default=0)
+    last_entry_id = Column(Integer)
+    created_at = Column(ISTDateTime, default=ist_now)
+
 class TrafficData(Base):
     __tablename__ = "traffic_data"
 
     id = Column(Integer, primary_key=True, index=True)
     toll_plaza_id = Column(Integer, ForeignKey("toll_plazas.id"))
-    timestamp = Column(DateTime, default=get_ist_now)
+    timestamp = Column(ISTDateTime, default=ist_now, index=True)
     vehicle_count = Column(Integer)
     average_wait_time = Column(Integer)  # Time in minutes
-    price_multiplier = Column(Float)
+    price_multiplier = Column(Float)  # As reported by the sensor; informational, prices come from pricing.py
 
     # Relationships
     toll_plaza = relationship("TollPlaza", back_populates="traffic_data")
 
+class TrafficAggregate(Base):
+    __tablename__ = "traffic_aggregates"
+
+    # Traffic samples rolled up into buckets of ``resolution`` seconds (one
+    # minute, hour or day) starting at ``bucket``. Sums and counts are kept
+    # instead of averages so that buckets can be merged (see traffic_rollups.py).
+    toll_plaza_id = Column(Integer, ForeignKey("toll_plazas.id"), primary_key=True)
+    resolution = Column(Integer, primary_key=True)
+    bucket = Column(ISTDateTime, primary_key=True)
+    samples = Column(Integer, nullable=False)
+    vehicle_count_min = Column(Integer)
+    vehicle_count_max = Column(Integer)
+    vehicle_count_sum = Column(Integer)
+    wait_sum = Column(Float)
+    multiplier_sum = Column(Float)
+
+    __table_args__ = (Index("ix_traffic_aggregates_resolution_bucket", "resolution", "bucket"),)
+
+class PlazaForecast(Base):
+    __tablename__ = "plaza_forecasts"
+
+    # Predicted traffic of a plaza ``horizon_minutes`` after generated_at,
+    # rewritten by the forecasting job (see forecasting.py)
+    toll_plaza_id = Column(Integer, ForeignKey("toll_plazas.id"), primary_key=True)
+    horizon_minutes = Column(Integer, primary_key=True)
+    generated_at = Column(ISTDateTime)
+    estimated_time = Column(Float)  # Time in minutes
+    vehicles_per_hour = Column(Float)
+    busy_level = Column(String)
+
+class JobWatermark(Base):
+    __tablename__ = "job_watermarks"
+
+    # Last row id processed by an incremental background job
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
 class Notification(Base):
     __tablename__ = "notifications"
 
@@ -192,7 +310,24 @@ class Notification(Base):
     message = Column(String)
     type = Column(String)
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=get_ist_now)
+    created_at = Column(ISTDateTime, default=ist_now)
 
     # Relationships
-    user = relationship("User", back_populates="notifications") 
\ No newline at end of file
+    user = relationship("User", back_populates="notifications")
+
+    __table_args__ = (Index("ix_notifications_user_id_is_read", "user_id", "is_read"),)
+
+class NotificationCounter(Base):
+    __tablename__ = "notification_counters"
+
+    # Number of unread notifications, maintained by every create / mark-read
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread = Column(Integer, default=0) 
+
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+
+    # Bumped together with every write to data held in process-local caches,
+    # so that all worker processes drop their copy (see cache.py)
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+
+# Maximum number of undelivered events buffered per connection. When a client
+# falls behind, the oldest events are dropped and the client is told to resync.
+QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "100"))
+
+# Interval between keep-alive comments on idle streams (in seconds)
+KEEPALIVE_SECONDS = float(os.getenv("NOTIFICATION_KEEPALIVE_SECONDS", "15"))
+
+class Subscription:
+    """Bounded event queue of one streaming connection"""
+
+    def __init__(self, user_id, maxsize=QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event):
+        # Called on the event loop thread only
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+class NotificationHub:
+    """
+    In-process pub/sub of new notifications, keyed by user id
+
+    Subscriptions are created, fed and removed on the event loop only;
+    ``publish`` may be called from any thread (sync endpoints run in the
+    threadpool) and hands events over to the loop with
+    ``call_soon_threadsafe``.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._loop = None
+
+    def bind(self, loop):
+        """Attach the hub to the running event loop (called on startup)"""
+        self._loop = loop
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def connection_count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, user_id, event):
+        """Queue ``event`` (a JSON-serializable dict) for every stream of ``user_id``"""
+        if self._loop is None or user_id not in self._subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._dispatch(user_id, event)
+        else:
+            self._loop.call_soon_threadsafe(self._dispatch, user_id, event)
+
+    def _dispatch(self, user_id, event):
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.put(event)
+
+hub = NotificationHub()
+
+def notification_event(notification):
+    """Serialize a Notification row for the stream"""
+    return {
+        "id": notification.id,
+        "user_id": notification.user_id,
+        "message": notification.message,
+        "type": getattr(notification.type, "value", notification.type),
+        "is_read": notification.is_read,
+        "created_at": notification.created_at.isoformat()
+    }
+
+async def event_stream(subscription):
+    """
+    Yield Server-Sent Events for a subscription until the client disconnects
+
+    A ``lagged`` event tells the client that events were dropped because it
+    did not keep up and that it should refetch ``/api/notifications``.
+    """
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if subscription.dropped:
+                yield f"event: lagged\ndata: {json.dumps({'dropped': subscription.dropped})}\n\n"
+                subscription.dropped = 0
+            yield f"id: {event['id']}\nevent: notification\ndata: {json.dumps(event)}\n\n"
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+import crud
+import models
+import notification_hub
+from database import shard_engines, shard_for_user, reserve_shard_ids
+from utils import ist_now
+
+logger = logging.getLogger(__name__)
+
+# A batch is written as soon as it holds NOTIFICATION_BATCH_SIZE notifications
+# or NOTIFICATION_FLUSH_MS milliseconds after its first notification arrived
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
+NOTIFICATION_FLUSH_MS = int(os.getenv("NOTIFICATION_FLUSH_MS", "50"))
+
+# Maximum number of pending notifications. Producers wait up to
+# NOTIFICATION_ENQUEUE_TIMEOUT_MS when it is reached, then write their
+# notification themselves.
+NOTIFICATION_QUEUE_MAX = int(os.getenv("NOTIFICATION_QUEUE_MAX", "100000"))
+NOTIFICATION_ENQUEUE_TIMEOUT_MS = int(os.getenv("NOTIFICATION_ENQUEUE_TIMEOUT_MS", "100"))
+
+# Retries of a failed batch, after 1, 2, 4... seconds. A batch that still
+# fails is written row by row, and rows that fail alone are appended to
+# NOTIFICATION_DEAD_LETTER_FILE (NDJSON) instead of being retried forever.
+NOTIFICATION_MAX_RETRIES = int(os.getenv("NOTIFICATION_MAX_RETRIES", "3"))
+NOTIFICATION_DEAD_LETTER_FILE = os.getenv("NOTIFICATION_DEAD_LETTER_FILE", "notification_dead_letters.ndjson")
+
+# How long shutdown waits for the queue to be written (in seconds)
+NOTIFICATION_STOP_TIMEOUT_SECONDS = float(os.getenv("NOTIFICATION_STOP_TIMEOUT_SECONDS", "30"))
+
+# Delay before the first retry of a batch whose write failed (in seconds)
+RETRY_DELAY_SECONDS = 1.0
+
+_queue = queue.Queue(maxsize=NOTIFICATION_QUEUE_MAX)
+_stop = object()
+_thread = None
+
+def write_notifications(rows):
+    """
+    Insert a batch of notification rows (one bulk insert per shard, together
+    with the unread counters) and publish them to the streaming hub once
+    committed
+
+    Args:
+        rows (list): Dicts with user_id, message, type, is_read and created_at
+    """
+    table = models.Notification.__table__
+    by_shard = defaultdict(list)
+    for row in rows:
+        by_shard[shard_for_user(row["user_id"])].append(row)
+
+    for shard_id, shard_rows in by_shard.items():
+        # Take the write lock up front (see database.py), the id reservation
+        # reads before it writes
+        with shard_engines[shard_id].execution_options(sqlite_immediate=True).begin() as conn:
+            ids = reserve_shard_ids(conn, table.name, len(shard_rows))
+            if ids:
+                shard_rows = [dict(row, id=row_id) for row, row_id in zip(shard_rows, ids)]
+                conn.execute(table.insert(), shard_rows)
+            else:
+                result = conn.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), shard_rows)
+                shard_rows = [dict(row, id=row_id) for row, (row_id,) in zip(shard_rows, result)]
+            crud.adjust_unread_counts(conn, Counter(row["user_id"] for row in shard_rows if not row["is_read"]))
+        for row in shard_rows:
+            notification_hub.hub.publish(row["user_id"], notification_hub.notification_event(models.Notification(**row)))
+
+def enqueue(user_id, notification):
+    """
+    Queue a notification for the background writer
+
+    The notification is written within NOTIFICATION_FLUSH_MS, or
+    dead-lettered when its insert keeps failing. Delivery is best effort:
+    the queue lives in memory, so notifications still queued when the
+    process dies without a shutdown are lost. When the writer is not running
+    (scripts, tests) or its queue stays full, it is written right away.
+
+    Args:
+        user_id (int): Recipient
+        notification (NotificationCreate): Message and type
+    """
+    row = {
+        "user_id": user_id,
+        "message": notification.message,
+        "type": getattr(notification.type, "value", notification.type),
+        "is_read": notification.is_read,
+        "created_at": ist_now()
+    }
+    if _thread is None:
+        write_notifications([row])
+        return
+    try:
+        _queue.put(row, timeout=NOTIFICATION_ENQUEUE_TIMEOUT_MS / 1000)
+    except queue.Full:
+        # The writer is behind: write this one in the request instead of
+        # blocking it any longer, once and without the retry delays
+        try:
+            write_notifications([row])
+        except Exception as e:
+            _dead_letter(row, e)
+
+def _next_batch():
+    # Block for the first notification, then collect until the batch is full
+    # or the flush interval has passed. Returns the batch and whether the
+    # writer was asked to stop.
+    first = _queue.get()
+    if first is _stop:
+        return [], True
+    batch = [first]
+    deadline = time.monotonic() + NOTIFICATION_FLUSH_MS / 1000
+    while len(batch) < NOTIFICATION_BATCH_SIZE:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            row = _queue.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if row is _stop:
+            return batch, True
+        batch.append(row)
+    return batch, False
+
+def _dead_letter(row, error):
+    logger.error("Failed to write a notification for user %s, dead-lettered: %s", row["user_id"], error)
+    with open(NOTIFICATION_DEAD_LETTER_FILE, "a") as dead_letters:
+        dead_letters.write(json.dumps({**row, "error": str(error)}, default=str) + "\n")
+
+def _write_rows(rows):
+    # Shards commit separately, so each is retried on its own and rows
+    # committed on another shard are not written twice
+    by_shard = defaultdict(list)
+    for row in rows:
+        by_shard[shard_for_user(row["user_id"])].append(row)
+
+    for shard_rows in by_shard.values():
+        for attempt in range(NOTIFICATION_MAX_RETRIES + 1):
+            try:
+                write_notifications(shard_rows)
+                break
+            except Exception as e:
+                error = e
+                if attempt < NOTIFICATION_MAX_RETRIES:
+                    logger.warning("Failed to write %d notifications, retrying: %s", len(shard_rows), e)
+                    time.sleep(RETRY_DELAY_SECONDS * 2 ** attempt)
+        else:
+            # One bad row must not hold back the others
+            if len(shard_rows) == 1:
+                _dead_letter(shard_rows[0], error)
+                continue
+            for row in shard_rows:
+                try:
+                    write_notifications([row])
+                except Exception as e:
+                    _dead_letter(row, e)
+
+def _run():
+    while True:
+        batch, stopping = _next_batch()
+        if batch:
+            _write_rows(batch)
+        if stopping:
+            return
+
+def start():
+    """Start the background writer thread"""
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_run, name="notification-writer", daemon=True)
+        _thread.start()
+
+def stop(timeout=NOTIFICATION_STOP_TIMEOUT_SECONDS):
+    """
+    Write every pending notification, then stop the writer thread. Gives up
+    after ``timeout`` seconds; the daemon thread then ends with the process.
+    """
+    global _thread
+    if _thread is not None:
+        deadline = time.monotonic() + timeout
+        try:
+            _queue.put(_stop, timeout=timeout)
+        except queue.Full:
+            pass
+        _thread.join(max(deadline - time.monotonic(), 0))
+        if _thread.is_alive():
+            logger.error("Notification writer did not stop within %s s, %d notifications not written", timeout, _queue.qsize())
+        _thread = None
@@ -0,0 +1,39 @@
+import cache
+import models
+import schemas
+from database import SessionLocal
+
+def _load():
+    # Plans are few and read on every vehicle registration and price quote,
+    # so the whole table is kept in memory with its features parsed
+    db = SessionLocal()
+    try:
+        return {
+            plan.id: schemas.Plan.model_validate(plan, from_attributes=True)
+            for plan in db.query(models.Plan).order_by(models.Plan.id)
+        }
+    finally:
+        db.close()
+
+_catalog = cache.VersionedCache("plans", _load)
+
+def get_plans(skip: int = 0, limit: int = 100):
+    """
+    List active subscription plans from the in-memory catalog
+
+    Args:
+        skip (int): Number of plans to skip
+        limit (int): Maximum number of plans
+
+    Returns:
+        list: Plans (schemas.Plan) ordered by id
+    """
+    return [plan for plan in _catalog.get().values() if plan.is_active][skip:skip + limit]
+
+def get_plan(plan_id: int):
+    """Return a plan (schemas.Plan) from the in-memory catalog, or None"""
+    return _catalog.get().get(plan_id)
+
+def invalidate(db):
+    """Reload the catalog in every worker once ``db`` commits its plan changes"""
+    _catalog.invalidate(db)
@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+import os
+from typing import List
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select, update, bindparam
+
+import models
+import pricing
+import schemas
+from database import engine
+
+# Rows validated and written per transaction, so that a large file does not
+# hold the write lock for long
+PLAZA_IMPORT_CHUNK_ROWS = int(os.getenv("PLAZA_IMPORT_CHUNK_ROWS", "1000"))
+
+# Invalid rows reported back (all of them are skipped)
+PLAZA_IMPORT_MAX_ERRORS = int(os.getenv("PLAZA_IMPORT_MAX_ERRORS", "100"))
+
+FORMATS = ("csv", "ndjson")
+
+# Columns set when a row updates an existing plaza. Wait time and vehicles
+# per hour are live traffic state and only seed new plazas.
+_UPDATED_COLUMNS = ("name", "location", "address", "base_price")
+
+_REQUIRED_COLUMNS = {name for name, field in schemas.TollPlazaImportRow.model_fields.items() if field.is_required()}
+
+_CHUNK = TypeAdapter(List[schemas.TollPlazaImportRow])
+
+def guess_format(filename):
+    """Return the import format of a file name, or None"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".ndjson", ".jsonl"):
+        return "ndjson"
+    return None
+
+def _records(stream, import_format):
+    # (line number, record) pairs, read one line at a time
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if import_format == "csv":
+        reader = csv.DictReader(text)
+        missing = _REQUIRED_COLUMNS - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"CSV header lacks the columns {', '.join(sorted(missing))}")
+        for record in reader:
+            # Empty cells take the column default
+            yield reader.line_num, {key: value for key, value in record.items() if key is not None and value not in ("", None)}
+    else:
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = e
+            yield line_number, record
+
+def _chunks(records):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == PLAZA_IMPORT_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _validate(chunk, errors):
+    # The chunk is validated at once; when some rows fail, they are reported
+    # and the rest is validated again without them. Returns (line, row) pairs.
+    lines = [line for line, record in chunk if isinstance(record, dict)]
+    records = [record for _, record in chunk if isinstance(record, dict)]
+    for line, record in chunk:
+        if not isinstance(record, dict):
+            errors.append({"line": line, "error": f"Invalid JSON object: {record}"})
+    try:
+        return list(zip(lines, _CHUNK.validate_python(records)))
+    except ValidationError as e:
+        invalid = {}
+        for error in e.errors():
+            index, *field = error["loc"]
+            invalid.setdefault(index, f"{'.'.join(str(part) for part in field) or 'row'}: {error['msg']}")
+        errors.extend({"line": lines[index], "error": message} for index, message in sorted(invalid.items()))
+        valid = [index for index in range(len(records)) if index not in invalid]
+        return list(zip([lines[index] for index in valid], _CHUNK.validate_python([records[index] for index in valid])))
+
+def _write(conn, rows, errors):
+    plazas = models.TollPlaza.__table__
+    updated = 0
+
+    # Ids are only used to update existing plazas: new plazas always get an
+    # id from the database, so a file cannot plant arbitrary ids
+    keyed = [(line, row) for line, row in rows if row.id is not None]
+    if keyed:
+        existing = set(conn.execute(select(plazas.c.id).where(plazas.c.id.in_([row.id for _, row in keyed]))).scalars())
+        errors.extend({"line": line, "error": f"id: Toll plaza {row.id} does not exist"} for line, row in keyed if row.id not in existing)
+        known = [row for _, row in keyed if row.id in existing]
+        if known:
+            conn.execute(
+                update(plazas)
+                .where(plazas.c.id == bindparam("plaza_id"))
+                .values({column: bindparam(column) for column in _UPDATED_COLUMNS}),
+                [{"plaza_id": row.id, **{column: value for column, value in _values(row).items() if column in _UPDATED_COLUMNS}} for row in known]
+            )
+            updated = len({row.id for row in known})
+
+    new = [row for _, row in rows if row.id is None]
+    if new:
+        conn.execute(plazas.insert(), [_values(row) for row in new])
+    return len(new), updated
+
+def _values(row):
+    return {
+        "name": row.name,
+        "location": row.location.replace(" ", ""),
+        "address": row.address,
+        "base_price": row.base_price,
+        # Replaced by the repricing at the end of the import
+        "current_price": row.base_price,
+        "busy_level": models.BusyLevel.LOW.value,
+        "estimated_time": row.estimated_time,
+        "vehicles_per_hour": row.vehicles_per_hour
+    }
+
+def import_toll_plazas(stream, import_format):
+    """
+    Upsert toll plazas from a CSV or NDJSON file, read as a stream
+
+    Rows are validated and written in chunks of PLAZA_IMPORT_CHUNK_ROWS with
+    bulk statements, one transaction per chunk. Rows with an id update that
+    plaza, rows without one create a plaza. Invalid rows and ids of unknown
+    plazas are skipped and reported. Prices and busy levels of all plazas
+    are recomputed once at the end.
+
+    Args:
+        stream: Binary file object
+        import_format (str): "csv" or "ndjson"
+
+    Returns:
+        dict: Counts of inserted, updated and invalid rows, plazas repriced
+        and the first PLAZA_IMPORT_MAX_ERRORS errors with their line
+
+    Raises:
+        ValueError: Unknown format, or a CSV header without the required columns
+    """
+    if import_format not in FORMATS:
+        raise ValueError(f"Unknown import format {import_format} (csv or ndjson)")
+
+    inserted = updated = invalid = 0
+    errors = []
+    for chunk in _chunks(_records(stream, import_format)):
+        chunk_errors = []
+        rows = _validate(chunk, chunk_errors)
+        if rows:
+            with engine.execution_options(sqlite_immediate=True).begin() as conn:
+                chunk_inserted, chunk_updated = _write(conn, rows, chunk_errors)
+            inserted += chunk_inserted
+            updated += chunk_updated
+        invalid += len(chunk_errors)
+        errors.extend(sorted(chunk_errors, key=lambda error: error["line"])[:PLAZA_IMPORT_MAX_ERRORS - len(errors)])
+
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "invalid": invalid,
+        "repriced": pricing.recompute_prices() if inserted or updated else 0,
+        "errors": errors
+    }
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.orm import Session
+
+import models
+from database import WriteSessionLocal, GLOBAL_SHARD
+
+def _parse_curve(value):
+    # "x1:y1,x2:y2,..." -> (xs, ys) sorted by x
+    points = sorted((float(x), float(y)) for x, y in (point.split(":") for point in value.split(",")))
+    return np.array([x for x, _ in points]), np.array([y for _, y in points])
+
+def _parse_mapping(value):
+    return {key.strip(): float(number) for key, number in (item.split(":") for item in value.split(","))}
+
+# Price multiplier as a function of vehicles per hour (linear between points,
+# flat outside them)
+VEHICLE_COUNT_CURVE = _parse_curve(os.getenv("PRICING_VEHICLE_COUNT_CURVE", "0:1.0,50:1.0,100:1.25,200:1.5"))
+
+# Price multiplier as a function of the average wait time in minutes
+WAIT_TIME_CURVE = _parse_curve(os.getenv("PRICING_WAIT_TIME_CURVE", "0:1.0,10:1.0,30:1.2"))
+
+# Bounds applied to the combined traffic multiplier
+MIN_MULTIPLIER = float(os.getenv("PRICING_MIN_MULTIPLIER", "0.5"))
+MAX_MULTIPLIER = float(os.getenv("PRICING_MAX_MULTIPLIER", "2.0"))
+
+# Vehicles per hour at which a plaza becomes medium / high busy, as "medium,high"
+BUSY_LEVEL_THRESHOLDS = tuple(sorted(float(value) for value in os.getenv("PRICING_BUSY_LEVEL_THRESHOLDS", "50,100").split(",")))
+
+# Multiplier applied to the plaza price per vehicle type
+VEHICLE_TYPE_MULTIPLIERS = _parse_mapping(os.getenv("PRICING_VEHICLE_MULTIPLIERS", "car:1.0,motorcycle:0.5,truck:2.0,bus:1.5,other:1.0"))
+
+# How often all plaza prices are recomputed (in seconds)
+PRICING_INTERVAL_SECONDS = int(os.getenv("PRICING_INTERVAL_SECONDS", "60"))
+
+_BUSY_LEVELS = np.array([models.BusyLevel.LOW.value, models.BusyLevel.MEDIUM.value, models.BusyLevel.HIGH.value])
+
+def busy_levels_for(vehicle_counts):
+    """Map vehicles per hour (np.ndarray) to busy level values"""
+    return _BUSY_LEVELS[np.searchsorted(BUSY_LEVEL_THRESHOLDS, vehicle_counts, side="right")]
+
+def compute_prices(base_prices, vehicle_counts, wait_times):
+    """
+    Price every plaza in one vectorized pass
+
+    Args:
+        base_prices (np.ndarray): Base price per plaza
+        vehicle_counts (np.ndarray): Vehicles per hour per plaza
+        wait_times (np.ndarray): Average wait time (minutes) per plaza
+
+    Returns:
+        tuple: (multipliers, current prices, busy levels) as arrays
+    """
+    multipliers = np.interp(vehicle_counts, *VEHICLE_COUNT_CURVE) * np.interp(wait_times, *WAIT_TIME_CURVE)
+    multipliers = np.clip(multipliers, MIN_MULTIPLIER, MAX_MULTIPLIER)
+    prices = np.round(base_prices * multipliers, 2)
+    return multipliers, prices, busy_levels_for(vehicle_counts)
+
+def recompute_prices(db: Session = None):
+    """
+    Recompute the current price and busy level of every toll plaza from its
+    latest traffic state and write the changed rows back in one bulk UPDATE
+
+    Returns:
+        int: Number of plazas whose price or busy level changed
+    """
+    close = db is None
+    db = db or WriteSessionLocal()
+    try:
+        plazas = models.TollPlaza.__table__
+        conn = db.connection(bind_arguments={"shard_id": GLOBAL_SHARD})
+        rows = conn.execute(select(
+            plazas.c.id,
+            plazas.c.base_price,
+            plazas.c.vehicles_per_hour,
+            plazas.c.estimated_time,
+            plazas.c.current_price,
+            plazas.c.busy_level
+        )).all()
+        if not rows:
+            return 0
+
+        ids, base_prices, vehicle_counts, wait_times, old_prices, old_levels = zip(*rows)
+        _, prices, busy_levels = compute_prices(
+            np.array(base_prices, dtype="f8"),
+            np.array([count or 0 for count in vehicle_counts], dtype="f8"),
+            np.array([wait or 0 for wait in wait_times], dtype="f8")
+        )
+        changed = np.flatnonzero(
+            (prices != np.array([price if price is not None else np.nan for price in old_prices], dtype="f8"))
+            | (busy_levels != np.array(old_levels, dtype=object).astype(str))
+        )
+        if len(changed):
+            conn.execute(
+                update(plazas)
+                .where(plazas.c.id == bindparam("plaza_id"))
+                .values(current_price=bindparam("price"), busy_level=bindparam("level")),
+                [{"plaza_id": ids[i], "price": float(prices[i]), "level": str(busy_levels[i])} for i in changed]
+            )
+        db.commit()
+        return len(changed)
+    finally:
+        if close:
+            db.close()
+
+def plan_discount(plan):
+    """Return the toll discount of a plan as a fraction (0.05 for 5%)"""
+    if plan is None:
+        return 0.0
+    return float((plan.features or {}).get("discount", 0)) / 100
+
+def quote(current_price, vehicle_type, plan=None):
+    """
+    Price a single passage at a plaza
+
+    Args:
+        current_price (float): Current price of the plaza
+        vehicle_type (str): Vehicle type
+        plan (Plan): Subscription plan of the user, if any
+
+    Returns:
+        dict: Vehicle multiplier, plan discount and final price
+    """
+    vehicle_type = getattr(vehicle_type, "value", vehicle_type)
+    vehicle_multiplier = VEHICLE_TYPE_MULTIPLIERS.get(vehicle_type, 1.0)
+    discount = plan_discount(plan)
+    return {
+        "vehicle_multiplier": vehicle_multiplier,
+        "plan_discount": discount,
+        "final_price": round(current_price * vehicle_multiplier * (1 - discount), 2)
+    }
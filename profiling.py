@@ -0,0 +1,338 @@
+import cProfile
+import functools
+import html
+import inspect
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+
+from auth import is_admin_email
+from ratelimit import user_from_headers
+from utils import get_ist_now
+
+# Header that makes an admin request run under cProfile
+PROFILE_HEADER = b"x-profile"
+
+# Number of request profiles kept for download; the oldest are dropped
+PROFILE_MAX_CAPTURES = int(os.getenv("PROFILE_MAX_CAPTURES", "20"))
+
+# Functions listed in a request profile, by cumulative time
+PROFILE_MAX_FUNCTIONS = int(os.getenv("PROFILE_MAX_FUNCTIONS", "60"))
+
+# Delay between two samples of the sampling profiler (in seconds)
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("SAMPLE_INTERVAL_SECONDS", "0.01"))
+
+# Maximum number of distinct stacks kept by the sampling profiler; further
+# new stacks are counted as "[truncated]"
+SAMPLE_MAX_STACKS = int(os.getenv("SAMPLE_MAX_STACKS", "20000"))
+
+# Longest on-demand sampling run (in seconds)
+SAMPLE_MAX_SECONDS = int(os.getenv("SAMPLE_MAX_SECONDS", "600"))
+
+# Run the sampling profiler all the time, keeping the last two windows
+SAMPLE_CONTINUOUS = os.getenv("SAMPLE_CONTINUOUS", "false").lower() == "true"
+SAMPLE_WINDOW_SECONDS = int(os.getenv("SAMPLE_WINDOW_SECONDS", "300"))
+
+# Leaf frames of threads that are waiting, left out of the samples
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("connection.py", "wait"),
+    ("thread.py", "_worker"),
+}
+
+# Per-request profiling
+
+class _RequestProfile:
+    def __init__(self, profile_id, method, path):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.created_at = get_ist_now()
+        self.profiler = cProfile.Profile()
+        self.captured = False
+        self.stats = None
+        self.duration_ms = None
+
+_captures = OrderedDict()
+_capture_ids = itertools.count(1)
+_captures_lock = threading.Lock()
+
+_current_profile = ContextVar("current_profile", default=None)
+
+# One request is profiled at a time; concurrent ones run unprofiled
+_profiler_lock = threading.Lock()
+
+def _profiled(endpoint):
+    # Endpoints run in the threadpool (or on the event loop), and cProfile
+    # only sees the thread it is enabled in, so it is enabled around the
+    # endpoint itself
+    def start():
+        profile = _current_profile.get()
+        if profile is None or not _profiler_lock.acquire(blocking=False):
+            return None
+        profile.captured = True
+        profile.profiler.enable()
+        return profile
+
+    def finish(profile):
+        if profile is not None:
+            profile.profiler.disable()
+            _profiler_lock.release()
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            profile = start()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                finish(profile)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            profile = start()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                finish(profile)
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    """Route class whose endpoint can be profiled per request"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+def list_captures():
+    """Return a summary of the stored request profiles, newest first"""
+    with _captures_lock:
+        captures = list(_captures.values())
+    return [
+        {"id": c.id, "method": c.method, "path": c.path, "created_at": c.created_at, "duration_ms": c.duration_ms}
+        for c in reversed(captures)
+    ]
+
+def get_capture(profile_id):
+    """Return the pstats report of a request profile, or None"""
+    with _captures_lock:
+        capture = _captures.get(profile_id)
+    return capture.stats if capture is not None else None
+
+def _store_capture(profile, duration):
+    # Only the text report is kept, so each capture has a bounded size
+    out = io.StringIO()
+    if profile.captured:
+        stats = pstats.Stats(profile.profiler, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_MAX_FUNCTIONS)
+    else:
+        out.write("Not captured: another request was being profiled\n")
+    profile.stats = f"{profile.method} {profile.path} ({duration * 1000:.1f} ms)\n{out.getvalue()}"
+    profile.duration_ms = round(duration * 1000, 1)
+    profile.profiler = None
+    with _captures_lock:
+        _captures[profile.id] = profile
+        while len(_captures) > PROFILE_MAX_CAPTURES:
+            _captures.popitem(last=False)
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests of admins that send ``X-Profile: 1``.
+    The response carries an ``X-Profile-Id`` header naming the capture to
+    download from ``/api/admin/profiles/{id}``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER) != b"1" or not is_admin_email(user_from_headers(headers)):
+            await self.app(scope, receive, send)
+            return
+
+        profile = _RequestProfile(next(_capture_ids), scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(profile.id).encode())]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            _store_capture(profile, time.perf_counter() - start)
+
+# Sampling profiler
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _is_idle(frame):
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of all threads at a fixed interval from a
+    background thread and aggregates them as folded stacks (root;...;leaf)
+    with a count. Memory is bounded by SAMPLE_MAX_STACKS per window.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS, max_stacks=SAMPLE_MAX_STACKS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._windows = deque([Counter()], maxlen=2)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.started_at = None
+        self.until = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=None, window_seconds=None):
+        """
+        Start sampling, for ``seconds`` or until stopped. With
+        ``window_seconds`` the samples are rotated into a new window at that
+        interval and only the last two windows are kept.
+        """
+        if self.running:
+            return False
+        with self._lock:
+            self._windows = deque([Counter()], maxlen=2)
+        self._stop.clear()
+        self.started_at = get_ist_now()
+        self.until = time.monotonic() + seconds if seconds else None
+        self._thread = threading.Thread(target=self._run, args=(window_seconds,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, window_seconds):
+        own_id = threading.get_ident()
+        next_window = time.monotonic() + window_seconds if window_seconds else None
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            if self.until is not None and now >= self.until:
+                break
+            if next_window is not None and now >= next_window:
+                with self._lock:
+                    self._windows.append(Counter())
+                next_window = now + window_seconds
+            self.sample(exclude=own_id)
+
+    def sample(self, exclude=None):
+        """Take one sample of every thread"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == exclude or _is_idle(frame):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, "thread"))
+            stacks.append(";".join(reversed(stack)))
+
+        with self._lock:
+            counts = self._windows[-1]
+            for stack in stacks:
+                if stack not in counts and len(counts) >= self.max_stacks:
+                    stack = "[truncated]"
+                counts[stack] += 1
+
+    def folded(self):
+        """Return the samples in the folded stack format used by flamegraph tools"""
+        with self._lock:
+            counts = sum(self._windows, Counter())
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    def status(self):
+        with self._lock:
+            samples = sum(sum(window.values()) for window in self._windows)
+            stacks = sum(len(window) for window in self._windows)
+        return {"running": self.running, "started_at": self.started_at, "samples": samples, "stacks": stacks}
+
+sampler = SamplingProfiler()
+
+def render_flamegraph(folded, title="TollEasy flamegraph", width=1200):
+    """
+    Render folded stacks as a standalone SVG flamegraph
+
+    Args:
+        folded (str): Lines of "frame;frame;... count"
+        title (str): Heading of the graph
+        width (int): Width in pixels
+
+    Returns:
+        str: SVG document
+    """
+    # Build a tree of frames: name -> [count, children]
+    root = [0, {}]
+    for line in folded.splitlines():
+        stack, _, count = line.rpartition(" ")
+        if not stack:
+            continue
+        node = root
+        node[0] += int(count)
+        for name in stack.split(";"):
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += int(count)
+
+    row_height = 16
+    total = root[0] or 1
+    min_width = 0.5
+    rects = []
+    depth_max = 0
+
+    def layout(children, x, depth):
+        nonlocal depth_max
+        for name, (count, grandchildren) in sorted(children.items()):
+            w = count / total * width
+            if w >= min_width:
+                depth_max = max(depth_max, depth)
+                rects.append((x, depth, w, name, count))
+                layout(grandchildren, x, depth + 1)
+            x += w
+
+    layout(root[1], 0.0, 0)
+    height = (depth_max + 1) * row_height + 40
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="16" font-size="14">{html.escape(title)} ({total} samples)</text>',
+    ]
+    for x, depth, w, name, count in rects:
+        y = height - (depth + 1) * row_height
+        hue = zlib.crc32(name.encode()) % 60
+        label = html.escape(name[:int(w / 7)]) if w > 21 else ""
+        out.append(
+            f'<g><title>{html.escape(name)} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + 12}">{label}</text></g>'
+        )
+    out.append("</svg>")
+    return "\n".join(out)
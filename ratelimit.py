@@ -0,0 +1,247 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from auth import get_token_subject
+
+logger = logging.getLogger(__name__)
+
+def _parse_limit(value):
+    # "<requests>/<seconds>" -> (capacity, refill rate per second)
+    requests, seconds = value.split("/")
+    return int(requests), int(requests) / float(seconds)
+
+# Budgets per route class and per client, as "<requests>/<seconds>". Each
+# budget is a token bucket holding at most <requests> tokens.
+RATE_LIMITS = {
+    "auth": _parse_limit(os.getenv("RATE_LIMIT_AUTH", "10/60")),
+    "maps": _parse_limit(os.getenv("RATE_LIMIT_MAPS", "30/60")),
+    "public": _parse_limit(os.getenv("RATE_LIMIT_PUBLIC", "120/60")),
+    "write": _parse_limit(os.getenv("RATE_LIMIT_WRITE", "60/60")),
+    "ip": _parse_limit(os.getenv("RATE_LIMIT_IP", "600/60")),
+    "user": _parse_limit(os.getenv("RATE_LIMIT_USER", "600/60")),
+}
+
+# Seconds after which an idle bucket has refilled under every budget; such
+# buckets are dropped from the store
+BUCKET_IDLE_SECONDS = max(capacity / rate for capacity, rate in RATE_LIMITS.values())
+
+# How long a shared bucket store is waited for before the request is let
+# through unchecked (in milliseconds)
+RATE_LIMIT_TIMEOUT_MS = int(os.getenv("RATE_LIMIT_TIMEOUT_MS", "1000"))
+
+# How often idle buckets are deleted from a shared store (in seconds)
+RATE_LIMIT_PRUNE_SECONDS = int(os.getenv("RATE_LIMIT_PRUNE_SECONDS", "60"))
+
+# Requests processed at once before new ones are shed with 503
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT_REQUESTS", "256"))
+
+# Shared bucket store, e.g. "sqlite:////var/run/tolleasy/ratelimit.db", so
+# that all workers enforce the same budgets. Empty means per-process memory.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "")
+
+# Paths never rate limited
+EXEMPT_PATHS = ("/docs", "/redoc", "/openapi.json", "/metrics")
+
+# Long-lived streams are rate limited when opened but not counted as in flight
+STREAMING_PATHS = ("/api/notifications/stream",)
+
+class MemoryBackend:
+    """Token buckets in process memory"""
+
+    blocking = False
+
+    # Idle buckets are pruned once this many keys are tracked
+    MAX_KEYS = 100000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        """
+        Take one token from the bucket ``key``
+
+        Returns:
+            float: 0 when allowed, otherwise seconds until a token is available
+        """
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+            return 0
+
+    def _prune(self, now):
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < BUCKET_IDLE_SECONDS}
+
+class SQLiteBackend:
+    """
+    Token buckets in a SQLite file shared by all worker processes
+
+    Calls block, so the middleware makes them from the threadpool. When the
+    file stays locked for RATE_LIMIT_TIMEOUT_MS, or cannot be written, the
+    request is let through: the rate limiter must not turn into an outage.
+    """
+
+    # take() blocks on SQLite and is called from the threadpool
+    blocking = True
+
+    def __init__(self, path, timeout_ms=RATE_LIMIT_TIMEOUT_MS, prune_seconds=RATE_LIMIT_PRUNE_SECONDS):
+        # Workers starting together wait for each other to create the table
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Buckets lost in a power failure only refill early
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        self._conn.execute(f"PRAGMA busy_timeout = {int(timeout_ms)}")
+        self._lock = threading.Lock()
+        self.prune_seconds = prune_seconds
+        self._pruned = 0
+
+    def take(self, key, capacity, rate, now):
+        """
+        Take one token from the bucket ``key``
+
+        Returns:
+            float: 0 when allowed (or when the store is unavailable),
+                otherwise seconds until a token is available
+        """
+        with self._lock:
+            try:
+                if now - self._pruned >= self.prune_seconds:
+                    self._prune(now)
+                # Refill and take in one statement; no row comes back when empty
+                row = self._conn.execute("""
+                    INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (:key, :capacity - 1, :now)
+                    ON CONFLICT (key) DO UPDATE SET
+                        tokens = MIN(:capacity, tokens + (:now - updated) * :rate) - 1,
+                        updated = :now
+                    WHERE MIN(:capacity, tokens + (:now - updated) * :rate) >= 1
+                    RETURNING tokens
+                """, {"key": key, "capacity": capacity, "rate": rate, "now": now}).fetchone()
+                if row is not None:
+                    return 0
+                tokens, updated = self._conn.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+                return (1 - min(capacity, tokens + (now - updated) * rate)) / rate
+            except sqlite3.OperationalError as e:
+                logger.warning("Rate limit store unavailable, request not limited: %s", e)
+                return 0
+
+    def _prune(self, now):
+        # Every worker prunes; deleting a bucket that has refilled changes nothing
+        self._pruned = now
+        self._conn.execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - BUCKET_IDLE_SECONDS,))
+
+def create_backend(url=RATE_LIMIT_BACKEND):
+    """Build the bucket store from a backend URL"""
+    if not url or url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported rate limit backend: {url}")
+
+def route_class(method, path):
+    """Return the budget class of a request, or None for plain reads"""
+    if path in ("/api/token", "/api/users") and method == "POST":
+        return "auth"
+    if path.startswith("/api/maps/"):
+        return "maps"
+    if path.startswith("/api/public/"):
+        return "public"
+    if method in ("POST", "PUT", "PATCH", "DELETE"):
+        return "write"
+    return None
+
+def user_from_headers(headers):
+    """Return the email in the bearer token of raw ASGI headers, without database access"""
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    return get_token_subject(authorization[7:])
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying token-bucket budgets per IP, per user and per
+    route class, and shedding load with 503 when too many requests are in
+    flight. Rejections happen before routing, so no database session is
+    opened for them.
+    """
+
+    def __init__(self, app, backend=None, limits=None, max_in_flight=MAX_IN_FLIGHT):
+        self.app = app
+        self.backend = backend or create_backend()
+        self.limits = limits or RATE_LIMITS
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if self.in_flight >= self.max_in_flight:
+            await self._reject(send, 503, "Server is overloaded, please retry", 1)
+            return
+
+        if self.backend.blocking:
+            retry_after = await run_in_threadpool(self._check, scope)
+        else:
+            retry_after = self._check(scope)
+        if retry_after:
+            await self._reject(send, 429, "Too many requests", retry_after)
+            return
+
+        if scope["path"] in STREAMING_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    def _check(self, scope):
+        now = time.time()
+        client = scope["client"][0] if scope.get("client") else "unknown"
+        user = user_from_headers(dict(scope["headers"]))
+        budget = route_class(scope["method"], scope["path"])
+
+        # Narrowest budget first so a rejected request does not drain the others
+        checks = []
+        if budget is not None:
+            checks.append((f"{budget}:{f'user:{user}' if user else f'ip:{client}'}", budget))
+        if user:
+            checks.append((f"user:{user}", "user"))
+        checks.append((f"ip:{client}", "ip"))
+
+        for key, name in checks:
+            capacity, rate = self.limits[name]
+            retry_after = self.backend.take(key, capacity, rate, now)
+            if retry_after:
+                return retry_after
+        return 0
+
+    async def _reject(self, send, status_code, detail, retry_after):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
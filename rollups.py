@@ -0,0 +1,121 @@
+import glob
+import os
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import archive
+import models
+from database import shard_for_user, scatter_gather
+
+def _upsert_daily_spend(db: Session, rows, shard_id):
+    table = models.UserDailySpend.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day, table.c.vehicle_id],
+        set_={
+            "trips": table.c.trips + stmt.excluded.trips,
+            "amount": table.c.amount + stmt.excluded.amount
+        }
+    )
+    db.execute(stmt, rows, bind_arguments={"shard_id": shard_id})
+
+def record_toll_payment(db: Session, transaction, sign: int = 1):
+    """
+    Add (or with ``sign=-1`` remove) a completed toll payment to the user's
+    daily spend rollup. Runs inside the caller's transaction; nothing is
+    committed here.
+    """
+    if transaction.transaction_type != models.TransactionType.TOLL_PAYMENT:
+        return
+    _upsert_daily_spend(db, [{
+        "user_id": transaction.user_id,
+        "day": transaction.timestamp.date(),
+        "vehicle_id": transaction.vehicle_id,
+        "trips": sign,
+        "amount": sign * transaction.amount
+    }], shard_for_user(transaction.user_id))
+
+def get_spend_totals(db: Session, user_id: int):
+    """Return total trips and amount per vehicle for a user"""
+    return db.query(
+        models.UserDailySpend.vehicle_id,
+        func.sum(models.UserDailySpend.trips),
+        func.sum(models.UserDailySpend.amount)
+    ).filter(
+        models.UserDailySpend.user_id == user_id
+    ).group_by(models.UserDailySpend.vehicle_id).all()
+
+def get_daily_spend(db: Session, user_id: int, year: int, month: int):
+    """Return trips and amount per day of a month for a user"""
+    start = archive.month_start(year, month)
+    end = archive.next_month_start(start)
+    return db.query(
+        models.UserDailySpend.day,
+        func.sum(models.UserDailySpend.trips),
+        func.sum(models.UserDailySpend.amount)
+    ).filter(
+        models.UserDailySpend.user_id == user_id,
+        models.UserDailySpend.day >= start.date(),
+        models.UserDailySpend.day < end.date()
+    ).group_by(models.UserDailySpend.day).order_by(models.UserDailySpend.day).all()
+
+def _rebuild_shard(db: Session):
+    shard_id = db.info["shard_id"]
+    transactions = models.Transaction.__table__
+    rollup = models.UserDailySpend.__table__
+
+    db.execute(delete(rollup))
+    db.execute(rollup.insert().from_select(
+        ["user_id", "day", "vehicle_id", "trips", "amount"],
+        select(
+            transactions.c.user_id,
+            func.date(transactions.c.timestamp),
+            transactions.c.vehicle_id,
+            func.count(),
+            func.sum(transactions.c.amount)
+        ).where(
+            transactions.c.transaction_type == models.TransactionType.TOLL_PAYMENT,
+            transactions.c.status == models.TransactionStatus.COMPLETED
+        ).group_by(
+            transactions.c.user_id,
+            func.date(transactions.c.timestamp),
+            transactions.c.vehicle_id
+        )
+    ))
+
+    # Archived months are aggregated straight from their Parquet partitions
+    paths = sorted(glob.glob(os.path.join(archive.ARCHIVE_DIR, transactions.name, shard_id, "*.parquet")))
+    if paths:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+    for path in paths:
+        table = pq.read_table(path, columns=["user_id", "vehicle_id", "timestamp", "amount", "transaction_type", "status"])
+        table = table.filter(pc.and_(
+            pc.equal(table["transaction_type"], models.TransactionType.TOLL_PAYMENT.value),
+            pc.equal(table["status"], models.TransactionStatus.COMPLETED.value)
+        ))
+        if table.num_rows == 0:
+            continue
+        table = table.append_column("day", pc.cast(table["timestamp"], pa.date32()))
+        grouped = table.group_by(["user_id", "day", "vehicle_id"]).aggregate([("amount", "count"), ("amount", "sum")])
+        _upsert_daily_spend(db, [
+            {"user_id": row["user_id"], "day": row["day"], "vehicle_id": row["vehicle_id"], "trips": row["amount_count"], "amount": row["amount_sum"]}
+            for row in grouped.to_pylist()
+        ], shard_id)
+
+    db.commit()
+    return db.query(func.count()).select_from(rollup).scalar()
+
+def rebuild_user_daily_spend():
+    """
+    Recompute the daily spend rollup of every user from the transactions
+    table and the archived partitions, one shard per thread
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    return sum(scatter_gather(_rebuild_shard, write=True))
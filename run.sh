@@ -12,6 +12,6 @@ else
     ./install_dependencies.sh
 fi
 
-# Start the FastAPI server
+# Start the FastAPI server (with dummy data unless TOLLEASY_SEED_DATA is set)
 echo "Starting TollEasy API server..."
-uvicorn main:app --reload 
\ No newline at end of file
+TOLLEASY_SEED_DATA="${TOLLEASY_SEED_DATA:-true}" uvicorn main:app --reload 
\ No newline at end of file
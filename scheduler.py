@@ -0,0 +1,66 @@
+import asyncio
+import fcntl
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Lock file taken by the worker process that runs the jobs. With several
+# workers sharing one database, only the worker holding the lock runs them.
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "")
+
+# Registered periodic jobs: (name, interval in seconds, callable)
+_jobs = []
+
+# Running asyncio tasks, one per job
+_tasks = []
+
+# Open lock file while this process holds the scheduler lock
+_lock_file = None
+
+def _acquire_lock():
+    global _lock_file
+    if not SCHEDULER_LOCK_FILE:
+        return True
+    lock_file = open(SCHEDULER_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+def register_job(name, interval_seconds, func):
+    """
+    Register a job to be run periodically once the scheduler is started
+
+    Args:
+        name (str): Job name used in log output
+        interval_seconds (float): Delay between two runs
+        func (callable): Blocking function run in a worker thread
+    """
+    _jobs.append((name, interval_seconds, func))
+
+async def _run_periodically(name, interval_seconds, func):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(func)
+        except Exception:
+            logger.exception("Scheduled job %s failed", name)
+
+def start():
+    """Start all registered jobs on the running event loop"""
+    if not _acquire_lock():
+        logger.info("Scheduled jobs run in another worker (lock held on %s)", SCHEDULER_LOCK_FILE)
+        return
+    for name, interval_seconds, func in _jobs:
+        _tasks.append(asyncio.ensure_future(_run_periodically(name, interval_seconds, func)))
+
+async def stop():
+    """Cancel all running jobs"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
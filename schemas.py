@@ -133,6 +133,17 @@ class TollPlazaUpdate(BaseModel):
     estimated_time: Optional[int] = None
     vehicles_per_hour: Optional[int] = None
 
+class TollPlazaImportRow(BaseModel):
+    # Row of a bulk import. A row with an id updates that existing plaza.
+    # Price and busy level are derived by the repricing that follows the import.
+    id: Optional[int] = Field(None, ge=1)
+    name: str = Field(min_length=1)
+    location: str = Field(pattern=r"^\s*-?\d{1,2}(\.\d+)?\s*,\s*-?\d{1,3}(\.\d+)?\s*$")  # "latitude,longitude"
+    address: str
+    base_price: float = Field(ge=0)
+    estimated_time: int = Field(0, ge=0)
+    vehicles_per_hour: int = Field(0, ge=0)
+
 class TollPlazaInDB(TollPlazaBase):
     id: int
 
@@ -142,6 +153,17 @@ class TollPlazaInDB(TollPlazaBase):
 class TollPlaza(TollPlazaInDB):
     pass
 
+class WaitForecast(BaseModel):
+    horizon_minutes: int
+    time: datetime
+    estimated_time: float
+    vehicles_per_hour: float
+    busy_level: BusyLevel
+
+class TollPlazaDetail(TollPlaza):
+    # Predicted wait time and busy level for the next minutes
+    forecast: List[WaitForecast] = []
+
 class PlanBase(BaseModel):
     name: str
     price: float
@@ -246,10 +268,22 @@ class AccountTransactionInDB(AccountTransactionBase):
 class AccountTransaction(AccountTransactionInDB):
     pass
 
+class LedgerEntry(BaseModel):
+    id: int
+    user_id: int
+    amount_paise: int
+    kind: str
+    reference_id: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
 class TrafficDataBase(BaseModel):
     toll_plaza_id: int
     vehicle_count: int
     average_wait_time: int
+    # Informational only: kept in the history, prices are computed by pricing.py
     price_multiplier: float
 
 class TrafficDataCreate(TrafficDataBase):
@@ -270,6 +304,23 @@ class TrafficDataInDB(TrafficDataBase):
 class TrafficData(TrafficDataInDB):
     pass
 
+class TrafficPoint(BaseModel):
+    # A raw sample, or the samples of one rollup bucket starting at timestamp
+    timestamp: datetime
+    samples: int
+    vehicle_count_min: Optional[int] = None
+    vehicle_count_max: Optional[int] = None
+    vehicle_count_avg: Optional[float] = None
+    average_wait_time: Optional[float] = None
+    price_multiplier: Optional[float] = None
+
+class TrafficSeries(BaseModel):
+    toll_plaza_id: int
+    resolution: str
+    start: datetime
+    end: datetime
+    points: List[TrafficPoint]
+
 class NotificationBase(BaseModel):
     message: str
     type: NotificationType
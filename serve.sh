@@ -0,0 +1,32 @@
+#!/bin/bash
+
+# Production launcher: several gunicorn / uvicorn worker processes sharing
+# one database (see gunicorn.conf.py for the worker settings)
+
+# Ensure we're in the right directory
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+cd "$SCRIPT_DIR" || exit 1
+
+# Activate virtual environment if it exists
+if [ -d ".venv" ]; then
+    source .venv/bin/activate
+fi
+
+# State shared by all workers
+export DATABASE_URL="${DATABASE_URL:-sqlite:///./tolleasy.db}"
+export RATE_LIMIT_BACKEND="${RATE_LIMIT_BACKEND:-sqlite:///./ratelimit.db}"
+export SCHEDULER_LOCK_FILE="${SCHEDULER_LOCK_FILE:-./scheduler.lock}"
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-./prometheus}"
+
+# Every worker would get its own empty in-memory database
+if [[ "$DATABASE_URL" == *":memory:"* ]]; then
+    echo "DATABASE_URL must point to a database file or server when running several workers"
+    exit 1
+fi
+
+# Metrics of the previous run would be added to the new ones
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+echo "Starting TollEasy API server with ${WEB_CONCURRENCY:-$(nproc)} workers..."
+exec gunicorn main:app --config gunicorn.conf.py
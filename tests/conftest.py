@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import uuid
+
+# The application reads its configuration when imported: point it at a
+# scratch database before the first import
+_data_dir = tempfile.mkdtemp(prefix="tolleasy-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_data_dir}/tolleasy.db")
+os.environ.setdefault("TOLLEASY_SEED_DATA", "false")
+os.environ.setdefault("ARCHIVE_DIR", os.path.join(_data_dir, "archive"))
+for _limit in ("AUTH", "WRITE", "PUBLIC", "IP", "USER"):
+    os.environ.setdefault(f"RATE_LIMIT_{_limit}", "100000/1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def user_headers(client):
+    """Authorization headers of a new user with a balance of 500"""
+    email = f"{uuid.uuid4().hex}@example.com"
+    response = client.post("/api/users", json={"email": email, "name": "Test", "password": "pw"})
+    assert response.status_code == 200, response.text
+    token = client.post("/api/token", data={"username": email, "password": "pw"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post("/api/account-transactions", json={"amount": 500, "type": "deposit"}, headers=headers)
+    assert response.status_code == 200, response.text
+    return headers
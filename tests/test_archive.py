@@ -0,0 +1,87 @@
+import random
+from datetime import timedelta
+
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, func, select, text
+
+import analytics
+import archive
+import crud
+import models
+from database import SessionLocal, shard_engines, shard_for_user
+
+def _transactions(engine, start, ids, user_id=1):
+    table = models.Transaction.__table__
+    with engine.begin() as conn:
+        conn.execute(table.insert(), [
+            {
+                "id": row_id,
+                "user_id": user_id,
+                "vehicle_id": 1,
+                "toll_plaza_id": 1,
+                "amount": 10.0,
+                "timestamp": start + timedelta(hours=row_id),
+                "status": "completed",
+                "transaction_type": "toll payment",
+                "reference_id": f"ref-{user_id}-{row_id}"
+            }
+            for row_id in ids
+        ])
+
+def test_rerun_after_failed_delete_does_not_duplicate_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'shard.db'}")
+    table = models.Transaction.__table__
+    table.create(engine)
+    start = archive.month_start(2024, 1)
+    end = archive.next_month_start(start)
+    path = archive.partition_path(table.name, 2024, 1)
+    _transactions(engine, start, range(1, 4))
+
+    # The partition is written, then the delete is rolled back
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            assert archive._archive_month(conn, table, start, end, path, [table.c.timestamp])
+            transaction.rollback()
+    # A late row arrives before the next run
+    _transactions(engine, start, [4])
+    with engine.begin() as conn:
+        assert archive._archive_month(conn, table, start, end, path, [table.c.timestamp])
+
+    assert sorted(pq.read_table(path)["id"].to_pylist()) == [1, 2, 3, 4]
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(table)).scalar() == 0
+
+def test_reads_fall_back_to_archived_months(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    user_id = random.randint(10 ** 8, 10 ** 9)
+    engine = shard_engines[shard_for_user(user_id)]
+    with engine.connect() as conn:
+        first_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM transactions")).scalar()
+    old = archive.archive_cutoff() - timedelta(days=40)
+    _transactions(engine, old, range(first_id, first_id + 3), user_id)
+    archive.archive_closed_months()
+    # A recent row stays in the database
+    _transactions(engine, archive.archive_cutoff(), [first_id + 3], user_id)
+
+    with SessionLocal() as db:
+        assert crud.get_transaction(db, first_id + 1).user_id == user_id
+        assert crud.get_transaction(db, 10 ** 12) is None
+        assert [t.id for t in crud.get_transactions_by_user(db, user_id)] == [first_id + 3, first_id, first_id + 1, first_id + 2]
+        assert [t.id for t in crud.get_transactions_by_user(db, user_id, skip=2, limit=1)] == [first_id + 1]
+
+def test_analytics_skip_archived_rows_still_in_the_database(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    user_id = random.randint(10 ** 8, 10 ** 9)
+    engine = shard_engines[shard_for_user(user_id)]
+    with engine.connect() as conn:
+        first_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM transactions")).scalar()
+    start = archive.month_start(2020, 1)
+    ids = range(first_id, first_id + 3)
+    _transactions(engine, start, ids, user_id)
+    archive.archive_closed_months()
+    # The archive run failed after writing the partition: the rows are back
+    _transactions(engine, start, ids, user_id)
+
+    loaded = analytics.load_transactions(start, archive.next_month_start(start))
+    assert len(loaded) == 3
@@ -0,0 +1,68 @@
+import random
+from datetime import timedelta
+
+import pyarrow as pa
+from sqlalchemy import text
+
+import archive
+import exports
+import models
+from database import shard_engines, shard_for_user
+from utils import ist_now
+
+def _insert_transactions(user_id, timestamps):
+    table = models.Transaction.__table__
+    with shard_engines[shard_for_user(user_id)].begin() as conn:
+        first_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM transactions")).scalar()
+        conn.execute(table.insert(), [
+            {
+                "id": first_id + index,
+                "user_id": user_id,
+                "vehicle_id": 1,
+                "toll_plaza_id": 1,
+                "amount": 10.0,
+                "timestamp": timestamp,
+                "status": "completed",
+                "transaction_type": "toll payment",
+                "reference_id": f"export-{user_id}-{index}"
+            }
+            for index, timestamp in enumerate(timestamps)
+        ])
+
+def _user_id():
+    return random.randint(10 ** 8, 10 ** 9)
+
+def test_export_pages_in_time_order_without_holding_a_snapshot(client, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_BATCH_ROWS", 3)
+    user_id = _user_id()
+    now = ist_now().replace(microsecond=0)
+    # Ties on the timestamp are ordered by id across page boundaries
+    _insert_transactions(user_id, [now - timedelta(minutes=minutes) for minutes in (5, 5, 5, 5, 1, 9, 9, 3, 0, 2)])
+
+    batches = []
+    for batch in exports.transaction_batches(user_id):
+        batches.append(batch)
+        # No read transaction is left open between batches
+        with shard_engines[shard_for_user(user_id)].connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").first()[0] == 0
+
+    assert [batch.num_rows for batch in batches] == [3, 3, 3, 1]
+    exported = pa.Table.from_batches(batches)
+    keys = list(zip(exported["timestamp"].to_pylist(), exported["id"].to_pylist()))
+    assert keys == sorted(keys)
+
+def test_rows_archived_during_export_are_not_lost(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(exports, "EXPORT_BATCH_ROWS", 2)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    user_id = _user_id()
+    old = archive.archive_cutoff() - timedelta(days=1)
+    _insert_transactions(user_id, [old - timedelta(hours=hours) for hours in range(5)])
+
+    batches = exports.transaction_batches(user_id)
+    exported = [next(batches)]
+    archive.archive_closed_months()
+    exported += list(batches)
+
+    ids = pa.Table.from_batches(exported)["id"].to_pylist()
+    assert len(ids) == 5
+    assert len(set(ids)) == 5
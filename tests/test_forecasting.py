@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from forecasting import WaitTimeModel
+
+START = 1700000000
+
+def _observe(model, plaza_ids, levels, hours=24 * 14):
+    # Hourly observations at a constant wait time / vehicles per hour per plaza
+    ts = START + np.arange(hours) * 3600
+    for plaza_id, level in zip(plaza_ids, levels):
+        model.update(np.full(hours, plaza_id), ts, np.full((hours, 2), float(level)), np.ones(hours))
+    return ts[-1]
+
+def test_constant_traffic_is_forecast_flat():
+    model = WaitTimeModel()
+    now = _observe(model, [1], [12])
+
+    plaza_ids, predictions = model.predict(now, [15, 30, 60])
+
+    assert plaza_ids.tolist() == [1]
+    assert np.allclose(predictions, 12)
+
+def test_sparse_plaza_ids_keep_their_own_forecast():
+    # Rows are compact: a huge id costs one row, not an array up to the id
+    model = WaitTimeModel()
+    now = _observe(model, [10 ** 12, 7, 3], [30, 5, 20])
+
+    plaza_ids, predictions = model.predict(now, [15])
+
+    assert len(model.weights) == 3
+    forecast = dict(zip(plaza_ids.tolist(), predictions[0, :, 0]))
+    assert forecast == pytest.approx({10 ** 12: 30.0, 7: 5.0, 3: 20.0})
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import idempotency
+
+WITHDRAWAL = {"amount": 25, "type": "withdrawal"}
+
+def _balance(client, headers):
+    return client.get("/api/users/me", headers=headers).json()["current_balance"]
+
+def test_retry_replays_stored_response(client, user_headers):
+    headers = {**user_headers, "Idempotency-Key": "retry"}
+    first = client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers)
+    retry = client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers)
+
+    assert first.status_code == 200
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert _balance(client, user_headers) == 475
+
+def test_parallel_retries_charge_once(client, user_headers):
+    # Every request runs in its own thread and session, like retries served
+    # by different workers: only the database sees them all
+    headers = {**user_headers, "Idempotency-Key": "parallel"}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda _: client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers), range(16)))
+
+    # The retries wait for the first request and replay its response
+    assert {response.status_code for response in responses} == {200}
+    executed = [response for response in responses if "Idempotent-Replayed" not in response.headers]
+    assert len(executed) == 1
+    assert {response.json()["id"] for response in responses} == {executed[0].json()["id"]}
+    assert _balance(client, user_headers) == 475
+
+def test_response_is_committed_with_the_key(client, user_headers):
+    headers = {**user_headers, "Idempotency-Key": "committed"}
+    first = client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers)
+
+    stored = idempotency._load((client.get("/api/users/me", headers=user_headers).json()["id"], "account-transactions", "committed"))
+    assert stored.response == first.text
+
+def test_key_reuse_with_other_body_is_rejected(client, user_headers):
+    headers = {**user_headers, "Idempotency-Key": "reuse"}
+    assert client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers).status_code == 200
+    response = client.post("/api/account-transactions", json={**WITHDRAWAL, "amount": 30}, headers=headers)
+
+    assert response.status_code == 422
+    assert _balance(client, user_headers) == 475
+
+def test_failed_request_does_not_keep_key(client, user_headers):
+    headers = {**user_headers, "Idempotency-Key": "overdraft"}
+    response = client.post("/api/account-transactions", json={"amount": 1000, "type": "withdrawal"}, headers=headers)
+    assert response.status_code == 400
+
+    client.post("/api/account-transactions", json={"amount": 1000, "type": "deposit"}, headers=user_headers)
+    response = client.post("/api/account-transactions", json={"amount": 1000, "type": "withdrawal"}, headers=headers)
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+
+def test_expired_keys_are_pruned(client, user_headers, monkeypatch):
+    headers = {**user_headers, "Idempotency-Key": "expired"}
+    assert client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers).status_code == 200
+
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_TTL_SECONDS", -1)
+    assert idempotency.prune_keys() >= 1
+    response = client.post("/api/account-transactions", json=WITHDRAWAL, headers=headers)
+    assert "Idempotent-Replayed" not in response.headers
+    assert _balance(client, user_headers) == 450
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ledger
+from database import WriteSessionLocal
+
+def test_concurrent_withdrawals_never_overdraw(client, user_headers):
+    # 30 withdrawals of 25 race for a balance of 500: 20 of them fit
+    def withdraw(_):
+        return client.post("/api/account-transactions", json={"amount": 25, "type": "withdrawal"}, headers=user_headers)
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        responses = list(pool.map(withdraw, range(30)))
+
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == 20
+    assert statuses.count(400) == 10
+    assert all(response.json()["detail"] == "Insufficient balance" for response in responses if response.status_code == 400)
+    assert client.get("/api/users/me", headers=user_headers).json()["current_balance"] == 0
+    assert ledger.reconcile_ledgers()["mismatches"] == []
+
+def test_guarded_debit_below_minimum_raises(client, user_headers):
+    user_id = client.get("/api/users/me", headers=user_headers).json()["id"]
+    db = WriteSessionLocal()
+    try:
+        with pytest.raises(ledger.InsufficientBalanceError):
+            ledger.post_entry(db, user_id, -ledger.to_paise(500.01), "withdrawal", min_balance_paise=0)
+        db.rollback()
+        assert ledger.post_entry(db, user_id, -ledger.to_paise(500), "withdrawal", min_balance_paise=0) == 0
+        db.rollback()
+    finally:
+        db.close()
@@ -0,0 +1,83 @@
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+import notification_writer
+import schemas
+
+def _notification(message):
+    return schemas.NotificationCreate(message=message, type=schemas.NotificationType.GENERAL)
+
+@pytest.fixture
+def written(monkeypatch, tmp_path):
+    """Rows written by a fresh writer thread whose inserts fail for "poison" messages"""
+    rows = []
+
+    def write_notifications(batch):
+        if any(row["message"] == "poison" for row in batch):
+            raise ValueError("bad row")
+        rows.extend(batch)
+
+    was_running = notification_writer._thread is not None
+    notification_writer.stop()
+    monkeypatch.setattr(notification_writer, "write_notifications", write_notifications)
+    monkeypatch.setattr(notification_writer, "RETRY_DELAY_SECONDS", 0)
+    monkeypatch.setattr(notification_writer, "NOTIFICATION_DEAD_LETTER_FILE", str(tmp_path / "dead.ndjson"))
+    notification_writer.start()
+    yield rows
+    notification_writer.stop()
+    if was_running:
+        notification_writer.start()
+
+def test_poison_row_is_dead_lettered(written, tmp_path):
+    for message in ("first", "poison", "last"):
+        notification_writer.enqueue(1, _notification(message))
+    notification_writer.stop(timeout=5)
+
+    assert [row["message"] for row in written] == ["first", "last"]
+    dead = [json.loads(line) for line in open(tmp_path / "dead.ndjson")]
+    assert [(row["message"], row["error"]) for row in dead] == [("poison", "bad row")]
+
+def test_full_queue_writes_in_the_request(monkeypatch):
+    rows = []
+    monkeypatch.setattr(notification_writer, "write_notifications", rows.extend)
+    # A writer that has fallen behind: its queue is full and nothing takes from it
+    monkeypatch.setattr(notification_writer, "_thread", threading.Thread(target=lambda: None))
+    monkeypatch.setattr(notification_writer, "_queue", queue.Queue(maxsize=1))
+    monkeypatch.setattr(notification_writer, "NOTIFICATION_ENQUEUE_TIMEOUT_MS", 10)
+    notification_writer.enqueue(1, _notification("queued"))
+    notification_writer.enqueue(1, _notification("direct"))
+
+    assert [row["message"] for row in rows] == ["direct"]
+    assert notification_writer._queue.get_nowait()["message"] == "queued"
+
+def test_stop_gives_up_on_a_stuck_writer(written, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(notification_writer, "write_notifications", lambda batch: release.wait())
+    notification_writer.enqueue(1, _notification("stuck"))
+    time.sleep(notification_writer.NOTIFICATION_FLUSH_MS / 1000 * 2)
+
+    started = time.monotonic()
+    notification_writer.stop(timeout=0.2)
+    assert time.monotonic() - started < 1
+    release.set()
+
+def test_full_queue_fallback_does_not_retry(monkeypatch, tmp_path):
+    def write_notifications(batch):
+        raise ValueError("locked")
+
+    monkeypatch.setattr(notification_writer, "write_notifications", write_notifications)
+    monkeypatch.setattr(notification_writer, "_thread", threading.Thread(target=lambda: None))
+    monkeypatch.setattr(notification_writer, "_queue", queue.Queue(maxsize=1))
+    monkeypatch.setattr(notification_writer, "NOTIFICATION_ENQUEUE_TIMEOUT_MS", 10)
+    monkeypatch.setattr(notification_writer, "NOTIFICATION_DEAD_LETTER_FILE", str(tmp_path / "dead.ndjson"))
+    notification_writer._queue.put_nowait({})
+
+    started = time.monotonic()
+    notification_writer.enqueue(1, _notification("direct"))
+    assert time.monotonic() - started < notification_writer.RETRY_DELAY_SECONDS
+    dead = [json.loads(line) for line in open(tmp_path / "dead.ndjson")]
+    assert [(row["message"], row["error"]) for row in dead] == [("direct", "locked")]
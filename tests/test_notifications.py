@@ -0,0 +1,15 @@
+import uuid
+
+import models
+from database import SessionLocal
+
+def test_unread_count_does_not_write(client):
+    email = f"{uuid.uuid4().hex}@example.com"
+    user_id = client.post("/api/users", json={"email": email, "name": "Test", "password": "pw"}).json()["id"]
+    token = client.post("/api/token", data={"username": email, "password": "pw"}).json()["access_token"]
+
+    response = client.get("/api/notifications/unread-count", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.json() == {"unread_count": 0}
+    with SessionLocal() as db:
+        assert db.query(models.NotificationCounter).filter(models.NotificationCounter.user_id == user_id).first() is None
@@ -0,0 +1,31 @@
+import io
+import json
+
+import models
+import plaza_import
+from database import SessionLocal
+
+def _ndjson(*rows):
+    return io.BytesIO("\n".join(json.dumps(row) for row in rows).encode())
+
+def _plaza(name, **fields):
+    return {"name": name, "location": "12.9,77.5", "address": "Road", "base_price": 40, **fields}
+
+def test_ids_only_update_existing_plazas(client):
+    assert plaza_import.import_toll_plazas(_ndjson(_plaza("Import A")), "ndjson")["inserted"] == 1
+    with SessionLocal() as db:
+        plaza_id = db.query(models.TollPlaza.id).filter(models.TollPlaza.name == "Import A").scalar()
+
+    result = plaza_import.import_toll_plazas(_ndjson(
+        _plaza("Import A renamed", id=plaza_id, base_price=55),
+        _plaza("Unknown", id=10 ** 12),
+        _plaza("Negative", id=-4),
+        _plaza("Import B")
+    ), "ndjson")
+
+    assert (result["inserted"], result["updated"], result["invalid"]) == (1, 1, 2)
+    assert [error["line"] for error in result["errors"]] == [2, 3]
+    with SessionLocal() as db:
+        assert db.get(models.TollPlaza, plaza_id).base_price == 55
+        assert db.get(models.TollPlaza, 10 ** 12) is None
+        assert db.query(models.TollPlaza).filter(models.TollPlaza.name.in_(["Unknown", "Negative"])).count() == 0
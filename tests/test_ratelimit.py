@@ -0,0 +1,81 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+import ratelimit
+
+def _limits(capacity, seconds=1000000):
+    return {name: (capacity, capacity / seconds) for name in ("auth", "maps", "public", "write", "ip", "user")}
+
+def _app(backend, capacity):
+    async def ok(request):
+        return PlainTextResponse("ok")
+    app = Starlette(routes=[Route("/", ok)])
+    return ratelimit.RateLimitMiddleware(app, backend=backend, limits=_limits(capacity))
+
+async def _flood(app, requests):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(*(client.get("/") for _ in range(requests)))
+    return [response.status_code for response in responses]
+
+def test_shared_budget_holds_under_flood(tmp_path):
+    # Two stores on one file stand for two workers sharing the budget
+    path = str(tmp_path / "ratelimit.db")
+    backends = [ratelimit.SQLiteBackend(path), ratelimit.SQLiteBackend(path)]
+
+    def take(index):
+        return backends[index % 2].take("ip:flood", 100, 100 / 1000000, time.time())
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(take, range(1000)))
+
+    assert sum(1 for retry_after in results if retry_after == 0) == 100
+
+def test_locked_store_fails_open(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    backend = ratelimit.SQLiteBackend(path, timeout_ms=50)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN EXCLUSIVE")
+    try:
+        started = time.monotonic()
+        assert backend.take("ip:locked", 1, 1 / 1000000, time.time()) == 0
+        assert time.monotonic() - started < 1
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+
+def test_idle_buckets_are_pruned(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    backend = ratelimit.SQLiteBackend(path, prune_seconds=0)
+    backend.take("ip:idle", 10, 1, 1000.0)
+    backend.take("ip:active", 10, 1, 1000.0 + ratelimit.BUCKET_IDLE_SECONDS + 1)
+
+    keys = [key for key, in sqlite3.connect(path).execute("SELECT key FROM rate_limit_buckets")]
+    assert keys == ["ip:active"]
+
+def test_middleware_rejects_flood_with_429(tmp_path):
+    app = _app(ratelimit.SQLiteBackend(str(tmp_path / "ratelimit.db")), 20)
+    statuses = asyncio.run(_flood(app, 200))
+
+    assert statuses.count(200) == 20
+    assert statuses.count(429) == 180
+
+def test_middleware_lets_requests_through_when_store_is_locked(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    app = _app(ratelimit.SQLiteBackend(path, timeout_ms=20), 1)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN EXCLUSIVE")
+    try:
+        statuses = asyncio.run(_flood(app, 20))
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+
+    assert statuses == [200] * 20
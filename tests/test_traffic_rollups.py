@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+import pytest
+
+import models
+import traffic_rollups
+from database import SessionLocal, engine
+from utils import ist_now
+
+def _plaza_with_samples(count):
+    with SessionLocal() as db:
+        plaza = models.TollPlaza(name="Rollup plaza", location="12.9,77.5", address="Road", base_price=40, current_price=40)
+        db.add(plaza)
+        db.commit()
+        plaza_id = plaza.id
+    start = ist_now().replace(second=0, microsecond=0) - timedelta(minutes=30)
+    with engine.begin() as conn:
+        conn.execute(models.TrafficData.__table__.insert(), [
+            {"toll_plaza_id": plaza_id, "timestamp": start + timedelta(milliseconds=index), "vehicle_count": 10,
+             "average_wait_time": 2, "price_multiplier": 1.0}
+            for index in range(count)
+        ])
+    return plaza_id, start
+
+def test_raw_series_is_not_truncated(client, monkeypatch):
+    monkeypatch.setattr(traffic_rollups, "TRAFFIC_MAX_POINTS", 5)
+    plaza_id, start = _plaza_with_samples(6)
+    traffic_rollups.rollup_traffic()
+    end = start + timedelta(minutes=10)
+
+    with SessionLocal() as db:
+        with pytest.raises(ValueError):
+            traffic_rollups.get_traffic_series(db, plaza_id, start, end, resolution=traffic_rollups.RAW)
+        series = traffic_rollups.get_traffic_series(db, plaza_id, start, end)
+
+    assert series["resolution"] == "1m"
+    assert [point["samples"] for point in series["points"]] == [6]
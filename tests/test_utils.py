@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, select
+
+import models
+from utils import IST, format_ist_timestamp, ist_now, to_ist_naive
+
+def test_aware_timestamps_convert_to_ist_wall_clock():
+    assert to_ist_naive(datetime(2024, 1, 31, 20, 0, tzinfo=timezone.utc)) == datetime(2024, 2, 1, 1, 30)
+    assert to_ist_naive(datetime(2024, 1, 1, 9, 0, tzinfo=timezone(timedelta(hours=-5)))) == datetime(2024, 1, 1, 19, 30)
+
+def test_naive_timestamps_are_taken_as_ist():
+    assert to_ist_naive(datetime(2024, 1, 1, 12, 0)) == datetime(2024, 1, 1, 12, 0)
+
+def test_format_assumes_utc_for_naive_timestamps():
+    assert format_ist_timestamp(datetime(2024, 1, 1, 0, 0)) == "2024-01-01 05:30:00 IST"
+
+def test_ist_now_is_naive_ist():
+    now = ist_now()
+    assert now.tzinfo is None
+    assert abs(datetime.now(IST).replace(tzinfo=None) - now) < timedelta(seconds=2)
+
+def test_columns_store_aware_values_as_ist(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tz.db'}")
+    table = models.Transaction.__table__
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert(), {"id": 1, "reference_id": "tz", "timestamp": datetime(2024, 3, 1, 0, 0, tzinfo=timezone.utc)})
+        # Ranges with an offset are compared on the same clock
+        stored = conn.execute(select(table.c.timestamp).where(table.c.timestamp >= datetime(2024, 3, 1, 5, 0, tzinfo=IST))).scalar()
+
+    assert stored == datetime(2024, 3, 1, 5, 30)
@@ -0,0 +1,273 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func, cast, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import crud
+import models
+from database import engine
+from utils import ist_now
+
+# Raw samples are rolled up every TRAFFIC_ROLLUP_INTERVAL_SECONDS
+TRAFFIC_ROLLUP_INTERVAL_SECONDS = int(os.getenv("TRAFFIC_ROLLUP_INTERVAL_SECONDS", "60"))
+
+# Raw samples rolled up per transaction, so that a large backlog does not hold
+# the write lock for long
+TRAFFIC_ROLLUP_BATCH = int(os.getenv("TRAFFIC_ROLLUP_BATCH", "50000"))
+
+# Days of data kept at each resolution (0 = forever)
+TRAFFIC_RAW_RETENTION_DAYS = int(os.getenv("TRAFFIC_RAW_RETENTION_DAYS", "7"))
+TRAFFIC_MINUTE_RETENTION_DAYS = int(os.getenv("TRAFFIC_MINUTE_RETENTION_DAYS", "30"))
+TRAFFIC_HOUR_RETENTION_DAYS = int(os.getenv("TRAFFIC_HOUR_RETENTION_DAYS", "400"))
+TRAFFIC_DAY_RETENTION_DAYS = int(os.getenv("TRAFFIC_DAY_RETENTION_DAYS", "0"))
+
+# Most points a traffic query returns. The finest resolution that fits is used.
+TRAFFIC_MAX_POINTS = int(os.getenv("TRAFFIC_MAX_POINTS", "1500"))
+
+# Raw samples are only served for ranges up to this many minutes
+TRAFFIC_RAW_MAX_MINUTES = int(os.getenv("TRAFFIC_RAW_MAX_MINUTES", "60"))
+
+RAW = "raw"
+
+# Rollup resolutions: name, bucket size in seconds and retention in days,
+# finest first
+RESOLUTIONS = [
+    ("1m", 60, TRAFFIC_MINUTE_RETENTION_DAYS),
+    ("1h", 3600, TRAFFIC_HOUR_RETENTION_DAYS),
+    ("1d", 86400, TRAFFIC_DAY_RETENTION_DAYS),
+]
+RESOLUTION_SECONDS = {name: seconds for name, seconds, _ in RESOLUTIONS}
+
+WATERMARK = "traffic_rollups"
+
+# Timestamps are IST wall clock times; strftime('%s') reads them as UTC, so
+# buckets are aligned to IST minutes, hours and days
+_EPOCH = datetime(1970, 1, 1)
+
+def _get_watermark(conn):
+    value = conn.execute(
+        select(models.JobWatermark.value).where(models.JobWatermark.name == WATERMARK)
+    ).scalar()
+    return value or 0
+
+def _set_watermark(conn, value):
+    table = models.JobWatermark.__table__
+    stmt = sqlite_insert(table).values(name=WATERMARK, value=value)
+    conn.execute(stmt.on_conflict_do_update(index_elements=[table.c.name], set_={"value": value}))
+
+def _rollup_range(conn, after_id, upto_id):
+    raw = models.TrafficData.__table__
+    aggregates = models.TrafficAggregate.__table__
+    rolled_up = 0
+    for _, seconds, _ in RESOLUTIONS:
+        bucket = cast(func.strftime("%s", raw.c.timestamp), Integer) // seconds
+        rows = conn.execute(
+            select(
+                raw.c.toll_plaza_id,
+                bucket,
+                func.count(),
+                func.min(raw.c.vehicle_count),
+                func.max(raw.c.vehicle_count),
+                func.sum(raw.c.vehicle_count),
+                func.sum(raw.c.average_wait_time),
+                func.sum(raw.c.price_multiplier)
+            ).where(
+                raw.c.id > after_id,
+                raw.c.id <= upto_id
+            ).group_by(raw.c.toll_plaza_id, bucket)
+        ).all()
+        if not rows:
+            return 0
+        rolled_up = sum(row[2] for row in rows)
+
+        # Samples that arrive late land in buckets that already exist, so
+        # buckets are merged rather than replaced
+        stmt = sqlite_insert(aggregates)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[aggregates.c.toll_plaza_id, aggregates.c.resolution, aggregates.c.bucket],
+            set_={
+                "samples": aggregates.c.samples + stmt.excluded.samples,
+                "vehicle_count_min": func.min(aggregates.c.vehicle_count_min, stmt.excluded.vehicle_count_min),
+                "vehicle_count_max": func.max(aggregates.c.vehicle_count_max, stmt.excluded.vehicle_count_max),
+                "vehicle_count_sum": aggregates.c.vehicle_count_sum + stmt.excluded.vehicle_count_sum,
+                "wait_sum": aggregates.c.wait_sum + stmt.excluded.wait_sum,
+                "multiplier_sum": aggregates.c.multiplier_sum + stmt.excluded.multiplier_sum
+            }
+        )
+        conn.execute(stmt, [
+            {
+                "toll_plaza_id": plaza_id,
+                "resolution": seconds,
+                "bucket": _EPOCH + timedelta(seconds=index * seconds),
+                "samples": samples,
+                "vehicle_count_min": count_min,
+                "vehicle_count_max": count_max,
+                "vehicle_count_sum": count_sum or 0,
+                "wait_sum": wait_sum or 0.0,
+                "multiplier_sum": multiplier_sum or 0.0
+            }
+            for plaza_id, index, samples, count_min, count_max, count_sum, wait_sum, multiplier_sum in rows
+        ])
+    return rolled_up
+
+def rollup_traffic():
+    """
+    Add the raw traffic samples written since the last run to the 1-minute,
+    1-hour and 1-day aggregates
+
+    Returns:
+        int: Number of raw samples rolled up
+    """
+    raw = models.TrafficData.__table__
+    rolled_up = 0
+    while True:
+        with engine.execution_options(sqlite_immediate=True).begin() as conn:
+            after_id = _get_watermark(conn)
+            last_id = conn.execute(select(func.max(raw.c.id))).scalar() or 0
+            if last_id <= after_id:
+                return rolled_up
+            upto_id = min(last_id, after_id + TRAFFIC_ROLLUP_BATCH)
+            rolled_up += _rollup_range(conn, after_id, upto_id)
+            _set_watermark(conn, upto_id)
+
+def apply_retention():
+    """
+    Delete raw samples and aggregates older than their retention window.
+    Raw samples are only deleted once they are rolled up.
+
+    Returns:
+        int: Number of rows deleted
+    """
+    now = ist_now()
+    raw = models.TrafficData.__table__
+    aggregates = models.TrafficAggregate.__table__
+    deleted = 0
+    with engine.execution_options(sqlite_immediate=True).begin() as conn:
+        if TRAFFIC_RAW_RETENTION_DAYS > 0:
+            # The last rolled up row is kept: SQLite hands out ids after the
+            # largest one left, so new samples always stay above the watermark
+            deleted += conn.execute(delete(raw).where(
+                raw.c.timestamp < now - timedelta(days=TRAFFIC_RAW_RETENTION_DAYS),
+                raw.c.id < _get_watermark(conn)
+            )).rowcount
+        for _, seconds, retention_days in RESOLUTIONS:
+            if retention_days > 0:
+                deleted += conn.execute(delete(aggregates).where(
+                    aggregates.c.resolution == seconds,
+                    aggregates.c.bucket < now - timedelta(days=retention_days)
+                )).rowcount
+    return deleted
+
+def run_traffic_rollups():
+    """Roll up new traffic samples, then drop data past its retention"""
+    rolled_up = rollup_traffic()
+    deleted = apply_retention()
+    return {"rolled_up": rolled_up, "deleted": deleted}
+
+def _covers(retention_days, start, now):
+    return retention_days == 0 or start >= now - timedelta(days=retention_days)
+
+def choose_resolution(start, end, now=None):
+    """
+    Pick the finest resolution that still holds data from ``start`` and
+    returns at most TRAFFIC_MAX_POINTS points for ``[start, end)``
+
+    Returns:
+        str: "raw", "1m", "1h" or "1d"
+    """
+    now = now or ist_now()
+    seconds_in_range = (end - start).total_seconds()
+    if seconds_in_range <= TRAFFIC_RAW_MAX_MINUTES * 60 and _covers(TRAFFIC_RAW_RETENTION_DAYS, start, now):
+        return RAW
+    for name, seconds, retention_days in RESOLUTIONS:
+        if seconds_in_range / seconds <= TRAFFIC_MAX_POINTS and _covers(retention_days, start, now):
+            return name
+    return RESOLUTIONS[-1][0]
+
+def get_traffic_series(db: Session, toll_plaza_id: int, start, end, resolution=None):
+    """
+    Return the traffic of a plaza in ``[start, end)`` at the given resolution,
+    or at the one picked by choose_resolution
+
+    Args:
+        db (Session): Database session
+        toll_plaza_id (int): Toll plaza
+        start (datetime): Start of the range (IST)
+        end (datetime): End of the range (IST)
+        resolution (str): "raw", "1m", "1h", "1d" or None for automatic; an
+            automatic raw series with more than TRAFFIC_MAX_POINTS samples is
+            read from the 1m rollup instead
+
+    Returns:
+        dict: Resolution used and the points of the series
+
+    Raises:
+        ValueError: Unknown resolution or more points than TRAFFIC_MAX_POINTS
+    """
+    seconds_in_range = (end - start).total_seconds()
+    automatic = resolution is None
+    if automatic:
+        resolution = choose_resolution(start, end)
+    elif resolution == RAW:
+        if seconds_in_range > TRAFFIC_RAW_MAX_MINUTES * 60:
+            raise ValueError(f"Raw samples are only available for ranges up to {TRAFFIC_RAW_MAX_MINUTES} minutes")
+    else:
+        seconds = RESOLUTION_SECONDS.get(resolution)
+        if seconds is None:
+            raise ValueError(f"Unknown resolution {resolution}")
+        if seconds_in_range / seconds > TRAFFIC_MAX_POINTS:
+            raise ValueError(f"Range too large for resolution {resolution} (more than {TRAFFIC_MAX_POINTS} points)")
+
+    if resolution == RAW:
+        # One more sample than allowed tells a full range from a truncated one
+        samples = crud.get_traffic_data_by_toll_plaza(db, toll_plaza_id, start, end, limit=TRAFFIC_MAX_POINTS + 1)
+        if len(samples) > TRAFFIC_MAX_POINTS:
+            if not automatic:
+                raise ValueError(f"Range too large for resolution {RAW} (more than {TRAFFIC_MAX_POINTS} points)")
+            resolution = RESOLUTIONS[0][0]
+
+    if resolution == RAW:
+        points = [
+            {
+                "timestamp": sample.timestamp,
+                "samples": 1,
+                "vehicle_count_min": sample.vehicle_count,
+                "vehicle_count_max": sample.vehicle_count,
+                "vehicle_count_avg": sample.vehicle_count,
+                "average_wait_time": sample.average_wait_time,
+                "price_multiplier": sample.price_multiplier
+            }
+            for sample in samples
+        ]
+    else:
+        seconds = RESOLUTION_SECONDS[resolution]
+        # The bucket that contains ``start`` is included
+        first_bucket = _EPOCH + timedelta(seconds=int((start - _EPOCH).total_seconds()) // seconds * seconds)
+        aggregates = db.query(models.TrafficAggregate).filter(
+            models.TrafficAggregate.toll_plaza_id == toll_plaza_id,
+            models.TrafficAggregate.resolution == seconds,
+            models.TrafficAggregate.bucket >= first_bucket,
+            models.TrafficAggregate.bucket < end
+        ).order_by(models.TrafficAggregate.bucket).all()
+        points = [
+            {
+                "timestamp": aggregate.bucket,
+                "samples": aggregate.samples,
+                "vehicle_count_min": aggregate.vehicle_count_min,
+                "vehicle_count_max": aggregate.vehicle_count_max,
+                "vehicle_count_avg": aggregate.vehicle_count_sum / aggregate.samples,
+                "average_wait_time": aggregate.wait_sum / aggregate.samples,
+                "price_multiplier": aggregate.multiplier_sum / aggregate.samples
+            }
+            for aggregate in aggregates
+        ]
+
+    return {
+        "toll_plaza_id": toll_plaza_id,
+        "resolution": resolution,
+        "start": start,
+        "end": end,
+        "points": points
+    }
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from collections import deque
+
+from sqlalchemy import bindparam, update
+
+import models
+from database import engine
+from utils import ist_now
+
+logger = logging.getLogger(__name__)
+
+# Buffered samples are written every TRAFFIC_FLUSH_MS milliseconds
+TRAFFIC_FLUSH_MS = int(os.getenv("TRAFFIC_FLUSH_MS", "1000"))
+
+# Samples kept per plaza between two flushes. When a plaza's buffer is full
+# its oldest samples are dropped, so memory stays bounded when the database
+# falls behind.
+TRAFFIC_BUFFER_SIZE = int(os.getenv("TRAFFIC_BUFFER_SIZE", "10000"))
+
+# plaza id -> ring buffer of sample rows. deque.append and popleft are atomic,
+# so request threads and the flusher share the buffers without a lock.
+_buffers = {}
+
+# Rows drained by a flush whose write failed, retried by the next one
+_pending = []
+
+_flush_lock = threading.Lock()
+_stop = threading.Event()
+_thread = None
+
+def enqueue(samples):
+    """
+    Buffer traffic samples for the background flusher
+
+    Samples are timestamped on arrival. When the flusher is not running
+    (scripts, tests) they are written right away.
+
+    Args:
+        samples (list): TrafficDataCreate samples of existing plazas
+
+    Returns:
+        int: Number of older buffered samples dropped to make room
+    """
+    now = ist_now()
+    dropped = 0
+    for sample in samples:
+        buffer = _buffers.get(sample.toll_plaza_id)
+        if buffer is None:
+            buffer = _buffers.setdefault(sample.toll_plaza_id, deque(maxlen=TRAFFIC_BUFFER_SIZE))
+        # Approximate under concurrency; only reported to the caller
+        if len(buffer) == buffer.maxlen:
+            dropped += 1
+        buffer.append({
+            "toll_plaza_id": sample.toll_plaza_id,
+            "timestamp": now,
+            "vehicle_count": sample.vehicle_count,
+            "average_wait_time": sample.average_wait_time,
+            "price_multiplier": sample.price_multiplier
+        })
+    if _thread is None:
+        flush()
+    return dropped
+
+def _drain():
+    rows = []
+    for buffer in list(_buffers.values()):
+        # Only what is there now, so that a busy plaza cannot keep the
+        # flusher in the loop
+        for _ in range(len(buffer)):
+            rows.append(buffer.popleft())
+    return rows
+
+def flush():
+    """
+    Write the buffered samples with one bulk insert and move every plaza to
+    its latest sample with one bulk update, in a single transaction
+
+    Returns:
+        int: Number of samples written
+    """
+    global _pending
+    with _flush_lock:
+        # After a failed write the same rows are retried before draining more,
+        # so at most one drain is held outside the buffers
+        rows = _pending or _drain()
+        if not rows:
+            return 0
+        _pending = rows
+
+        latest = {}
+        for row in rows:
+            current = latest.get(row["toll_plaza_id"])
+            if current is None or row["timestamp"] >= current["timestamp"]:
+                latest[row["toll_plaza_id"]] = row
+
+        plazas = models.TollPlaza.__table__
+        with engine.execution_options(sqlite_immediate=True).begin() as conn:
+            conn.execute(models.TrafficData.__table__.insert(), rows)
+            # Busy level and price follow in pricing.recompute_prices
+            conn.execute(
+                update(plazas)
+                .where(plazas.c.id == bindparam("plaza_id"))
+                .values(estimated_time=bindparam("wait"), vehicles_per_hour=bindparam("count")),
+                [
+                    {"plaza_id": plaza_id, "wait": row["average_wait_time"], "count": row["vehicle_count"]}
+                    for plaza_id, row in latest.items()
+                ]
+            )
+        _pending = []
+        return len(rows)
+
+def _run():
+    while not _stop.wait(TRAFFIC_FLUSH_MS / 1000):
+        try:
+            flush()
+        except Exception as e:
+            logger.warning("Failed to write %d traffic samples, retrying: %s", len(_pending), e)
+
+def start():
+    """Start the background flusher thread"""
+    global _thread
+    if _thread is None:
+        _stop.clear()
+        _thread = threading.Thread(target=_run, name="traffic-writer", daemon=True)
+        _thread.start()
+
+def stop():
+    """Stop the flusher thread, then write every buffered sample"""
+    global _thread
+    if _thread is not None:
+        _stop.set()
+        _thread.join()
+        _thread = None
+    flush()
@@ -1,20 +1,33 @@
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+# Timestamps are stored as naive IST wall clock times. The zone is looked up
+# once; rollup buckets, archive months and forecasts are aligned to it.
+IST = ZoneInfo("Asia/Kolkata")
 
 # Get current time in IST
 def get_ist_now():
-    """Get current time in Indian Standard Time (IST)"""
-    utc_now = datetime.utcnow()
-    ist_timezone = pytz.timezone('Asia/Kolkata')
-    return utc_now.replace(tzinfo=pytz.utc).astimezone(ist_timezone)
+    """Get current time in Indian Standard Time (IST), timezone-aware"""
+    return datetime.now(IST)
+
+# Current time as stored in the database
+def ist_now():
+    """Get current time as a naive IST wall clock time, for column defaults and queries"""
+    return datetime.now(IST).replace(tzinfo=None)
 
 # Format IST timestamp (if needed for presentation)
 def format_ist_timestamp(timestamp):
     """Format a timezone-aware timestamp to IST string format"""
     if not timestamp.tzinfo:
         # If the timestamp doesn't have timezone info, assume UTC
-        timestamp = timestamp.replace(tzinfo=pytz.utc)
-    
-    ist_timezone = pytz.timezone('Asia/Kolkata')
-    ist_time = timestamp.astimezone(ist_timezone)
-    return ist_time.strftime("%Y-%m-%d %H:%M:%S %Z") 
\ No newline at end of file
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+
+    ist_time = timestamp.astimezone(IST)
+    return ist_time.strftime("%Y-%m-%d %H:%M:%S %Z")
+
+# Naive IST time, as timestamps are stored in the database
+def to_ist_naive(timestamp):
+    """Convert a timestamp to naive IST; naive timestamps are taken as IST already"""
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(IST)
+    return timestamp.replace(tzinfo=None)